@@ -13,7 +13,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from copy import deepcopy
+from functools import partial
 from math import ceil
 
 import einops
@@ -68,146 +68,169 @@ def get_stats_einops_patterns(dataset, num_workers=0):
     return stats_patterns
 
 
-def compute_stats(dataset, batch_size=8, num_workers=8, max_num_samples=None):
-    """Compute mean/std and min/max statistics of all data keys in a LeRobotDataset."""
+def compute_batch_sufficient_stats(batch: dict, stats_patterns: dict[str, str]) -> dict[str, dict]:
+    """Compute the sufficient statistics of a batch to merge with other batches (see `merge_sufficient_stats`).
+
+    For each key, they are the number of values reduced per channel ("count"), and the "mean", the sum of the
+    squared differences to the mean ("m2"), the "min" and the "max" of these values. They are computed in float64
+    to not lose precision when merging many batches.
+    """
+    sufficient_stats = {}
+    for key, pattern in stats_patterns.items():
+        x = batch[key].type(torch.float64)
+        mean = einops.reduce(x, pattern, "mean")
+        sufficient_stats[key] = {
+            "count": torch.tensor(x.numel() // mean.numel(), dtype=torch.float64),
+            "mean": mean,
+            "m2": einops.reduce((x - mean) ** 2, pattern, "sum"),
+            "min": einops.reduce(x, pattern, "min"),
+            "max": einops.reduce(x, pattern, "max"),
+        }
+    return sufficient_stats
+
+
+def merge_sufficient_stats(stats_a: dict[str, dict], stats_b: dict[str, dict]) -> dict[str, dict]:
+    """Merge the sufficient statistics of two disjoint sets of data (e.g. two batches, or two shards).
+
+    The mean and the sum of squared differences to the mean are merged with the parallel algorithm of Chan et
+    al. (https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm):
+    - δ = mean_b - mean_a
+    - mean = mean_a + δ * n_b / n
+    - m2 = m2_a + m2_b + δ² * n_a * n_b / n
+    """
+    merged = {}
+    for key in stats_a.keys() | stats_b.keys():
+        if key not in stats_a or key not in stats_b:
+            merged[key] = stats_a.get(key, stats_b.get(key))
+            continue
+        a, b = stats_a[key], stats_b[key]
+        count = a["count"] + b["count"]
+        delta = b["mean"] - a["mean"]
+        merged[key] = {
+            "count": count,
+            "mean": a["mean"] + delta * (b["count"] / count),
+            "m2": a["m2"] + b["m2"] + delta**2 * (a["count"] * (b["count"] / count)),
+            "min": torch.minimum(a["min"], b["min"]),
+            "max": torch.maximum(a["max"], b["max"]),
+        }
+    return merged
+
+
+def sufficient_stats_to_stats(sufficient_stats: dict[str, dict]) -> dict[str, dict[str, torch.Tensor]]:
+    """Convert sufficient statistics to the mean/std/min/max float32 statistics of a dataset."""
+    stats = {}
+    for key, ss in sufficient_stats.items():
+        stats[key] = {
+            "mean": ss["mean"].type(torch.float32),
+            "std": torch.sqrt(ss["m2"] / ss["count"]).type(torch.float32),
+            "max": ss["max"].type(torch.float32),
+            "min": ss["min"].type(torch.float32),
+        }
+    return stats
+
+
+def _collate_sufficient_stats(items: list[dict], stats_patterns: dict[str, str]) -> dict[str, dict]:
+    # reduce the batches in the DataLoader workers, so that only their statistics are sent to the main process
+    return compute_batch_sufficient_stats(torch.utils.data.default_collate(items), stats_patterns)
+
+
+def compute_sufficient_stats(
+    dataset,
+    batch_size=8,
+    num_workers=8,
+    max_num_samples=None,
+    num_shards=1,
+    shard_index=0,
+    indices=None,
+) -> dict[str, dict]:
+    """Compute the sufficient statistics of all data keys in a LeRobotDataset in a single pass.
+
+    Each batch is reduced to its sufficient statistics (see `compute_batch_sufficient_stats`) by the DataLoader
+    worker which loads it, and the statistics of the batches are merged in the main process.
+
+    When `max_num_samples` is provided, the statistics are computed on a random subset of the dataset (always
+    the same one). The samples can also be split into `num_shards` shards, e.g. to compute the statistics of
+    each shard in a different process, and merge them with `merge_sufficient_stats`. Finally, `indices` can
+    restrict the statistics to some samples of the dataset, e.g. to the frames of newly recorded episodes.
+    """
+    if indices is None:
+        indices = range(len(dataset))
     if max_num_samples is None:
-        max_num_samples = len(dataset)
+        max_num_samples = len(indices)
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(
+            f"Expected 0 <= shard_index < num_shards, but {shard_index=} and {num_shards=} given."
+        )
 
     # for more info on why we need to set the same number of workers, see `load_from_videos`
     stats_patterns = get_stats_einops_patterns(dataset, num_workers)
 
-    # mean and std will be computed incrementally while max and min will track the running value.
-    mean, std, max, min = {}, {}, {}, {}
-    for key in stats_patterns:
-        mean[key] = torch.tensor(0.0).float()
-        std[key] = torch.tensor(0.0).float()
-        max[key] = torch.tensor(-float("inf")).float()
-        min[key] = torch.tensor(float("inf")).float()
-
-    def create_seeded_dataloader(dataset, batch_size, seed):
-        generator = torch.Generator()
-        generator.manual_seed(seed)
-        dataloader = torch.utils.data.DataLoader(
-            dataset,
-            num_workers=num_workers,
-            batch_size=batch_size,
-            shuffle=True,
-            drop_last=False,
-            generator=generator,
-        )
-        return dataloader
-
-    # Note: Due to be refactored soon. The point of storing `first_batch` is to make sure we don't get
-    # surprises when rerunning the sampler.
-    first_batch = None
-    running_item_count = 0  # for online mean computation
-    dataloader = create_seeded_dataloader(dataset, batch_size, seed=1337)
-    for i, batch in enumerate(
-        tqdm.tqdm(dataloader, total=ceil(max_num_samples / batch_size), desc="Compute mean, min, max")
-    ):
-        this_batch_size = len(batch["index"])
-        running_item_count += this_batch_size
-        if first_batch is None:
-            first_batch = deepcopy(batch)
-        for key, pattern in stats_patterns.items():
-            batch[key] = batch[key].float()
-            # Numerically stable update step for mean computation.
-            batch_mean = einops.reduce(batch[key], pattern, "mean")
-            # Hint: to update the mean we need x̄ₙ = (Nₙ₋₁x̄ₙ₋₁ + Bₙxₙ) / Nₙ, where the subscript represents
-            # the update step, N is the running item count, B is this batch size, x̄ is the running mean,
-            # and x is the current batch mean. Some rearrangement is then required to avoid risking
-            # numerical overflow. Another hint: Nₙ₋₁ = Nₙ - Bₙ. Rearrangement yields
-            # x̄ₙ = x̄ₙ₋₁ + Bₙ * (xₙ - x̄ₙ₋₁) / Nₙ
-            mean[key] = mean[key] + this_batch_size * (batch_mean - mean[key]) / running_item_count
-            max[key] = torch.maximum(max[key], einops.reduce(batch[key], pattern, "max"))
-            min[key] = torch.minimum(min[key], einops.reduce(batch[key], pattern, "min"))
-
-        if i == ceil(max_num_samples / batch_size) - 1:
-            break
-
-    first_batch_ = None
-    running_item_count = 0  # for online std computation
-    dataloader = create_seeded_dataloader(dataset, batch_size, seed=1337)
-    for i, batch in enumerate(
-        tqdm.tqdm(dataloader, total=ceil(max_num_samples / batch_size), desc="Compute std")
+    generator = torch.Generator()
+    generator.manual_seed(1337)
+    indices = torch.as_tensor(indices, dtype=torch.int64)[
+        torch.randperm(len(indices), generator=generator)[:max_num_samples]
+    ]
+    indices = indices[shard_index::num_shards].tolist()
+
+    dataloader = torch.utils.data.DataLoader(
+        torch.utils.data.Subset(dataset, indices),
+        num_workers=num_workers,
+        batch_size=batch_size,
+        shuffle=False,
+        drop_last=False,
+        collate_fn=partial(_collate_sufficient_stats, stats_patterns=stats_patterns),
+    )
+    sufficient_stats = {}
+    for batch_sufficient_stats in tqdm.tqdm(
+        dataloader, total=ceil(len(indices) / batch_size), desc="Compute mean, std, min, max"
     ):
-        this_batch_size = len(batch["index"])
-        running_item_count += this_batch_size
-        # Sanity check to make sure the batches are still in the same order as before.
-        if first_batch_ is None:
-            first_batch_ = deepcopy(batch)
-            for key in stats_patterns:
-                assert torch.equal(first_batch_[key], first_batch[key])
-        for key, pattern in stats_patterns.items():
-            batch[key] = batch[key].float()
-            # Numerically stable update step for mean computation (where the mean is over squared
-            # residuals).See notes in the mean computation loop above.
-            batch_std = einops.reduce((batch[key] - mean[key]) ** 2, pattern, "mean")
-            std[key] = std[key] + this_batch_size * (batch_std - std[key]) / running_item_count
-
-        if i == ceil(max_num_samples / batch_size) - 1:
-            break
-
-    for key in stats_patterns:
-        std[key] = torch.sqrt(std[key])
+        sufficient_stats = merge_sufficient_stats(sufficient_stats, batch_sufficient_stats)
+    return sufficient_stats
 
-    stats = {}
-    for key in stats_patterns:
-        stats[key] = {
-            "mean": mean[key],
-            "std": std[key],
-            "max": max[key],
-            "min": min[key],
+
+def compute_stats(dataset, batch_size=8, num_workers=8, max_num_samples=None):
+    """Compute mean/std and min/max statistics of all data keys in a LeRobotDataset.
+
+    The statistics are computed in a single pass over the data (see `compute_sufficient_stats`).
+    """
+    sufficient_stats = compute_sufficient_stats(dataset, batch_size, num_workers, max_num_samples)
+    return sufficient_stats_to_stats(sufficient_stats)
+
+
+def stats_to_sufficient_stats(stats: dict[str, dict], num_samples: int) -> dict[str, dict]:
+    """Convert the mean/std/min/max statistics of `num_samples` samples to sufficient statistics to merge them.
+
+    The "count" of the sufficient statistics is the number of samples rather than the number of values reduced
+    per channel, which gives the same result when merged with statistics of samples of the same shape.
+    """
+    sufficient_stats = {}
+    for key, key_stats in stats.items():
+        count = torch.tensor(num_samples, dtype=torch.float64)
+        sufficient_stats[key] = {
+            "count": count,
+            "mean": key_stats["mean"].type(torch.float64),
+            "m2": key_stats["std"].type(torch.float64) ** 2 * count,
+            "min": key_stats["min"].type(torch.float64),
+            "max": key_stats["max"].type(torch.float64),
         }
-    return stats
+    return sufficient_stats
 
 
 def aggregate_stats(ls_datasets) -> dict[str, torch.Tensor]:
     """Aggregate stats of multiple LeRobot datasets into one set of stats without recomputing from scratch.
 
-    The final stats will have the union of all data keys from each of the datasets.
-
     The final stats will have the union of all data keys from each of the datasets. For instance:
     - new_max = max(max_dataset_0, max_dataset_1, ...)
     - new_min = min(min_dataset_0, min_dataset_1, ...)
     - new_mean = (mean of all data)
     - new_std = (std of all data)
+
+    The mean and std are merged with the same algorithm as the batches in `compute_stats` (see
+    `merge_sufficient_stats`).
     """
-    data_keys = set()
+    sufficient_stats = {}
     for dataset in ls_datasets:
-        data_keys.update(dataset.stats.keys())
-    stats = {k: {} for k in data_keys}
-    for data_key in data_keys:
-        for stat_key in ["min", "max"]:
-            # compute `max(dataset_0["max"], dataset_1["max"], ...)`
-            stats[data_key][stat_key] = einops.reduce(
-                torch.stack([d.stats[data_key][stat_key] for d in ls_datasets if data_key in d.stats], dim=0),
-                "n ... -> ...",
-                stat_key,
-            )
-        total_samples = sum(d.num_samples for d in ls_datasets if data_key in d.stats)
-        # Compute the "sum" statistic by multiplying each mean by the number of samples in the respective
-        # dataset, then divide by total_samples to get the overall "mean".
-        # NOTE: the brackets around (d.num_samples / total_samples) are needed tor minimize the risk of
-        # numerical overflow!
-        stats[data_key]["mean"] = sum(
-            d.stats[data_key]["mean"] * (d.num_samples / total_samples)
-            for d in ls_datasets
-            if data_key in d.stats
+        sufficient_stats = merge_sufficient_stats(
+            sufficient_stats, stats_to_sufficient_stats(dataset.stats, dataset.num_samples)
         )
-        # The derivation for standard deviation is a little more involved but is much in the same spirit as
-        # the computation of the mean.
-        # Given two sets of data where the statistics are known:
-        # σ_combined = sqrt[ (n1 * (σ1^2 + d1^2) + n2 * (σ2^2 + d2^2)) / (n1 + n2) ]
-        # where d1 = μ1 - μ_combined, d2 = μ2 - μ_combined
-        # NOTE: the brackets around (d.num_samples / total_samples) are needed tor minimize the risk of
-        # numerical overflow!
-        stats[data_key]["std"] = torch.sqrt(
-            sum(
-                (d.stats[data_key]["std"] ** 2 + (d.stats[data_key]["mean"] - stats[data_key]["mean"]) ** 2)
-                * (d.num_samples / total_samples)
-                for d in ls_datasets
-                if data_key in d.stats
-            )
-        )
-    return stats
+    return sufficient_stats_to_stats(sufficient_stats)
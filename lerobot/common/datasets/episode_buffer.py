@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Storage of the episodes recorded with `populate_dataset.py`.
+
+The values of the frames of the episode being recorded are appended to preallocated numpy buffers, one per key,
+whose capacity is doubled when they are full (see `EpisodeBuffer`). When the episode is saved, its columns are
+written to an Arrow file of the episodes directory, with the features of the final dataset:
+```
+episodes
+├── data_recording_info.json
+├── episode_0.arrow
+├── episode_1.arrow
+├── ...
+```
+The episode files are not modified once written. At the end of the recording, they are memory-mapped and
+concatenated into the dataset (see `load_episodes`), without loading all the episodes in memory.
+"""
+
+from pathlib import Path
+
+import datasets
+import numpy as np
+import pyarrow as pa
+import torch
+from datasets import Features, Image, Sequence, Value
+
+from lerobot.common.datasets.video_utils import VideoFrame
+
+
+class EpisodeBuffer:
+    """Columns of the frames of the episode being recorded, in preallocated numpy buffers.
+
+    Args:
+        initial_capacity: Number of frames the buffers are allocated for. The capacity of the buffers is doubled
+            when they are full.
+    """
+
+    def __init__(self, initial_capacity: int = 1024):
+        if initial_capacity < 1:
+            raise ValueError(f"`initial_capacity` should be at least 1, but {initial_capacity=} given.")
+        self.capacity = initial_capacity
+        self.num_frames = 0
+        self._buffers = {}
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    def append(self, frame: dict[str, torch.Tensor | np.ndarray | int | float | bool]):
+        """Appends the values of a frame (tensors or scalars). All the frames have the same keys."""
+        if self.num_frames == 0:
+            for key, value in frame.items():
+                value = np.asarray(value)
+                self._buffers[key] = np.empty((self.capacity, *value.shape), dtype=value.dtype)
+        elif frame.keys() != self._buffers.keys():
+            raise ValueError(
+                f"The keys of the frame ({list(frame)}) aren't the ones of the episode ({list(self._buffers)})."
+            )
+
+        if self.num_frames == self.capacity:
+            self.capacity *= 2
+            for key, buffer in self._buffers.items():
+                grown_buffer = np.empty((self.capacity, *buffer.shape[1:]), dtype=buffer.dtype)
+                grown_buffer[: self.num_frames] = buffer
+                self._buffers[key] = grown_buffer
+
+        for key, value in frame.items():
+            self._buffers[key][self.num_frames] = value
+        self.num_frames += 1
+
+    @property
+    def columns(self) -> dict[str, np.ndarray]:
+        """Values of the frames appended so far, by key (views of the buffers)."""
+        return {key: buffer[: self.num_frames] for key, buffer in self._buffers.items()}
+
+
+def get_episode_features(columns: dict[str, np.ndarray], image_keys: list[str], video: bool) -> Features:
+    """Returns the features of the dataset of the recorded episodes: the images (`VideoFrame` or `Image`) first,
+    then the other columns (`Value` or `Sequence` of values), in the same order as `to_hf_dataset`."""
+    features = {key: VideoFrame() if video else Image() for key in image_keys}
+    for key, column in columns.items():
+        if column.ndim == 1:
+            features[key] = Value(dtype=str(column.dtype), id=None)
+        elif column.ndim == 2:
+            features[key] = Sequence(length=column.shape[1], feature=Value(dtype=str(column.dtype), id=None))
+        else:
+            raise ValueError(
+                f"Only scalars and vectors can be recorded, but {key} has shape {column.shape[1:]}."
+            )
+    return Features(features)
+
+
+def episode_to_table(columns: dict[str, np.ndarray], image_columns: dict[str, list], video: bool) -> pa.Table:
+    """Converts the columns of an episode into an Arrow table with the features of the dataset (see
+    `get_episode_features`).
+
+    The `image_columns` contain the frames of the images, as `{"path": ..., "timestamp": ...}` dictionaries
+    when `video` is True, or as paths of png images otherwise.
+    """
+    features = get_episode_features(columns, list(image_columns), video)
+    arrays = []
+    for key, feature in features.items():
+        if key in image_columns:
+            values = (
+                image_columns[key]
+                if video
+                else [{"bytes": None, "path": path} for path in image_columns[key]]
+            )
+            arrays.append(pa.array(values, type=feature.pa_type))
+        elif isinstance(feature, Sequence):
+            column = np.ascontiguousarray(columns[key])
+            arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(column.reshape(-1)), column.shape[1]))
+        else:
+            arrays.append(pa.array(columns[key]))
+    return pa.Table.from_arrays(arrays, schema=features.arrow_schema)
+
+
+def write_episode_table(table: pa.Table, path: Path):
+    """Writes the table of an episode to an Arrow (stream) file, which can be memory-mapped with
+    `datasets.Dataset.from_file`."""
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    # the file is renamed once written, so that an interrupted write isn't mistaken for an episode
+    tmp_path.replace(path)
+
+
+def _legacy_episode_to_table(ep_dict: dict, video: bool) -> pa.Table:
+    # episodes saved with `torch.save` by previous versions of `save_current_episode`
+    columns = {key: value.numpy() for key, value in ep_dict.items() if torch.is_tensor(value)}
+    image_columns = {key: value for key, value in ep_dict.items() if not torch.is_tensor(value)}
+    return episode_to_table(columns, image_columns, video)
+
+
+def load_episodes(episodes_dir: Path, num_episodes: int, video: bool) -> datasets.Dataset:
+    """Concatenates the memory-mapped Arrow files of the recorded episodes, and adds their "index" column.
+
+    The episodes saved as `.pth` files by previous versions are converted to Arrow files first.
+    """
+    episodes = []
+    for episode_index in range(num_episodes):
+        ep_path = Path(episodes_dir) / f"episode_{episode_index}.arrow"
+        if not ep_path.exists():
+            ep_dict = torch.load(ep_path.with_suffix(".pth"))
+            write_episode_table(_legacy_episode_to_table(ep_dict, video), ep_path)
+        episodes.append(datasets.Dataset.from_file(str(ep_path)))
+    hf_dataset = datasets.concatenate_datasets(episodes)
+    return hf_dataset.add_column("index", np.arange(len(hf_dataset), dtype=np.int64))
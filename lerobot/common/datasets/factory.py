@@ -90,6 +90,13 @@ def make_dataset(cfg, split: str = "train") -> LeRobotDataset | MultiLeRobotData
             random_order=cfg_tf.random_order,
         )
 
+    frame_cache_resolutions = None
+    if cfg.get("frame_cache") is not None:
+        # cache the video frames at the resolution of the inputs of the policy
+        frame_cache_resolutions = {
+            key: tuple(shape[1:]) for key, shape in cfg.policy.input_shapes.items() if len(shape) == 3
+        }
+
     if isinstance(cfg.dataset_repo_id, str):
         dataset = LeRobotDataset(
             cfg.dataset_repo_id,
@@ -97,6 +104,11 @@ def make_dataset(cfg, split: str = "train") -> LeRobotDataset | MultiLeRobotData
             delta_timestamps=cfg.training.get("delta_timestamps"),
             image_transforms=image_transforms,
             video_backend=cfg.video_backend,
+            frame_cache=cfg.get("frame_cache"),
+            frame_cache_resolutions=frame_cache_resolutions,
+            image_dtype=getattr(torch, cfg.get("image_dtype", "float32")),
+            storage=cfg.get("dataset_storage", "arrow"),
+            image_cache=cfg.get("image_cache"),
         )
     else:
         dataset = MultiLeRobotDataset(
@@ -105,6 +117,11 @@ def make_dataset(cfg, split: str = "train") -> LeRobotDataset | MultiLeRobotData
             delta_timestamps=cfg.training.get("delta_timestamps"),
             image_transforms=image_transforms,
             video_backend=cfg.video_backend,
+            frame_cache=cfg.get("frame_cache"),
+            frame_cache_resolutions=frame_cache_resolutions,
+            image_dtype=getattr(torch, cfg.get("image_dtype", "float32")),
+            storage=cfg.get("dataset_storage", "arrow"),
+            image_cache=cfg.get("image_cache"),
         )
 
     if cfg.get("override_dataset_stats"):
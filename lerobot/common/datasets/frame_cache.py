@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cache of the decoded frames of the videos of a LeRobotDataset, stored as uint8 numpy memmaps.
+
+Decoding the same mp4 frames at every epoch is often the bottleneck of training on video datasets. The frame
+cache decodes every video once, and stores its frames (uint8, channel first, optionally resized) in one memmap
+shard per video, next to an array of the timestamps of its frames:
+```
+frame_cache
+├── frame_cache_info.json
+├── observation.image_episode_000000.frames
+├── observation.image_episode_000000.timestamps.npy
+├── ...
+```
+The frames are then read from the memmaps without decoding, with the same frame selection as
+`decode_video_frames_torchvision`.
+
+The cache is rebuilt when it doesn't match the dataset anymore, e.g. when the encoding of the videos in
+`info.json` changes, or when the requested resolutions change.
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import datasets
+import numpy as np
+import torch
+import torchvision
+
+from lerobot.common.datasets.utils import (
+    check_disk_space,
+    find_closest_timestamps,
+    make_build_dir,
+    move_build_dir,
+)
+from lerobot.common.datasets.video_utils import VideoFrame, get_video_shape
+
+FRAME_CACHE_INFO = "frame_cache_info.json"
+
+
+def get_video_paths(hf_dataset: datasets.Dataset) -> dict[str, list[str]]:
+    """Returns the paths of the videos of each `VideoFrame` key of the dataset."""
+    video_paths = {}
+    for key, feats in hf_dataset.features.items():
+        if not isinstance(feats, VideoFrame):
+            continue
+        paths = set()
+        for chunk in hf_dataset.data.column(key).chunks:
+            paths.update(chunk.field("path").unique().to_pylist())
+        video_paths[key] = sorted(paths)
+    return video_paths
+
+
+class VideoFrameCache:
+    """Decoded frames of the videos of a dataset, stored as uint8 memmaps (see module docstring).
+
+    Args:
+        cache_dir: Directory of the cache. It is created, or rebuilt if it doesn't match the dataset.
+        videos_dir: Directory of the mp4 files of the dataset (see `load_videos`).
+        hf_dataset: Dataset whose `VideoFrame` keys are cached.
+        info: Info of the dataset (see `load_info`). The cache is invalidated when the "encoding" or the "fps"
+            changes.
+        resolutions: Optional (height, width) of the cached frames of each key, e.g. the resolution of the
+            inputs of a policy. Keys which are not provided keep the resolution of the videos.
+        backend: Backend of `torchvision.io.VideoReader` used to decode the videos.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        videos_dir: Path,
+        hf_dataset: datasets.Dataset,
+        info: dict,
+        resolutions: dict[str, tuple[int, int]] | None = None,
+        backend: str = "pyav",
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.videos_dir = Path(videos_dir)
+        self.backend = backend
+        self.video_paths = get_video_paths(hf_dataset)
+        resolutions = resolutions if resolutions is not None else {}
+        self.resolutions = {
+            key: list(resolutions[key]) if key in resolutions else None for key in self.video_paths
+        }
+        self.expected_info = {
+            "encoding": info.get("encoding"),
+            "fps": info.get("fps"),
+            "resolutions": self.resolutions,
+        }
+        if not self.is_valid():
+            self.build()
+        with open(self.cache_dir / FRAME_CACHE_INFO) as f:
+            self.videos = json.load(f)["videos"]
+        self._frames = None
+
+    def is_valid(self) -> bool:
+        info_path = self.cache_dir / FRAME_CACHE_INFO
+        if not info_path.exists():
+            return False
+        with open(info_path) as f:
+            cache_info = json.load(f)
+        if any(cache_info.get(k) != v for k, v in self.expected_info.items()):
+            logging.info(f"The frame cache in {self.cache_dir} doesn't match the dataset anymore.")
+            return False
+        expected_paths = {path for paths in self.video_paths.values() for path in paths}
+        return expected_paths.issubset(cache_info["videos"])
+
+    def build(self):
+        """Decode all the videos into a temporary directory, which replaces the cache once complete (see
+        `move_build_dir`)."""
+        # since video path already contains "videos" (e.g. videos_dir="data/videos", path="videos/episode_0.mp4")
+        data_dir = self.videos_dir.parent
+
+        # check the disk space required by all the shards before decoding anything
+        shapes = {}
+        for key, paths in self.video_paths.items():
+            for path in paths:
+                num_frames, height, width = get_video_shape(data_dir / path)
+                if self.resolutions[key] is not None:
+                    height, width = self.resolutions[key]
+                shapes[path] = (num_frames, 3, height, width)
+        tmp_dir = make_build_dir(self.cache_dir)
+        check_disk_space(sum(int(np.prod(shape)) for shape in shapes.values()), tmp_dir)
+
+        logging.info(f"Decoding {len(shapes)} videos into the frame cache {self.cache_dir}")
+        videos = {}
+        for paths in self.video_paths.values():
+            for path in paths:
+                shard = Path(path).stem
+                num_frames = self._decode_video(data_dir / path, tmp_dir, shard, shapes[path])
+                videos[path] = {"shard": shard, "shape": [num_frames, *shapes[path][1:]]}
+
+        with open(tmp_dir / FRAME_CACHE_INFO, "w") as f:
+            json.dump({**self.expected_info, "videos": videos}, f, indent=4)
+        # when several processes build the cache at once, the first complete cache is used by all of them
+        move_build_dir(tmp_dir, self.cache_dir, self.is_valid)
+
+    def _decode_video(self, video_path: Path, shard_dir: Path, shard: str, shape: tuple[int, ...]) -> int:
+        frames = np.memmap(shard_dir / f"{shard}.frames", dtype=np.uint8, mode="w+", shape=shape)
+        timestamps = np.zeros(shape[0], dtype=np.float64)
+
+        torchvision.set_video_backend(self.backend)
+        reader = torchvision.io.VideoReader(str(video_path), "video")
+        num_frames = 0
+        for frame in reader:
+            if num_frames == shape[0]:
+                logging.warning(f"More frames than expected were decoded from {video_path}, ignoring them.")
+                break
+            data = frame["data"]
+            if tuple(data.shape[1:]) != shape[2:]:
+                data = torch.nn.functional.interpolate(
+                    data[None].type(torch.float32), size=shape[2:], mode="bilinear", antialias=True
+                )[0]
+                data = data.round().clamp(0, 255).type(torch.uint8)
+            frames[num_frames] = data.numpy()
+            timestamps[num_frames] = frame["pts"]
+            num_frames += 1
+        if self.backend == "pyav":
+            reader.container.close()
+
+        frames.flush()
+        np.save(shard_dir / f"{shard}.timestamps.npy", timestamps[:num_frames])
+        return num_frames
+
+    def _open_shards(self) -> dict[str, tuple[np.memmap, torch.Tensor]]:
+        frames = {}
+        for path, video in self.videos.items():
+            frames[path] = (
+                # copy-on-write mode, so that the frames can be wrapped in tensors without copy or warning
+                np.memmap(
+                    self.cache_dir / f"{video['shard']}.frames",
+                    dtype=np.uint8,
+                    mode="c",
+                    shape=tuple(video["shape"]),
+                ),
+                torch.from_numpy(np.load(self.cache_dir / f"{video['shard']}.timestamps.npy")),
+            )
+        return frames
+
+    def load(
+        self,
+        item: dict,
+        video_frame_keys: list[str],
+        tolerance_s: float,
+        image_dtype: torch.dtype = torch.float32,
+    ) -> dict:
+        """Same as `load_from_videos`, but reads the frames from the cache instead of decoding the videos."""
+        if self._frames is None:
+            self._frames = self._open_shards()
+
+        for key in video_frame_keys:
+            frames = item[key] if isinstance(item[key], list) else [item[key]]
+            positions_per_path = {}
+            for position, frame in enumerate(frames):
+                positions_per_path.setdefault(frame["path"], []).append(position)
+
+            loaded_frames = [None] * len(frames)
+            for path, positions in positions_per_path.items():
+                shard, timestamps = self._frames[path]
+                query_ts = torch.tensor([frames[position]["timestamp"] for position in positions])
+                min_, argmin_ = find_closest_timestamps(query_ts, timestamps)
+                is_within_tol = min_ < tolerance_s
+                assert is_within_tol.all(), (
+                    f"One or several query timestamps unexpectedly violate the tolerance ({min_[~is_within_tol]} > {tolerance_s=})."
+                    "It means that the closest frame that can be loaded from the video is too far away in time."
+                    f"\nqueried timestamps: {query_ts}"
+                    f"\nvideo: {path}"
+                )
+                for position, idx in zip(positions, argmin_.tolist(), strict=True):
+                    loaded_frames[position] = torch.from_numpy(shard[idx])
+
+            loaded_frames = torch.stack(loaded_frames)
+            if image_dtype != torch.uint8:
+                # convert to the pytorch format which is float32 in [0,1] range (and channel first)
+                loaded_frames = loaded_frames.type(torch.float32) / 255
+            item[key] = loaded_frames if isinstance(item[key], list) else loaded_frames[0]
+
+        return item
+
+    def __getstate__(self):
+        # don't pickle the content of the memmaps (e.g. when spawning DataLoader workers)
+        state = self.__dict__.copy()
+        state["_frames"] = None
+        return state
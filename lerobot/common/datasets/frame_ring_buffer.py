@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Ring buffer of frames in shared memory, to pass the frames of a camera to the image writer processes without
+pickling them (see `async_save_image`).
+
+The ring buffer is a memmap of `num_slots` frames of a fixed shape, next to the state of each slot, in a file of
+`/dev/shm` (or of the temporary directory when `/dev/shm` doesn't exist or is too small, see `_get_dir`):
+```
+states: int64 (num_slots,)          # FREE or FILLED
+frames: uint8 (num_slots, h, w, c)
+```
+The control process copies each frame once into the next slot, and only sends the slot (see `SharedFrame`)
+through the queue of the image writer. The image writer process reads the frame in place, and frees the slot
+once the image is saved. The slots are reused in order: when the next slot isn't freed yet, the ring buffer is
+full and the frame isn't put in it (it is counted as an overrun).
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+import weakref
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from lerobot.common.datasets.utils import check_disk_space
+
+SHM_DIR = "/dev/shm"
+
+FREE = 0
+FILLED = 1
+
+
+def _remove_ring_file(path: Path, pid: int):
+    # the copies of the ring buffer inherited by the image writer processes don't remove it
+    if os.getpid() == pid:
+        path.unlink(missing_ok=True)
+
+
+@dataclass(frozen=True)
+class SharedFrame:
+    """Reference to a frame stored in a `FrameRingBuffer`, sent to the image writer processes instead of the
+    frame itself."""
+
+    path: str
+    shape: tuple[int, ...]
+    num_slots: int
+    slot: int
+
+
+class FrameRingBuffer:
+    """Ring buffer of frames in shared memory (see module docstring).
+
+    Args:
+        shape: Shape of the frames (uint8, e.g. (h, w, c)).
+        num_slots: Number of frames which can be waiting to be saved.
+        path: File of the ring buffer. When None, a new file is created, and removed with the ring buffer.
+    """
+
+    def __init__(self, shape: tuple[int, ...], num_slots: int, path: str | Path | None = None):
+        if num_slots < 1:
+            raise ValueError(f"`num_slots` should be at least 1, but {num_slots=} given.")
+        self.shape = tuple(shape)
+        self.num_slots = num_slots
+        is_new = path is None
+        if is_new:
+            fd, path = tempfile.mkstemp(prefix="lerobot_frames_", dir=self._get_dir())
+            os.close(fd)
+            path = Path(path)
+            weakref.finalize(self, _remove_ring_file, path, os.getpid())
+            states = np.memmap(path, dtype=np.int64, mode="w+", shape=self._num_bytes // 8)
+            del states
+        self.path = Path(path)
+        self.states = np.memmap(self.path, dtype=np.int64, mode="r+", shape=(num_slots,))
+        self.frames = np.memmap(
+            self.path, dtype=np.uint8, mode="r+", offset=num_slots * 8, shape=(num_slots, *self.shape)
+        )
+        if is_new:
+            # allocate the pages of the file upfront, instead of when the first frames are recorded
+            self.frames[:] = 0
+        self.next_slot = 0
+        self.num_overruns = 0
+
+    def _get_dir(self) -> str | None:
+        """Returns `/dev/shm` when the ring buffer fits in it, otherwise None (the temporary directory).
+
+        `/dev/shm` can be small (e.g. 64MB by default in docker containers, see `--shm-size`), and writing to a
+        file beyond its free space kills the process (SIGBUS) instead of raising an error. Raises a RuntimeError
+        when the ring buffer doesn't fit in the temporary directory either.
+        """
+        if Path(SHM_DIR).is_dir():
+            free_space = shutil.disk_usage(SHM_DIR).free
+            # same margin as `check_disk_space`
+            if self._num_bytes < free_space * 0.8:
+                return SHM_DIR
+            logging.warning(
+                f"The ring buffer of {self._num_bytes} bytes doesn't fit in {SHM_DIR} ({free_space} bytes free), "
+                "it is created in the temporary directory instead. Consider increasing the size of "
+                f"{SHM_DIR} (e.g. `docker run --shm-size`), or reducing the number of slots."
+            )
+        check_disk_space(self._num_bytes, Path(tempfile.gettempdir()))
+        return None
+
+    @property
+    def _num_bytes(self) -> int:
+        # rounded up to a multiple of 8 bytes
+        return self.num_slots * 8 + -(-self.num_slots * int(np.prod(self.shape)) // 8) * 8
+
+    @classmethod
+    def open(cls, shared_frame: SharedFrame) -> "FrameRingBuffer":
+        """Opens the ring buffer of a frame, e.g. in an image writer process."""
+        return cls(shared_frame.shape, shared_frame.num_slots, path=shared_frame.path)
+
+    def put(self, image: torch.Tensor | np.ndarray, max_wait_s: float = 0) -> SharedFrame | None:
+        """Copies a frame into the next slot. Returns None (and counts an overrun) when the frame doesn't fit
+        in the ring buffer, i.e. when the next slot isn't freed within `max_wait_s` seconds, or when the frame
+        doesn't have the shape of the ring buffer."""
+        slot = self.next_slot
+        if tuple(image.shape) != self.shape:
+            self.num_overruns += 1
+            return None
+        if self.states[slot] != FREE:
+            start_t = time.perf_counter()
+            while self.states[slot] != FREE and time.perf_counter() - start_t < max_wait_s:
+                time.sleep(0.001)
+            if self.states[slot] != FREE:
+                self.num_overruns += 1
+                return None
+        self.frames[slot] = np.asarray(image)
+        self.states[slot] = FILLED
+        self.next_slot = (slot + 1) % self.num_slots
+        return SharedFrame(str(self.path), self.shape, self.num_slots, slot)
+
+    def get(self, slot: int) -> torch.Tensor:
+        """Returns the frame of a slot, without copying it. It is valid until the slot is freed."""
+        return torch.from_numpy(self.frames[slot])
+
+    def free(self, slot: int):
+        self.states[slot] = FREE
+
+    @property
+    def num_filled(self) -> int:
+        """Number of frames waiting to be saved."""
+        return int((self.states == FILLED).sum())
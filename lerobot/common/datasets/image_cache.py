@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cache of the decoded images of an image (non-video) LeRobotDataset, shared by the DataLoader workers.
+
+The images of image datasets are stored as png in the Arrow table, and are decoded at every access. The cache
+stores the decoded images (uint8, channel first) of each image key in a memmap of a bounded number of slots,
+next to the row index of the image stored in each slot:
+```
+image_cache
+├── observation.image.frames
+├── observation.image.tags
+├── ...
+```
+Row `idx` is stored in slot `idx % num_slots`. When the dataset fits in the cache, each image is decoded once per
+run. Otherwise, the images of the rows sharing a slot replace each other.
+
+The memmaps are opened in read/write mode by every process, so that an image decoded by a DataLoader worker is
+read from the cache by the other workers, and in the next epochs. Next to the row index, the tags store a
+sequence number of each slot, which is odd while the image of the slot is written. A reader checks that the
+sequence number is even and unchanged after reading the image, so that it doesn't use an image while it is
+replaced (even if the slot is then written again with the same row). The writers of a slot are serialized with a
+lock on the range of its tag in the tags file (`fcntl.lockf`, not available on Windows, where only the threads
+of a process are serialized).
+
+By default, the cache is a temporary directory removed with the `DecodedImageCache` of the main process.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from pathlib import Path
+
+import datasets
+import numpy as np
+
+from lerobot.common.datasets.utils import check_disk_space
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# position of the row index and of the sequence number in the tag of a slot
+TAG_INDEX, TAG_SEQ = 0, 1
+
+
+def _remove_cache_dir(cache_dir: Path, pid: int):
+    # the copies of the cache inherited by DataLoader workers don't remove it
+    if os.getpid() == pid:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+class CachedImageColumn:
+    """Column of the decoded images of a key, indexed like a numpy array of shape (num_rows, c, h, w)."""
+
+    def __init__(self, cache: "DecodedImageCache", key: str):
+        self.cache = cache
+        self.key = key
+
+    def __getitem__(self, indices) -> np.ndarray:
+        indices = np.asarray(indices, dtype=np.int64)
+        images = self.cache.get(self.key, indices.reshape(-1))
+        images = images.reshape(*indices.shape, *images.shape[1:])
+        if self.cache.to_float32:
+            # same as `transforms.ToTensor`, float32 in [0,1] range
+            images = images.astype(np.float32) / np.float32(255)
+        return images
+
+
+class DecodedImageCache:
+    """Bounded cache of the decoded images of a dataset, shared by the DataLoader workers (see module docstring).
+
+    Args:
+        hf_dataset: Dataset whose `datasets.Image` keys are cached.
+        max_num_bytes: Size of the cache, over all the keys. The number of slots is the number of rows of the
+            dataset if they fit in the cache, otherwise the number of rows which fit in the cache.
+        cache_dir: Directory of the memmaps. By default, a temporary directory which is removed with the cache.
+            It shouldn't be shared by several datasets.
+        to_float32: Whether the images are returned as float32 in [0,1] range (like `hf_transform_to_torch`),
+            or as uint8 in [0,255] range.
+    """
+
+    def __init__(
+        self,
+        hf_dataset: datasets.Dataset,
+        max_num_bytes: int,
+        cache_dir: Path | None = None,
+        to_float32: bool = True,
+    ):
+        self.keys = [key for key, feats in hf_dataset.features.items() if isinstance(feats, datasets.Image)]
+        self.to_float32 = to_float32
+        # the images are decoded by the `datasets.Image` feature, without the transform of the dataset
+        self._raw_datasets = {key: hf_dataset.select_columns(key).with_format(None) for key in self.keys}
+        self.shapes = {
+            key: self._decode(key, np.array([0], dtype=np.int64)).shape[1:] if len(hf_dataset) > 0 else None
+            for key in self.keys
+        }
+        row_num_bytes = sum(int(np.prod(shape)) for shape in self.shapes.values() if shape is not None)
+        self.num_slots = min(len(hf_dataset), max_num_bytes // max(row_num_bytes, 1))
+        if self.num_slots == 0 and len(hf_dataset) > 0:
+            raise ValueError(f"The images of a row ({row_num_bytes} bytes) don't fit in {max_num_bytes=}.")
+        if self.num_slots < len(hf_dataset):
+            logging.warning(
+                f"Only {self.num_slots} of the {len(hf_dataset)} rows fit in the image cache, the images of the "
+                "other rows will be decoded again when they are replaced in the cache."
+            )
+
+        if cache_dir is None:
+            cache_dir = Path(tempfile.mkdtemp(prefix="lerobot_image_cache_"))
+            weakref.finalize(self, _remove_cache_dir, cache_dir, os.getpid())
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        check_disk_space(self.num_slots * row_num_bytes, self.cache_dir)
+        for key in self.keys:
+            if self.shapes[key] is None:
+                continue
+            frames = np.memmap(
+                self.cache_dir / f"{key}.frames",
+                dtype=np.uint8,
+                mode="w+",
+                shape=(self.num_slots, *self.shapes[key]),
+            )
+            del frames
+            tags = np.memmap(
+                self.cache_dir / f"{key}.tags", dtype=np.int64, mode="w+", shape=(self.num_slots, 2)
+            )
+            tags[:, TAG_INDEX] = -1
+            tags[:, TAG_SEQ] = 0
+            tags.flush()
+        self._memmaps = None
+        self._write_lock = threading.Lock()
+
+    @property
+    def columns(self) -> dict[str, CachedImageColumn]:
+        """Columns of the decoded images, e.g. to be used as `columns` of `load_previous_and_future_frames`."""
+        return {key: CachedImageColumn(self, key) for key in self.keys if self.shapes[key] is not None}
+
+    def _open_memmaps(self) -> dict[str, tuple[np.memmap, np.memmap, object]]:
+        return {
+            key: (
+                np.memmap(
+                    self.cache_dir / f"{key}.frames",
+                    dtype=np.uint8,
+                    mode="r+",
+                    shape=(self.num_slots, *self.shapes[key]),
+                ),
+                np.memmap(
+                    self.cache_dir / f"{key}.tags", dtype=np.int64, mode="r+", shape=(self.num_slots, 2)
+                ),
+                # the tags file is kept open to lock the tags of the slots being written
+                open(self.cache_dir / f"{key}.tags", "r+b"),  # noqa: SIM115
+            )
+            for key in self.keys
+            if self.shapes[key] is not None
+        }
+
+    def _write(self, key: str, slot: int, idx: int, image: np.ndarray):
+        """Writes the image of row `idx` in `slot`, with the sequence number of the slot odd while it is written."""
+        frames, tags, tags_file = self._memmaps[key]
+        tag_num_bytes = tags.itemsize * tags.shape[1]
+        with self._write_lock:
+            if fcntl is not None:
+                fcntl.lockf(tags_file, fcntl.LOCK_EX, tag_num_bytes, slot * tag_num_bytes, os.SEEK_SET)
+            try:
+                seq = int(tags[slot, TAG_SEQ])
+                tags[slot, TAG_SEQ] = seq + 1
+                frames[slot] = image
+                tags[slot, TAG_INDEX] = idx
+                tags[slot, TAG_SEQ] = seq + 2
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(tags_file, fcntl.LOCK_UN, tag_num_bytes, slot * tag_num_bytes, os.SEEK_SET)
+
+    def _decode(self, key: str, indices: np.ndarray) -> np.ndarray:
+        images = [np.asarray(img) for img in self._raw_datasets[key][indices.tolist()][key]]
+        # channel first, like `transforms.PILToTensor`
+        images = [img[None] if img.ndim == 2 else img.transpose(2, 0, 1) for img in images]
+        return np.stack(images)
+
+    def get(self, key: str, indices: np.ndarray) -> np.ndarray:
+        """Returns the decoded images (uint8, channel first) of the rows `indices` of `key`. The images which
+        aren't in the cache are decoded, and stored in the cache."""
+        if self._memmaps is None:
+            self._memmaps = self._open_memmaps()
+        frames, tags, _ = self._memmaps[key]
+
+        slots = indices % self.num_slots
+        seqs_before = np.array(tags[slots, TAG_SEQ])
+        images = np.asarray(frames[slots])
+        # the images of slots which were being written, or were written while being read, are decoded again
+        is_cached = (
+            (seqs_before % 2 == 0)
+            & (tags[slots, TAG_INDEX] == indices)
+            & (tags[slots, TAG_SEQ] == seqs_before)
+        )
+        if not is_cached.all():
+            missing = np.flatnonzero(~is_cached)
+            decoded = self._decode(key, indices[missing])
+            images[missing] = decoded
+            for slot, idx, image in zip(
+                slots[missing].tolist(), indices[missing].tolist(), decoded, strict=True
+            ):
+                self._write(key, slot, idx, image)
+        return images
+
+    def __getstate__(self):
+        # don't pickle the content of the memmaps (e.g. when spawning DataLoader workers)
+        state = self.__dict__.copy()
+        state["_memmaps"] = None
+        del state["_write_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._write_lock = threading.Lock()
@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming version of `LeRobotDataset`, for datasets which don't fit on the local disk or in the page cache.
+
+`LeRobotDataset` accesses the rows in a random order, which reads the Arrow table at every item.
+`LeRobotIterableDataset` instead reads the rows of the dataset sequentially:
+- The episodes are grouped into chunks of consecutive episodes of about `chunk_size` frames. The chunks are
+  shuffled at every epoch, and dealt to the DataLoader workers in turn, so that all the workers have rows to
+  read even when the dataset has fewer shards than workers.
+- Each worker reads the rows of its chunks in order, from the shards which contain them: the Arrow files of a
+  dataset stored locally, or the parquet files of the hub, of which only the row groups containing the rows
+  are read remotely (without downloading the whole shards).
+- The rows of the previous and future frames of `delta_timestamps` are taken from a rolling buffer of the rows
+  of the current episode, which only holds the rows of the window around the frame being read.
+- The windows of rows go through a shuffle buffer before the items are built. The buffer only holds undecoded
+  rows (e.g. the paths and timestamps of the video frames), the images and video frames of an item are decoded
+  once it is drawn from the buffer (with a `VideoDecoderPool`, like `LeRobotDataset`).
+
+An episode can be spread over several shards: the rows of a chunk are read from all the shards containing
+them, using the number of rows of each shard (from the metadata of the shards) to locate them.
+"""
+
+import bisect
+import itertools
+import logging
+from pathlib import Path
+from typing import Callable, Iterator
+
+import datasets
+import pyarrow as pa
+import pyarrow.parquet as pq
+import torch
+from huggingface_hub import HfApi, HfFileSystem
+
+from lerobot.common.datasets.lerobot_dataset import CODEBASE_VERSION, DATA_DIR
+from lerobot.common.datasets.utils import (
+    find_closest_timestamps,
+    get_hf_dataset_safe_version,
+    hf_transform_to_torch,
+    load_episode_data_index,
+    load_info,
+    load_stats,
+    load_videos,
+    load_videos_index,
+)
+from lerobot.common.datasets.video_utils import VideoDecoderPool, VideoFetcher, VideoFrame, load_from_videos
+
+# number of rows read at once from a parquet shard
+READ_BATCH_SIZE = 1000
+
+
+class LeRobotIterableDataset(torch.utils.data.IterableDataset):
+    """Iterates over a LeRobotDataset by reading its shards sequentially (see module docstring).
+
+    The items are the same as the ones of `LeRobotDataset` (with `split="train"`), in a different order.
+
+    Args:
+        repo_id: Name of the dataset on the hub, or of its directory in `root`.
+        root: Directory of a dataset stored locally. Its shards are either the Arrow files of `train`
+            (`datasets.Dataset.save_to_disk`), or the parquet files of `data` (same layout as on the hub).
+            When None, the dataset is streamed from the hub.
+        image_transforms: Same as in `LeRobotDataset`.
+        delta_timestamps: Same as in `LeRobotDataset`.
+        video_backend: Backend of `torchvision.io.VideoReader` used to decode the videos.
+        image_dtype: Same as in `LeRobotDataset`.
+        shuffle: Whether to shuffle the order of the chunks of episodes and the items. When False, the items are
+            yielded in the order of the dataset (when using a single worker).
+        shuffle_buffer_size: Number of frames from which each yielded item is randomly drawn, in each worker.
+            The buffer holds the undecoded rows of the frames (and of their `delta_timestamps` windows), so its
+            memory doesn't depend on the resolution of the videos (only on the size of the encoded images of
+            image datasets). The items of consecutive frames are correlated, so it should cover several episodes.
+        seed: Seed of the shuffling, combined with the epoch (see `set_epoch`) and the worker id.
+        chunk_size: Number of frames of the chunks of consecutive episodes which are dealt to the workers. A chunk
+            has at least one episode, and ends with the episode reaching `chunk_size` frames.
+    """
+
+    def __init__(
+        self,
+        repo_id: str,
+        root: Path | None = DATA_DIR,
+        image_transforms: Callable | None = None,
+        delta_timestamps: dict[list[float]] | None = None,
+        video_backend: str | None = None,
+        image_dtype: torch.dtype = torch.float32,
+        shuffle: bool = True,
+        shuffle_buffer_size: int = 10_000,
+        seed: int = 0,
+        chunk_size: int = 1000,
+    ):
+        super().__init__()
+        if image_dtype not in [torch.float32, torch.uint8]:
+            raise ValueError(
+                f"`image_dtype` should be torch.float32 or torch.uint8, but {image_dtype=} given."
+            )
+        self.repo_id = repo_id
+        self.root = root
+        self.image_transforms = image_transforms
+        self.delta_timestamps = delta_timestamps
+        self.video_backend = video_backend if video_backend is not None else "pyav"
+        self.image_dtype = image_dtype
+        self.shuffle = shuffle
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.epoch = 0
+        # only the meta data is loaded, the shards and videos are read (or downloaded) when iterating
+        self.episode_data_index = load_episode_data_index(repo_id, CODEBASE_VERSION, root)
+        self.stats = load_stats(repo_id, CODEBASE_VERSION, root)
+        self.info = load_info(repo_id, CODEBASE_VERSION, root)
+        self.revision = None if root is not None else get_hf_dataset_safe_version(repo_id, CODEBASE_VERSION)
+        self.shards = self._list_shards()
+        self.features = self._load_features()
+        self.videos_dir = None
+        self.videos_index = None
+        if self.video:
+            self.videos_dir = load_videos(repo_id, CODEBASE_VERSION, root, lazy=True)
+            videos_index = load_videos_index(repo_id, CODEBASE_VERSION, root)
+            if videos_index is not None:
+                self.videos_index = {str(self.videos_dir.parent / k): v for k, v in videos_index.items()}
+        # index of the row following the last row of each shard
+        self.shard_ends = list(itertools.accumulate(self._get_shard_num_rows(shard) for shard in self.shards))
+
+    def _list_shards(self) -> list[str]:
+        """Returns the paths of the shards, relative to the dataset directory, in the order of the dataset."""
+        if self.root is not None:
+            dataset_dir = Path(self.root) / self.repo_id
+            paths = sorted((dataset_dir / "train").glob("*.arrow")) or sorted(
+                dataset_dir.glob("data/*.parquet")
+            )
+            shards = [str(path.relative_to(dataset_dir)) for path in paths]
+        else:
+            files = HfApi().list_repo_files(self.repo_id, repo_type="dataset", revision=self.revision)
+            shards = sorted(f for f in files if f.startswith("data/") and f.endswith(".parquet"))
+        if len(shards) == 0:
+            raise FileNotFoundError(f"No Arrow or parquet shard found for {self.repo_id}.")
+        return shards
+
+    def _open_parquet_shard(self, shard: str) -> pq.ParquetFile:
+        """Opens a parquet shard. The shards of the hub are opened remotely, so that only the parts which are
+        read (e.g. the metadata, or some row groups) are downloaded. Close it with `close(force=True)`."""
+        if self.root is not None:
+            return pq.ParquetFile(Path(self.root) / self.repo_id / shard)
+        fs = HfFileSystem()
+        return pq.ParquetFile(fs.open(f"datasets/{self.repo_id}@{self.revision}/{shard}"))
+
+    def _get_shard_num_rows(self, shard: str) -> int:
+        """Returns the number of rows of a shard, from its metadata."""
+        if shard.endswith(".arrow"):
+            # the record batches are memory-mapped, so only their metadata is read
+            with pa.memory_map(str(Path(self.root) / self.repo_id / shard)) as source:
+                return sum(record_batch.num_rows for record_batch in pa.ipc.open_stream(source))
+        parquet_file = self._open_parquet_shard(shard)
+        try:
+            return parquet_file.metadata.num_rows
+        finally:
+            parquet_file.close(force=True)
+
+    def _load_features(self) -> datasets.Features:
+        shard = self.shards[0]
+        if shard.endswith(".arrow"):
+            with pa.memory_map(str(Path(self.root) / self.repo_id / shard)) as source:
+                schema = pa.ipc.open_stream(source).schema
+        else:
+            parquet_file = self._open_parquet_shard(shard)
+            try:
+                schema = parquet_file.schema_arrow
+            finally:
+                parquet_file.close(force=True)
+        return datasets.Features.from_arrow_schema(schema)
+
+    @property
+    def fps(self) -> int:
+        """Frames per second used during data collection."""
+        return self.info["fps"]
+
+    @property
+    def video(self) -> bool:
+        """Returns True if this dataset loads video frames from mp4 files."""
+        return self.info.get("video", False)
+
+    @property
+    def camera_keys(self) -> list[str]:
+        """Keys to access image and video stream from cameras."""
+        return [
+            key for key, feats in self.features.items() if isinstance(feats, (datasets.Image, VideoFrame))
+        ]
+
+    @property
+    def video_frame_keys(self) -> list[str]:
+        """Keys to access video frames that requires to be decoded into images."""
+        return [key for key, feats in self.features.items() if isinstance(feats, VideoFrame)]
+
+    @property
+    def num_samples(self) -> int:
+        """Number of samples/frames."""
+        return self.episode_data_index["to"][-1].item()
+
+    @property
+    def num_episodes(self) -> int:
+        """Number of episodes."""
+        return len(self.episode_data_index["from"])
+
+    @property
+    def tolerance_s(self) -> float:
+        """Same as in `LeRobotDataset`."""
+        # 1e-4 to account for possible numerical error
+        return 1 / self.fps - 1e-4
+
+    def __len__(self):
+        return self.num_samples
+
+    def set_epoch(self, epoch: int):
+        """Sets the epoch used to seed the shuffling, so that the order changes between epochs. It must be
+        called before creating the iterator of the DataLoader (e.g. at the beginning of every epoch)."""
+        self.epoch = epoch
+
+    def _iter_shard_record_batches(self, shard: str, start: int, end: int) -> Iterator[pa.RecordBatch]:
+        """Yields the record batches of the rows of a shard from `start` to `end` (excluded)."""
+        if shard.endswith(".arrow"):
+            source = pa.memory_map(str(Path(self.root) / self.repo_id / shard))
+            record_batches = pa.ipc.open_stream(source)
+            offset = 0
+        else:
+            source = self._open_parquet_shard(shard)
+            # only the row groups containing the rows are read
+            row_group_ends = list(
+                itertools.accumulate(
+                    source.metadata.row_group(i).num_rows for i in range(source.metadata.num_row_groups)
+                )
+            )
+            first = bisect.bisect_right(row_group_ends, start)
+            last = bisect.bisect_left(row_group_ends, end)
+            offset = row_group_ends[first - 1] if first > 0 else 0
+            record_batches = source.iter_batches(
+                batch_size=READ_BATCH_SIZE, row_groups=list(range(first, last + 1))
+            )
+        try:
+            for record_batch in record_batches:
+                if offset >= end:
+                    break
+                if offset + record_batch.num_rows > start:
+                    lo = max(start - offset, 0)
+                    yield record_batch.slice(lo, min(end - offset, record_batch.num_rows) - lo)
+                offset += record_batch.num_rows
+        finally:
+            if isinstance(source, pq.ParquetFile):
+                source.close(force=True)
+            else:
+                source.close()
+
+    def _iter_rows(self, start: int, end: int) -> Iterator[dict]:
+        """Yields the rows of the dataset from `start` to `end` (excluded), from the shards which contain them.
+
+        The rows are not decoded (see `_make_item`), e.g. the images are still encoded.
+        """
+        for i in range(bisect.bisect_right(self.shard_ends, start), len(self.shards)):
+            shard_start = self.shard_ends[i - 1] if i > 0 else 0
+            if shard_start >= end:
+                break
+            shard_end = min(end, self.shard_ends[i])
+            for record_batch in self._iter_shard_record_batches(
+                self.shards[i], max(start - shard_start, 0), shard_end - shard_start
+            ):
+                yield from record_batch.to_pylist()
+
+    def _make_chunks(self) -> list[tuple[int, int]]:
+        """Groups the episodes into chunks of consecutive episodes of about `chunk_size` frames, and returns the
+        range of rows of each chunk."""
+        chunks = []
+        chunk_start = None
+        for ep_from, ep_to in zip(
+            self.episode_data_index["from"].tolist(), self.episode_data_index["to"].tolist(), strict=True
+        ):
+            if chunk_start is None:
+                chunk_start = ep_from
+            if ep_to - chunk_start >= self.chunk_size:
+                chunks.append((chunk_start, ep_to))
+                chunk_start = None
+        if chunk_start is not None:
+            chunks.append((chunk_start, self.episode_data_index["to"][-1].item()))
+        return chunks
+
+    def _make_window(
+        self, rows: list[dict], position: int, ep_first_ts: float, episode_ended: bool
+    ) -> tuple[dict, dict[str, list[dict]], dict[str, torch.Tensor]]:
+        """Returns the row of `rows[position]`, and the rows of its previous and future frames (taken in `rows`)
+        with their padding masks, for each key of `delta_timestamps`."""
+        row = rows[position]
+        delta_rows, is_pad = {}, {}
+        if self.delta_timestamps is not None:
+            # same as `load_previous_and_future_frames`, restricted to the rows of the rolling buffer
+            timestamps = torch.tensor([r["timestamp"] for r in rows])
+            ep_last_ts = timestamps[-1].item() if episode_ended else float("inf")
+            for key, delta_ts in self.delta_timestamps.items():
+                query_ts = row["timestamp"] + torch.tensor(delta_ts)
+                min_, argmin_ = find_closest_timestamps(query_ts, timestamps)
+                is_pad[key] = min_ > self.tolerance_s
+                assert ((query_ts[is_pad[key]] < ep_first_ts) | (ep_last_ts < query_ts[is_pad[key]])).all(), (
+                    f"One or several timestamps unexpectedly violate the tolerance ({min_} > {self.tolerance_s=}) inside episode range."
+                    "This might be due to synchronization issues with timestamps during data collection."
+                )
+                delta_rows[key] = [rows[i] for i in argmin_.tolist()]
+        return row, delta_rows, is_pad
+
+    def _iter_windows(self, rows: Iterator[dict]) -> Iterator[tuple]:
+        """Yields the windows (see `_make_window`) of consecutive rows, with a rolling buffer of the rows of the
+        current episode.
+
+        A window is made once the buffer contains the row following its last requested timestamp (or the end
+        of the episode), and the rows preceding the first requested timestamp of the next window are dropped.
+        """
+        delta_timestamps = self.delta_timestamps if self.delta_timestamps is not None else {}
+        all_delta_ts = [0.0] + [delta for deltas in delta_timestamps.values() for delta in deltas]
+        min_delta_ts, max_delta_ts = min(all_delta_ts), max(all_delta_ts)
+
+        buffer = []
+        position = 0  # position in `buffer` of the next window
+        ep_first_ts = None
+        for row in itertools.chain(rows, [None]):
+            episode_ended = row is None or (
+                len(buffer) > 0 and row["episode_index"] != buffer[0]["episode_index"]
+            )
+            if episode_ended:
+                while position < len(buffer):
+                    yield self._make_window(buffer, position, ep_first_ts, episode_ended=True)
+                    position += 1
+                buffer, position = [], 0
+                if row is None:
+                    break
+
+            if len(buffer) == 0:
+                ep_first_ts = row["timestamp"]
+            buffer.append(row)
+
+            last_ts = row["timestamp"]
+            while position < len(buffer) and buffer[position]["timestamp"] + max_delta_ts <= last_ts:
+                yield self._make_window(buffer, position, ep_first_ts, episode_ended=False)
+                position += 1
+                # keep the last row preceding the first requested timestamp of the next window
+                if position < len(buffer):
+                    first_query_ts = buffer[position]["timestamp"] + min_delta_ts
+                    while position > 0 and buffer[1]["timestamp"] <= first_query_ts:
+                        buffer.pop(0)
+                        position -= 1
+
+    def _iter_shuffled(self, windows: Iterator[tuple], generator: torch.Generator) -> Iterator[tuple]:
+        """Yields the windows in a random order, each of them drawn from a buffer of `shuffle_buffer_size`
+        windows."""
+        buffer = []
+        for window in windows:
+            if len(buffer) < self.shuffle_buffer_size:
+                buffer.append(window)
+                continue
+            i = torch.randint(len(buffer), (), generator=generator).item()
+            yield buffer[i]
+            buffer[i] = window
+        while len(buffer) > 0:
+            i = torch.randint(len(buffer), (), generator=generator).item()
+            buffer[i], buffer[-1] = buffer[-1], buffer[i]
+            yield buffer.pop()
+
+    def _to_torch(self, batch: dict[str, list]) -> dict[str, list]:
+        """Decodes the values of a batch of rows, like the transform of `LeRobotDataset`."""
+        return hf_transform_to_torch(self.features.decode_batch(batch), image_dtype=self.image_dtype)
+
+    def _make_item(
+        self,
+        window: tuple,
+        decoder_pool: VideoDecoderPool | None = None,
+        video_fetcher: VideoFetcher | None = None,
+    ) -> dict:
+        """Builds the item of a window (see `_make_window`), decoding its images and video frames."""
+        row, delta_rows, is_pad = window
+        item = {key: values[0] for key, values in self._to_torch({k: [v] for k, v in row.items()}).items()}
+        for key, rows in delta_rows.items():
+            values = self._to_torch({key: [r[key] for r in rows]})[key]
+            item[key] = values if key in self.video_frame_keys else torch.stack(values)
+            item[f"{key}_is_pad"] = is_pad[key]
+
+        if len(self.video_frame_keys) > 0:
+            item = load_from_videos(
+                item,
+                self.video_frame_keys,
+                self.videos_dir,
+                self.tolerance_s,
+                self.video_backend,
+                decoder_pool,
+                self.image_dtype,
+                video_fetcher,
+            )
+
+        if self.image_transforms is not None:
+            for cam in self.camera_keys:
+                item[cam] = self.image_transforms(item[cam])
+        return item
+
+    def __iter__(self) -> Iterator[dict]:
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        chunks = self._make_chunks()
+        if self.shuffle:
+            chunks = [chunks[i] for i in torch.randperm(len(chunks), generator=generator).tolist()]
+        if len(chunks) < num_workers and worker_id == 0:
+            logging.warning(
+                f"{num_workers - len(chunks)} workers have no episodes to read. Reduce `chunk_size` to split the "
+                "episodes between more workers."
+            )
+        chunks = chunks[worker_id::num_workers]
+
+        def rows():
+            for start, end in chunks:
+                yield from self._iter_rows(start, end)
+
+        windows = self._iter_windows(rows())
+        if self.shuffle:
+            # each worker draws its items from its own shuffle buffer
+            generator.manual_seed(self.seed + self.epoch * num_workers + worker_id)
+            windows = self._iter_shuffled(windows, generator)
+
+        decoder_pool, video_fetcher = None, None
+        if self.video:
+            decoder_pool = VideoDecoderPool(videos_index=self.videos_index)
+            if self.root is None:
+                video_fetcher = VideoFetcher(self.repo_id, self.revision)
+        try:
+            for window in windows:
+                yield self._make_item(window, decoder_pool, video_fetcher)
+        finally:
+            if decoder_pool is not None:
+                decoder_pool.close()
+            if video_fetcher is not None:
+                video_fetcher.close()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(\n"
+            f"  Repository ID: '{self.repo_id}',\n"
+            f"  Number of Shards: {len(self.shards)},\n"
+            f"  Number of Samples: {self.num_samples},\n"
+            f"  Number of Episodes: {self.num_episodes},\n"
+            f"  Type: {'video (.mp4)' if self.video else 'image (.png)'},\n"
+            f"  Recorded Frames per Second: {self.fps},\n"
+            f"  Camera Keys: {self.camera_keys},\n"
+            f"  Video Frame Keys: {self.video_frame_keys if self.video else 'N/A'},\n"
+            f"  Transformations: {self.image_transforms},\n"
+            f"  Codebase Version: {self.info.get('codebase_version', '< v1.6')},\n"
+            f")"
+        )
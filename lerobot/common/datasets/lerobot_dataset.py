@@ -13,27 +13,40 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import bisect
+import itertools
 import logging
 import os
+from functools import cached_property, partial
 from pathlib import Path
 from typing import Callable
 
 import datasets
+import numpy as np
 import torch
 import torch.utils
 
 from lerobot.common.datasets.compute_stats import aggregate_stats
+from lerobot.common.datasets.frame_cache import VideoFrameCache, get_video_paths
+from lerobot.common.datasets.image_cache import DecodedImageCache
+from lerobot.common.datasets.memmap_storage import ColumnarMemmapStorage
 from lerobot.common.datasets.utils import (
     calculate_episode_data_index,
+    calculate_timestamps_index,
+    get_hf_dataset_safe_version,
+    hf_transform_to_torch,
     load_episode_data_index,
     load_hf_dataset,
     load_info,
     load_previous_and_future_frames,
+    load_previous_and_future_frames_batch,
     load_stats,
+    load_timestamps_index,
     load_videos,
+    load_videos_index,
     reset_episode_index,
 )
-from lerobot.common.datasets.video_utils import VideoFrame, load_from_videos
+from lerobot.common.datasets.video_utils import VideoDecoderPool, VideoFetcher, VideoFrame, load_from_videos
 
 # For maintainers, see lerobot/common/datasets/push_dataset_to_hub/CODEBASE_VERSION.md
 CODEBASE_VERSION = "v1.6"
@@ -49,27 +62,113 @@ class LeRobotDataset(torch.utils.data.Dataset):
         image_transforms: Callable | None = None,
         delta_timestamps: dict[list[float]] | None = None,
         video_backend: str | None = None,
+        frame_cache: str | None = None,
+        frame_cache_dir: Path | None = None,
+        frame_cache_resolutions: dict[str, tuple[int, int]] | None = None,
+        image_dtype: torch.dtype = torch.float32,
+        storage: str = "arrow",
+        storage_dir: Path | None = None,
+        image_cache: str | None = None,
+        image_cache_max_num_bytes: int = 8 * 2**30,
     ):
         super().__init__()
+        if frame_cache not in [None, "memmap"]:
+            raise ValueError(f"`frame_cache` should be None or 'memmap', but {frame_cache=} given.")
+        if image_cache not in [None, "memmap"]:
+            raise ValueError(f"`image_cache` should be None or 'memmap', but {image_cache=} given.")
+        if storage not in ["arrow", "memmap"]:
+            raise ValueError(f"`storage` should be 'arrow' or 'memmap', but {storage=} given.")
+        if image_dtype not in [torch.float32, torch.uint8]:
+            raise ValueError(
+                f"`image_dtype` should be torch.float32 or torch.uint8, but {image_dtype=} given."
+            )
         self.repo_id = repo_id
         self.root = root
         self.split = split
+        self._selected_datasets = {}
         self.image_transforms = image_transforms
         self.delta_timestamps = delta_timestamps
+        # images are float32 in [0,1] range, or uint8 in [0,255] range to make the items 4 times smaller when
+        # they are sent by the DataLoader workers (they are then converted on the device, see `Normalize`)
+        self.image_dtype = image_dtype
         # load data from hub or locally when root is provided
         # TODO(rcadene, aliberts): implement faster transfer
         # https://huggingface.co/docs/huggingface_hub/en/guides/download#faster-downloads
         self.hf_dataset = load_hf_dataset(repo_id, CODEBASE_VERSION, root, split)
         if split == "train":
             self.episode_data_index = load_episode_data_index(repo_id, CODEBASE_VERSION, root)
+            self.timestamps_index = load_timestamps_index(repo_id, CODEBASE_VERSION, root, self.hf_dataset)
         else:
             self.episode_data_index = calculate_episode_data_index(self.hf_dataset)
             self.hf_dataset = reset_episode_index(self.hf_dataset)
+            self.timestamps_index = calculate_timestamps_index(self.hf_dataset)
+        # optionally export the numeric columns once into memmaps (by default in ".cache", next to "meta_data" which
+        # is pushed to the hub), from which they are read instead of the Arrow table. The storage of each split is
+        # keyed by the fingerprint of its dataset, so that the splits don't rebuild each other's storage.
+        self.storage = None
+        if storage == "memmap":
+            if storage_dir is None and root is not None:
+                storage_dir = Path(root) / repo_id / ".cache" / "columns" / self.hf_dataset._fingerprint
+            elif storage_dir is None:
+                # the snapshot of the hub is read-only, so the columns are stored next to the Arrow cache files
+                storage_dir = (
+                    Path(self.hf_dataset.cache_files[0]["filename"]).parent
+                    / "lerobot_columns"
+                    / self.hf_dataset._fingerprint
+                )
+            self.storage = ColumnarMemmapStorage(storage_dir, self.hf_dataset)
+        if image_dtype == torch.uint8:
+            self.hf_dataset.set_transform(partial(hf_transform_to_torch, image_dtype=image_dtype))
         self.stats = load_stats(repo_id, CODEBASE_VERSION, root)
         self.info = load_info(repo_id, CODEBASE_VERSION, root)
+        self.video_fetcher = None
         if self.video:
-            self.videos_dir = load_videos(repo_id, CODEBASE_VERSION, root)
+            # the videos of a dataset on the hub are downloaded when they are first accessed (or prefetched, see
+            # `prefetch_videos`), instead of downloading all of them here
+            self.videos_dir = load_videos(repo_id, CODEBASE_VERSION, root, lazy=True)
+            if root is None:
+                self.video_fetcher = VideoFetcher(
+                    repo_id, get_hf_dataset_safe_version(repo_id, CODEBASE_VERSION)
+                )
             self.video_backend = video_backend if video_backend is not None else "pyav"
+            # keep videos open between items, with a bounded number of open files per DataLoader worker
+            videos_index = load_videos_index(repo_id, CODEBASE_VERSION, root)
+            if videos_index is not None:
+                videos_index = {str(self.videos_dir.parent / k): v for k, v in videos_index.items()}
+            self.video_decoder_pool = VideoDecoderPool(videos_index=videos_index)
+        # optionally decode the videos once into uint8 memmaps (by default next to the local videos), from which the
+        # frames are read instead of decoding the videos at every access
+        self.frame_cache = None
+        if self.video and frame_cache == "memmap":
+            if self.video_fetcher is not None:
+                # all the videos are decoded into the cache
+                video_paths = [path for paths in get_video_paths(self.hf_dataset).values() for path in paths]
+                self.video_fetcher.prefetch(video_paths)
+                for path in video_paths:
+                    self.video_fetcher.fetch(path)
+            if frame_cache_dir is None and root is not None:
+                frame_cache_dir = self.videos_dir.parent / "frame_cache"
+            elif frame_cache_dir is None:
+                # the snapshot of the hub is managed by huggingface_hub, so the frames are cached next to the Arrow
+                # cache files
+                frame_cache_dir = (
+                    Path(self.hf_dataset.cache_files[0]["filename"]).parent / "lerobot_frame_cache"
+                )
+            self.frame_cache = VideoFrameCache(
+                frame_cache_dir,
+                self.videos_dir,
+                self.hf_dataset,
+                self.info,
+                frame_cache_resolutions,
+                self.video_backend,
+            )
+        # optionally keep the decoded png images in a cache shared by the DataLoader workers, so that they are
+        # decoded once instead of at every access
+        self.image_cache = None
+        if image_cache == "memmap" and not self.video:
+            self.image_cache = DecodedImageCache(
+                self.hf_dataset, image_cache_max_num_bytes, to_float32=image_dtype != torch.uint8
+            )
 
     @property
     def fps(self) -> int:
@@ -115,7 +214,7 @@ class LeRobotDataset(torch.utils.data.Dataset):
         """Number of samples/frames."""
         return len(self.hf_dataset)
 
-    @property
+    @cached_property
     def num_episodes(self) -> int:
         """Number of episodes."""
         return len(self.hf_dataset.unique("episode_index"))
@@ -132,8 +231,57 @@ class LeRobotDataset(torch.utils.data.Dataset):
     def __len__(self):
         return self.num_samples
 
+    def _get_array_columns(self) -> dict | None:
+        """Columns which are read from arrays instead of the hugging face dataset (see `ColumnarMemmapStorage`
+        and `DecodedImageCache`), or None if there is none."""
+        array_columns = {}
+        if self.storage is not None:
+            array_columns.update(self.storage.columns)
+        if self.image_cache is not None:
+            array_columns.update(self.image_cache.columns)
+        return array_columns if len(array_columns) > 0 else None
+
+    def _select_columns(self, columns: list[str]) -> datasets.Dataset:
+        """Same as `self.hf_dataset.select_columns(columns)`, which is memoized since it copies the metadata of
+        the dataset at every call."""
+        key = (self.hf_dataset._fingerprint, tuple(columns))
+        if key not in self._selected_datasets:
+            self._selected_datasets[key] = self.hf_dataset.select_columns(columns)
+        return self._selected_datasets[key]
+
+    def _get_rows(self, indices: int | list[int], columns: list[str] | None = None) -> dict:
+        """Same as `self.hf_dataset.select_columns(columns)[indices]`, except that the columns of the columnar
+        storage and of the image cache are read from their arrays.
+        """
+        columns = self.hf_dataset.column_names if columns is None else columns
+        array_columns = self._get_array_columns() or {}
+        hf_columns = [key for key in columns if key not in array_columns]
+
+        rows = {}
+        if hf_columns == self.hf_dataset.column_names:
+            rows = self.hf_dataset[indices]
+        elif len(hf_columns) > 0:
+            rows = self._select_columns(hf_columns)[indices]
+        for key in columns:
+            if key in array_columns:
+                values = torch.from_numpy(np.asarray(array_columns[key][indices]))
+                # lists of tensors for a list of indices, like the batches of the hugging face dataset
+                rows[key] = list(values) if isinstance(indices, list) else values
+        return {key: rows[key] for key in columns}
+
+    def prefetch_videos(self, indices: list[int]):
+        """Starts downloading in the background the videos of the episodes of `indices`, when the videos are
+        fetched from the hub (see `VideoFetcher`). Videos which are already downloaded are skipped.
+        """
+        if self.video_fetcher is None:
+            return
+        ep_ids = torch.searchsorted(self.episode_data_index["to"], torch.as_tensor(indices), right=True)
+        from_ids = self.episode_data_index["from"][ep_ids.unique()].tolist()
+        rows = self.hf_dataset.select_columns(self.video_frame_keys)[from_ids]
+        self.video_fetcher.prefetch([frame["path"] for frames in rows.values() for frame in frames])
+
     def __getitem__(self, idx):
-        item = self.hf_dataset[idx]
+        item = self._get_rows(int(idx)) if self._get_array_columns() is not None else self.hf_dataset[idx]
 
         if self.delta_timestamps is not None:
             item = load_previous_and_future_frames(
@@ -142,15 +290,22 @@ class LeRobotDataset(torch.utils.data.Dataset):
                 self.episode_data_index,
                 self.delta_timestamps,
                 self.tolerance_s,
+                self.timestamps_index,
+                self._get_array_columns(),
             )
 
-        if self.video:
+        if self.video and self.frame_cache is not None:
+            item = self.frame_cache.load(item, self.video_frame_keys, self.tolerance_s, self.image_dtype)
+        elif self.video:
             item = load_from_videos(
                 item,
                 self.video_frame_keys,
                 self.videos_dir,
                 self.tolerance_s,
                 self.video_backend,
+                self.video_decoder_pool,
+                self.image_dtype,
+                self.video_fetcher,
             )
 
         if self.image_transforms is not None:
@@ -159,6 +314,69 @@ class LeRobotDataset(torch.utils.data.Dataset):
 
         return item
 
+    def __getitems__(self, indices: list[int]) -> list[dict]:
+        """Batched version of `__getitem__`, automatically used by `torch.utils.data.DataLoader`.
+
+        Instead of querying the Arrow table once per item and once per delta timestamps modality, all the rows
+        needed by the batch (including the previous and future frames) are fetched with one query per modality.
+        """
+        if self.delta_timestamps is not None and self.timestamps_index is None:
+            # e.g. a dataset created with `from_preloaded` without `timestamps_index`
+            return [self[idx] for idx in indices]
+
+        indices = [int(idx) for idx in indices]
+
+        columns = self.hf_dataset.column_names
+        if self.delta_timestamps is not None:
+            # don't load (and decode) frames which are replaced by their previous and future frames
+            columns = [
+                key
+                for key in columns
+                if key not in self.delta_timestamps or key in ["episode_index", "timestamp"]
+            ]
+        batch = self._get_rows(indices, columns)
+
+        if self.delta_timestamps is not None:
+            batch = load_previous_and_future_frames_batch(
+                batch,
+                self.hf_dataset,
+                self.episode_data_index,
+                self.delta_timestamps,
+                self.tolerance_s,
+                self.timestamps_index,
+                self._get_array_columns(),
+            )
+
+        items = [{key: batch[key][i] for key in batch} for i in range(len(indices))]
+
+        for item in items:
+            if self.video and self.frame_cache is not None:
+                item = self.frame_cache.load(item, self.video_frame_keys, self.tolerance_s, self.image_dtype)
+            elif self.video:
+                item = load_from_videos(
+                    item,
+                    self.video_frame_keys,
+                    self.videos_dir,
+                    self.tolerance_s,
+                    self.video_backend,
+                    self.video_decoder_pool,
+                    self.image_dtype,
+                    self.video_fetcher,
+                )
+
+            if self.image_transforms is not None:
+                for cam in self.camera_keys:
+                    item[cam] = self.image_transforms(item[cam])
+
+        return items
+
+    def __getstate__(self):
+        # the selected datasets are recreated when needed, instead of pickling their tables (e.g. when spawning
+        # DataLoader workers)
+        state = self.__dict__.copy()
+        state["_selected_datasets"] = {}
+        return state
+
     def __repr__(self):
         return (
             f"{self.__class__.__name__}(\n"
@@ -186,10 +404,12 @@ class LeRobotDataset(torch.utils.data.Dataset):
         # additional preloaded attributes
         hf_dataset=None,
         episode_data_index=None,
+        timestamps_index=None,
         stats=None,
         info=None,
         videos_dir=None,
         video_backend=None,
+        video_decoder_pool=None,
     ) -> "LeRobotDataset":
         """Create a LeRobot Dataset from existing data and attributes instead of loading from the filesystem.
 
@@ -206,12 +426,20 @@ class LeRobotDataset(torch.utils.data.Dataset):
         obj.split = split
         obj.image_transforms = transform
         obj.delta_timestamps = delta_timestamps
+        obj.image_dtype = torch.float32
         obj.hf_dataset = hf_dataset
         obj.episode_data_index = episode_data_index
+        obj.timestamps_index = timestamps_index
         obj.stats = stats
         obj.info = info if info is not None else {}
         obj.videos_dir = videos_dir
         obj.video_backend = video_backend if video_backend is not None else "pyav"
+        obj.video_decoder_pool = video_decoder_pool
+        obj.frame_cache = None
+        obj.storage = None
+        obj.video_fetcher = None
+        obj.image_cache = None
+        obj._selected_datasets = {}
         return obj
 
 
@@ -230,6 +458,11 @@ class MultiLeRobotDataset(torch.utils.data.Dataset):
         image_transforms: Callable | None = None,
         delta_timestamps: dict[list[float]] | None = None,
         video_backend: str | None = None,
+        frame_cache: str | None = None,
+        frame_cache_resolutions: dict[str, tuple[int, int]] | None = None,
+        image_dtype: torch.dtype = torch.float32,
+        storage: str = "arrow",
+        image_cache: str | None = None,
     ):
         super().__init__()
         self.repo_ids = repo_ids
@@ -243,6 +476,11 @@ class MultiLeRobotDataset(torch.utils.data.Dataset):
                 delta_timestamps=delta_timestamps,
                 image_transforms=image_transforms,
                 video_backend=video_backend,
+                frame_cache=frame_cache,
+                frame_cache_resolutions=frame_cache_resolutions,
+                image_dtype=image_dtype,
+                storage=storage,
+                image_cache=image_cache,
             )
             for repo_id in repo_ids
         ]
@@ -279,6 +517,8 @@ class MultiLeRobotDataset(torch.utils.data.Dataset):
         self.image_transforms = image_transforms
         self.delta_timestamps = delta_timestamps
         self.stats = aggregate_stats(self._datasets)
+        # index of the first sample of each dataset after the first one, to route indices with a binary search
+        self.cumulative_sizes = list(itertools.accumulate(dataset.num_samples for dataset in self._datasets))
 
     @property
     def repo_id_to_index(self):
@@ -344,9 +584,14 @@ class MultiLeRobotDataset(torch.utils.data.Dataset):
     @property
     def num_samples(self) -> int:
         """Number of samples/frames."""
-        return sum(d.num_samples for d in self._datasets)
+        return self.cumulative_sizes[-1]
 
     @property
+    def episode_data_indices(self) -> list[dict[str, torch.Tensor]]:
+        """`episode_data_index` of each dataset, with indices relative to the first sample of the dataset."""
+        return [dataset.episode_data_index for dataset in self._datasets]
+
+    @cached_property
     def num_episodes(self) -> int:
         """Number of episodes."""
         return sum(d.num_episodes for d in self._datasets)
@@ -363,28 +608,45 @@ class MultiLeRobotDataset(torch.utils.data.Dataset):
     def __len__(self):
         return self.num_samples
 
-    def __getitem__(self, idx: int) -> dict[str, torch.Tensor]:
+    def _route(self, idx: int) -> tuple[int, int]:
+        """Returns the index of the dataset containing the sample `idx`, and the index of the sample in it."""
         if idx >= len(self):
             raise IndexError(f"Index {idx} out of bounds.")
-        # Determine which dataset to get an item from based on the index.
-        start_idx = 0
-        dataset_idx = 0
-        for dataset in self._datasets:
-            if idx >= start_idx + dataset.num_samples:
-                start_idx += dataset.num_samples
-                dataset_idx += 1
-                continue
-            break
-        else:
-            raise AssertionError("We expect the loop to break out as long as the index is within bounds.")
-        item = self._datasets[dataset_idx][idx - start_idx]
+        dataset_idx = bisect.bisect_right(self.cumulative_sizes, idx)
+        start_idx = self.cumulative_sizes[dataset_idx - 1] if dataset_idx > 0 else 0
+        return dataset_idx, idx - start_idx
+
+    def _postprocess_item(self, item: dict, dataset_idx: int) -> dict:
         item["dataset_index"] = torch.tensor(dataset_idx)
         for data_key in self.disabled_data_keys:
             if data_key in item:
                 del item[data_key]
-
         return item
 
+    def __getitem__(self, idx: int) -> dict[str, torch.Tensor]:
+        dataset_idx, sample_idx = self._route(idx)
+        item = self._datasets[dataset_idx][sample_idx]
+        return self._postprocess_item(item, dataset_idx)
+
+    def __getitems__(self, indices: list[int]) -> list[dict]:
+        """Batched version of `__getitem__`, automatically used by `torch.utils.data.DataLoader`.
+
+        The indices are grouped by dataset, so that each dataset loads its part of the batch at once (see
+        `LeRobotDataset.__getitems__`).
+        """
+        positions_per_dataset = {}
+        for position, idx in enumerate(indices):
+            dataset_idx, sample_idx = self._route(int(idx))
+            positions_per_dataset.setdefault(dataset_idx, []).append((position, sample_idx))
+
+        items = [None] * len(indices)
+        for dataset_idx, positions in positions_per_dataset.items():
+            sample_indices = [sample_idx for _, sample_idx in positions]
+            dataset_items = self._datasets[dataset_idx].__getitems__(sample_indices)
+            for (position, _), item in zip(positions, dataset_items, strict=True):
+                items[position] = self._postprocess_item(item, dataset_idx)
+        return items
+
     def __repr__(self):
         return (
             f"{self.__class__.__name__}(\n"
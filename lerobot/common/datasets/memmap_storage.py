@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Columnar storage of the numeric columns of a LeRobotDataset, as numpy memmaps.
+
+Reading a row of the hugging face dataset goes through the Arrow table, then python objects, then
+`hf_transform_to_torch` which builds new tensors. This storage exports the numeric columns (e.g. states,
+actions, timestamps, indices) once into one `.npy` file per column, which are memory mapped:
+```
+columns
+├── columns_info.json
+├── action.npy
+├── episode_index.npy
+├── ...
+```
+The rows are then read from the memmaps with `torch.from_numpy`, without copy for single rows. The images,
+video frames and strings are still read from the hugging face dataset.
+
+The columns are stored with the dtypes returned by `hf_transform_to_torch` (float32 for floats, int64 for
+integers), so that the items are the same with both storages. The storage is rebuilt when it doesn't match the
+dataset anymore (i.e. when the fingerprint of the hugging face dataset changes).
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import datasets
+import numpy as np
+import torch
+
+from lerobot.common.datasets.utils import check_disk_space, make_build_dir, move_build_dir
+
+COLUMNS_INFO = "columns_info.json"
+# number of rows converted at once when exporting the columns
+EXPORT_BATCH_SIZE = 100_000
+
+
+def _get_column_dtype(feature) -> np.dtype | None:
+    """Returns the dtype of the memmap of a column, or None if the column can't be stored in a memmap."""
+    if isinstance(feature, datasets.Sequence):
+        feature = feature.feature
+    if not isinstance(feature, datasets.Value):
+        return None
+    if feature.dtype == "bool":
+        return np.dtype("bool")
+    if feature.dtype.startswith(("int", "uint")):
+        return np.dtype("int64")
+    if feature.dtype.startswith("float"):
+        return np.dtype("float32")
+    return None
+
+
+class ColumnarMemmapStorage:
+    """Numeric columns of a dataset, stored as numpy memmaps (see module docstring).
+
+    Args:
+        storage_dir: Directory of the storage. It is created, or rebuilt if it doesn't match the dataset.
+        hf_dataset: Dataset whose numeric columns are stored.
+    """
+
+    def __init__(self, storage_dir: Path, hf_dataset: datasets.Dataset):
+        self.storage_dir = Path(storage_dir)
+        self.expected_info = {"fingerprint": hf_dataset._fingerprint, "num_rows": len(hf_dataset)}
+        if not self.is_valid():
+            self.build(hf_dataset)
+        with open(self.storage_dir / COLUMNS_INFO) as f:
+            self.column_names = json.load(f)["columns"]
+        self._columns = None
+
+    def is_valid(self) -> bool:
+        info_path = self.storage_dir / COLUMNS_INFO
+        if not info_path.exists():
+            return False
+        with open(info_path) as f:
+            storage_info = json.load(f)
+        if any(storage_info.get(k) != v for k, v in self.expected_info.items()):
+            logging.info(f"The columnar storage in {self.storage_dir} doesn't match the dataset anymore.")
+            return False
+        return True
+
+    def build(self, hf_dataset: datasets.Dataset):
+        """Export the numeric columns into a temporary directory, which replaces the storage once complete (see
+        `move_build_dir`)."""
+        tmp_dir = make_build_dir(self.storage_dir)
+
+        dtypes = {}
+        for key, feature in hf_dataset.features.items():
+            if (dtype := _get_column_dtype(feature)) is not None:
+                dtypes[key] = dtype
+        numpy_dataset = hf_dataset.with_format("numpy", columns=list(dtypes))
+
+        logging.info(f"Exporting the columns {list(dtypes)} into the columnar storage {self.storage_dir}")
+        columns = {}
+        for start in range(0, len(hf_dataset), EXPORT_BATCH_SIZE):
+            batch = numpy_dataset[start : start + EXPORT_BATCH_SIZE]
+            for key in list(dtypes):
+                values = batch[key]
+                if values.dtype == object:
+                    # e.g. sequences of different lengths
+                    logging.warning(
+                        f"The column {key} doesn't have a fixed shape, it isn't stored in a memmap."
+                    )
+                    del dtypes[key]
+                    columns.pop(key, None)
+                    (tmp_dir / f"{key}.npy").unlink(missing_ok=True)
+                    continue
+                if key not in columns:
+                    shape = (len(hf_dataset), *values.shape[1:])
+                    check_disk_space(dtypes[key].itemsize * int(np.prod(shape)), tmp_dir)
+                    columns[key] = np.lib.format.open_memmap(
+                        tmp_dir / f"{key}.npy", mode="w+", dtype=dtypes[key], shape=shape
+                    )
+                columns[key][start : start + len(values)] = values
+        for column in columns.values():
+            column.flush()
+        del columns
+
+        with open(tmp_dir / COLUMNS_INFO, "w") as f:
+            json.dump({**self.expected_info, "columns": list(dtypes)}, f, indent=4)
+        move_build_dir(tmp_dir, self.storage_dir, self.is_valid)
+
+    @property
+    def columns(self) -> dict[str, np.memmap]:
+        if self._columns is None:
+            # copy-on-write mode, so that the rows can be wrapped in tensors without copy or warning
+            self._columns = {
+                key: np.load(self.storage_dir / f"{key}.npy", mmap_mode="c") for key in self.column_names
+            }
+        return self._columns
+
+    def get_item(self, idx: int, keys: list[str] | None = None) -> dict[str, torch.Tensor]:
+        """Returns the row `idx` of the columns `keys` (all by default), without copy for the sequence columns."""
+        keys = self.column_names if keys is None else keys
+        return {key: torch.from_numpy(np.asarray(self.columns[key][idx])) for key in keys}
+
+    def get_batch(self, indices: list[int], keys: list[str] | None = None) -> dict[str, torch.Tensor]:
+        """Returns the rows `indices` of the columns `keys` (all by default), stacked."""
+        keys = self.column_names if keys is None else keys
+        return {key: torch.from_numpy(self.columns[key][indices]) for key in keys}
+
+    def __getstate__(self):
+        # don't pickle the content of the memmaps (e.g. when spawning DataLoader workers)
+        state = self.__dict__.copy()
+        state["_columns"] = None
+        return state
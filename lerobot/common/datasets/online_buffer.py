@@ -21,12 +21,14 @@ faster than using HuggingFace Datasets as there's no conversion to an intermedia
 supports in-place slicing and mutation which is very handy for a dynamic buffer.
 """
 
+import io
 import os
 from pathlib import Path
 from typing import Any
 
 import numpy as np
 import torch
+from PIL import Image
 
 from lerobot.common.datasets.lerobot_dataset import LeRobotDataset
 
@@ -50,6 +52,31 @@ def _make_memmap_safe(**kwargs) -> np.memmap:
     return np.memmap(**kwargs)
 
 
+def _encode_image(image: np.ndarray, codec: str, quality: int) -> bytes:
+    """Encode a channel first image, either uint8 or float in [0, 1], with PIL."""
+    if image.dtype != np.uint8:
+        image = np.clip(np.round(image * 255), 0, 255).astype(np.uint8)
+    image = np.moveaxis(image, 0, -1)
+    if image.shape[-1] == 1:
+        image = image[..., 0]
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(
+        buffer, format=codec.upper(), **({"quality": quality} if codec == "jpeg" else {})
+    )
+    return buffer.getvalue()
+
+
+def _decode_image(data: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    """Decode an image encoded by `_encode_image` to a channel first image of the given dtype."""
+    image = np.asarray(Image.open(io.BytesIO(data.tobytes())))
+    if image.ndim == 2:
+        image = image[..., None]
+    image = np.moveaxis(image, -1, 0)
+    if dtype != np.uint8:
+        image = image.astype(dtype) / 255
+    return image
+
+
 class OnlineBuffer(torch.utils.data.Dataset):
     """FIFO data buffer for the online training loop in train.py.
 
@@ -59,16 +86,21 @@ class OnlineBuffer(torch.utils.data.Dataset):
     The underlying data structure will have data inserted in a circular fashion. Always insert after the
     last index, and when you reach the end, wrap around to the start.
 
-    The data is stored in a numpy memmap.
+    The data is stored in a numpy memmap. Optionally, images can be stored encoded with an image codec (see
+    `__init__`).
     """
 
     NEXT_INDEX_KEY = "_next_index"
+    NUM_SAMPLES_KEY = "_num_samples"
+    NUM_EPISODES_KEY = "_num_episodes"
+    GENERATION_KEY = "_generation"
     OCCUPANCY_MASK_KEY = "_occupancy_mask"
     INDEX_KEY = "index"
     FRAME_INDEX_KEY = "frame_index"
     EPISODE_INDEX_KEY = "episode_index"
     TIMESTAMP_KEY = "timestamp"
     IS_PAD_POSTFIX = "_is_pad"
+    IMAGE_CODECS = ("jpeg", "png")
 
     def __init__(
         self,
@@ -90,6 +122,12 @@ class OnlineBuffer(torch.utils.data.Dataset):
                 "dtype": np.dtype}}. This should include all the data that you wish to record into the buffer,
                 but note that "index", "frame_index" and "episode_index" are already accounted for by this
                 class, so you don't need to include them.
+                Images can be stored encoded by adding "codec": "jpeg" or "png" to their specification (channel
+                first, either uint8 or float in [0, 1]). The encoded images are then stored in a fixed size slot
+                per frame of "max_num_bytes" bytes (by default, the size of the raw image plus 4 KiB for the
+                headers). Only the bytes of the encoded images are written, so the memmap file is sparse and only
+                their size is used on disk and in the page cache. "quality" sets the quality of the jpeg codec
+                (95 by default).
             buffer_capacity: How many frames should be stored in the buffer as a maximum. Be aware of your
                 system's available disk space when choosing this.
             fps: Same as the fps concept in LeRobot dataset. Here it needs to be provided for the
@@ -105,16 +143,29 @@ class OnlineBuffer(torch.utils.data.Dataset):
         # minus 1e-4 to account for possible numerical error
         self.tolerance_s = 1 / self.fps - 1e-4 if fps is not None else None
         self._buffer_capacity = buffer_capacity
+        self._codecs = {k: v for k, v in data_spec.items() if v.get("codec") is not None}
         data_spec = self._make_data_spec(data_spec, buffer_capacity)
         Path(write_dir).mkdir(parents=True, exist_ok=True)
         self._data = {}
+        new_keys = set()
         for k, v in data_spec.items():
+            if not (Path(write_dir) / k).exists():
+                new_keys.add(k)
             self._data[k] = _make_memmap_safe(
                 filename=Path(write_dir) / k,
                 dtype=v["dtype"] if v is not None else None,
-                mode="r+" if (Path(write_dir) / k).exists() else "w+",
+                mode="w+" if k in new_keys else "r+",
                 shape=tuple(v["shape"]) if v is not None else None,
             )
+        if OnlineBuffer.NUM_SAMPLES_KEY in new_keys and OnlineBuffer.OCCUPANCY_MASK_KEY not in new_keys:
+            # buffer written before the number of samples was kept in the metadata
+            self._data[OnlineBuffer.NUM_SAMPLES_KEY][...] = np.count_nonzero(
+                self._data[OnlineBuffer.OCCUPANCY_MASK_KEY]
+            )
+        self._compute_episode_table()
+        if OnlineBuffer.NUM_EPISODES_KEY in new_keys and OnlineBuffer.OCCUPANCY_MASK_KEY not in new_keys:
+            # buffer written before the number of episodes was kept in the metadata
+            self._data[OnlineBuffer.NUM_EPISODES_KEY][...] = len(self._episode_indices)
 
     @property
     def delta_timestamps(self) -> dict[str, np.ndarray] | None:
@@ -152,6 +203,14 @@ class OnlineBuffer(torch.utils.data.Dataset):
             # _next_index will be a pointer to the next index that we should start filling from when we add
             # more data.
             OnlineBuffer.NEXT_INDEX_KEY: {"dtype": np.dtype("int64"), "shape": ()},
+            # _num_samples keeps count of the occupied indices, so that the length of the buffer doesn't need
+            # to be computed from the occupancy mask.
+            OnlineBuffer.NUM_SAMPLES_KEY: {"dtype": np.dtype("int64"), "shape": ()},
+            # _num_episodes keeps count of the episodes with frames in the buffer, for the same reason.
+            OnlineBuffer.NUM_EPISODES_KEY: {"dtype": np.dtype("int64"), "shape": ()},
+            # _generation is incremented each time data is added, so that the processes reading the buffer
+            # (e.g. the DataLoader workers) know when their episode table is out of date.
+            OnlineBuffer.GENERATION_KEY: {"dtype": np.dtype("int64"), "shape": ()},
             # Since the memmap is initialized with all-zeros, this keeps track of which indices are occupied
             # with real data rather than the dummy initialization.
             OnlineBuffer.OCCUPANCY_MASK_KEY: {"dtype": np.dtype("?"), "shape": (buffer_capacity,)},
@@ -161,9 +220,115 @@ class OnlineBuffer(torch.utils.data.Dataset):
             OnlineBuffer.TIMESTAMP_KEY: {"dtype": np.dtype("float64"), "shape": (buffer_capacity,)},
         }
         for k, v in data_spec.items():
-            complete_data_spec[k] = {"dtype": v["dtype"], "shape": (buffer_capacity, *v["shape"])}
+            if v.get("codec") is None:
+                complete_data_spec[k] = {"dtype": v["dtype"], "shape": (buffer_capacity, *v["shape"])}
+                continue
+            if v["codec"] not in OnlineBuffer.IMAGE_CODECS:
+                raise ValueError(
+                    f"The codec of {k} should be one of {OnlineBuffer.IMAGE_CODECS}, not {v['codec']}."
+                )
+            if len(v["shape"]) != 3:
+                raise ValueError(f"Only channel first images can be encoded, but {k} has shape {v['shape']}.")
+            max_num_bytes = v.get("max_num_bytes", int(np.prod(v["shape"])) + 4096)
+            complete_data_spec[k] = {"dtype": np.dtype("uint8"), "shape": (buffer_capacity, max_num_bytes)}
+            # number of bytes of the encoded image in each slot
+            complete_data_spec[self._num_bytes_key(k)] = {
+                "dtype": np.dtype("int64"),
+                "shape": (buffer_capacity,),
+            }
         return complete_data_spec
 
+    @staticmethod
+    def _num_bytes_key(key: str) -> str:
+        return f"_{key}_num_bytes"
+
+    def _read(self, key: str, positions: int | np.ndarray) -> np.ndarray:
+        """Read the data of a key at the given positions of the buffer, decoding the encoded images."""
+        if key not in self._codecs:
+            return self._data[key][positions]
+        positions = np.asarray(positions)
+        # only read the bytes of the encoded images, not the whole slots
+        images = [
+            _decode_image(self._data[key][pos, :num_bytes], self._codecs[key]["dtype"])
+            for pos, num_bytes in zip(
+                positions.reshape(-1),
+                self._data[self._num_bytes_key(key)][positions.reshape(-1)],
+                strict=True,
+            )
+        ]
+        return np.stack(images).reshape(*positions.shape, *self._codecs[key]["shape"])
+
+    def _write_encoded_images(self, key: str, images: np.ndarray | torch.Tensor, next_index: int):
+        """Encode images and write them in their slots, starting from next_index and wrapping around."""
+        codec, max_num_bytes = self._codecs[key]["codec"], self._data[key].shape[1]
+        encoded_images = [
+            _encode_image(np.asarray(image), codec, self._codecs[key].get("quality", 95)) for image in images
+        ]
+        if (num_bytes := max(len(data) for data in encoded_images)) > max_num_bytes:
+            raise ValueError(
+                f"An image of {key} takes {num_bytes} bytes once encoded with {codec}, but only {max_num_bytes} "
+                'bytes are available per frame. Increase its "max_num_bytes" in the data_spec.'
+            )
+        for i, data in enumerate(encoded_images):
+            pos = (next_index + i) % self._buffer_capacity
+            # only write the bytes of the encoded image, so that the rest of the slot stays sparse on disk
+            self._data[key][pos, : len(data)] = np.frombuffer(data, dtype=np.uint8)
+            self._data[self._num_bytes_key(key)][pos] = len(data)
+
+    def _compute_episode_table(self):
+        """Compute the table of the episodes in the buffer from the data (e.g. when loading an existing buffer).
+
+        The frames of an episode are contiguous in the buffer, modulo the wraparound. So the table stores, for
+        each episode index in the buffer (sorted), the position of its first frame which is still in the buffer
+        and its number of frames. It is then kept up to date in `add_data`, so that the frames of an episode
+        can be retrieved without scanning the whole buffer.
+
+        The table is kept in the memory of each process, so the processes which only read the buffer compute it
+        again when data was added by another process (see `_sync_episode_table`).
+        """
+        # read before the data, so that the table is computed again if data is being added meanwhile
+        self._episode_table_generation = self._data[OnlineBuffer.GENERATION_KEY].item()
+        # positions of the frames in the buffer from the oldest to the newest
+        order = np.roll(np.arange(self._buffer_capacity), -self._data[OnlineBuffer.NEXT_INDEX_KEY].item())
+        order = order[self._data[OnlineBuffer.OCCUPANCY_MASK_KEY][order]]
+        episode_indices = self._data[OnlineBuffer.EPISODE_INDEX_KEY][order]
+        firsts = np.flatnonzero(np.diff(episode_indices, prepend=episode_indices[:1] - 1))
+        self._episode_indices = episode_indices[firsts]
+        self._episode_starts = order[firsts]
+        self._episode_lengths = np.diff(firsts, append=len(order))
+
+    def _sync_episode_table(self):
+        """Compute the table of the episodes again if data was added to the buffer since it was computed, e.g. by
+        the main process when the buffer is read by forked DataLoader workers."""
+        if self._episode_table_generation != self._data[OnlineBuffer.GENERATION_KEY].item():
+            self._compute_episode_table()
+
+    def _update_episode_table(self, next_index: int, n_overwritten: int, new_episode_indices: np.ndarray):
+        """Update the table of the episodes (see `_compute_episode_table`) after adding data at `next_index`.
+
+        The `n_overwritten` frames that were overwritten are always the oldest ones, so they are removed from
+        the start of the oldest episodes.
+        """
+        if n_overwritten > 0:
+            cum_lengths = np.cumsum(self._episode_lengths)
+            n_removed = np.searchsorted(cum_lengths, n_overwritten, side="right")
+            self._episode_indices = self._episode_indices[n_removed:]
+            self._episode_starts = self._episode_starts[n_removed:]
+            self._episode_lengths = self._episode_lengths[n_removed:]
+            n_trimmed = n_overwritten - (cum_lengths[n_removed - 1] if n_removed > 0 else 0)
+            if n_trimmed > 0:
+                self._episode_starts[0] = (self._episode_starts[0] + n_trimmed) % self._buffer_capacity
+                self._episode_lengths[0] -= n_trimmed
+
+        firsts = np.flatnonzero(np.diff(new_episode_indices, prepend=new_episode_indices[:1] - 1))
+        self._episode_indices = np.concatenate([self._episode_indices, new_episode_indices[firsts]])
+        self._episode_starts = np.concatenate(
+            [self._episode_starts, (next_index + firsts) % self._buffer_capacity]
+        )
+        self._episode_lengths = np.concatenate(
+            [self._episode_lengths, np.diff(firsts, append=len(new_episode_indices))]
+        )
+
     def add_data(self, data: dict[str, np.ndarray]):
         """Add new data to the buffer, which could potentially mean shifting old data out.
 
@@ -180,7 +345,8 @@ class OnlineBuffer(torch.utils.data.Dataset):
         if not all(len(data[k]) == new_data_length for k in self.data_keys):
             raise ValueError("All data items should have the same length")
 
-        next_index = self._data[OnlineBuffer.NEXT_INDEX_KEY]
+        self._sync_episode_table()
+        next_index = self._data[OnlineBuffer.NEXT_INDEX_KEY].item()
 
         # Sanity check to make sure that the new data indices start from 0.
         assert data[OnlineBuffer.EPISODE_INDEX_KEY][0].item() == 0
@@ -195,7 +361,15 @@ class OnlineBuffer(torch.utils.data.Dataset):
 
         # Insert the new data starting from next_index. It may be necessary to wrap around to the start.
         n_surplus = max(0, new_data_length - (self._buffer_capacity - next_index))
+        n_overwritten = np.count_nonzero(
+            self._data[OnlineBuffer.OCCUPANCY_MASK_KEY][next_index : next_index + new_data_length]
+        ) + np.count_nonzero(self._data[OnlineBuffer.OCCUPANCY_MASK_KEY][:n_surplus])
+        self._update_episode_table(next_index, n_overwritten, data[OnlineBuffer.EPISODE_INDEX_KEY])
+        for k in self._codecs:
+            self._write_encoded_images(k, data[k], next_index)
         for k in self.data_keys:
+            if k in self._codecs:
+                continue
             if n_surplus == 0:
                 slc = slice(next_index, next_index + new_data_length)
                 self._data[k][slc] = data[k]
@@ -204,17 +378,20 @@ class OnlineBuffer(torch.utils.data.Dataset):
                 self._data[k][next_index:] = data[k][:-n_surplus]
                 self._data[OnlineBuffer.OCCUPANCY_MASK_KEY][next_index:] = True
                 self._data[k][:n_surplus] = data[k][-n_surplus:]
+        self._data[OnlineBuffer.NUM_SAMPLES_KEY][...] += new_data_length - n_overwritten
+        self._data[OnlineBuffer.NUM_EPISODES_KEY][...] = len(self._episode_indices)
+        # Write the next index in place, so that it is kept in the memmap when the buffer is reloaded.
         if n_surplus == 0:
-            self._data[OnlineBuffer.NEXT_INDEX_KEY] = next_index + new_data_length
+            self._data[OnlineBuffer.NEXT_INDEX_KEY][...] = next_index + new_data_length
         else:
-            self._data[OnlineBuffer.NEXT_INDEX_KEY] = n_surplus
+            self._data[OnlineBuffer.NEXT_INDEX_KEY][...] = n_surplus
+        # Only once all the data is written, so that the readers don't compute their table from partial data.
+        self._data[OnlineBuffer.GENERATION_KEY][...] += 1
+        self._episode_table_generation = self._data[OnlineBuffer.GENERATION_KEY].item()
 
     @property
     def data_keys(self) -> list[str]:
-        keys = set(self._data)
-        keys.remove(OnlineBuffer.OCCUPANCY_MASK_KEY)
-        keys.remove(OnlineBuffer.NEXT_INDEX_KEY)
-        return sorted(keys)
+        return sorted(k for k in self._data if not k.startswith("_"))
 
     @property
     def fps(self) -> float | None:
@@ -222,13 +399,11 @@ class OnlineBuffer(torch.utils.data.Dataset):
 
     @property
     def num_episodes(self) -> int:
-        return len(
-            np.unique(self._data[OnlineBuffer.EPISODE_INDEX_KEY][self._data[OnlineBuffer.OCCUPANCY_MASK_KEY]])
-        )
+        return self._data[OnlineBuffer.NUM_EPISODES_KEY].item()
 
     @property
     def num_samples(self) -> int:
-        return np.count_nonzero(self._data[OnlineBuffer.OCCUPANCY_MASK_KEY])
+        return self._data[OnlineBuffer.NUM_SAMPLES_KEY].item()
 
     def __len__(self):
         return self.num_samples
@@ -244,35 +419,46 @@ class OnlineBuffer(torch.utils.data.Dataset):
                 item_[k] = torch.tensor(v)
         return item_
 
+    def _get_episode_timestamps(self, episode_index: int) -> tuple[int, np.ndarray]:
+        """Returns the position in the buffer of the first frame of an episode, and the timestamps of its frames."""
+        self._sync_episode_table()
+        i = np.searchsorted(self._episode_indices, episode_index)
+        start, length = self._episode_starts[i], self._episode_lengths[i]
+        timestamps = self._data[OnlineBuffer.TIMESTAMP_KEY]
+        if start + length <= self._buffer_capacity:
+            return start, timestamps[start : start + length]
+        # the episode wraps around the end of the buffer
+        return start, np.concatenate(
+            [timestamps[start:], timestamps[: start + length - self._buffer_capacity]]
+        )
+
     def __getitem__(self, idx: int) -> dict[str, torch.Tensor]:
         if idx >= len(self) or idx < -len(self):
             raise IndexError
 
-        item = {k: v[idx] for k, v in self._data.items() if not k.startswith("_")}
+        item = {k: self._read(k, idx) for k in self.data_keys}
 
         if self.delta_timestamps is None:
             return self._item_to_tensors(item)
 
         episode_index = item[OnlineBuffer.EPISODE_INDEX_KEY]
         current_ts = item[OnlineBuffer.TIMESTAMP_KEY]
-        episode_data_indices = np.where(
-            np.bitwise_and(
-                self._data[OnlineBuffer.EPISODE_INDEX_KEY] == episode_index,
-                self._data[OnlineBuffer.OCCUPANCY_MASK_KEY],
-            )
-        )[0]
-        episode_timestamps = self._data[OnlineBuffer.TIMESTAMP_KEY][episode_data_indices]
+        episode_start, episode_timestamps = self._get_episode_timestamps(episode_index)
 
         for data_key in self.delta_timestamps:
-            # Note: The logic in this loop is copied from `load_previous_and_future_frames`.
+            # Note: The logic in this loop is copied from `load_previous_and_future_frames`, except that the
+            # timestamps of the episode are sorted so the closest ones are found with a binary search.
             # Get timestamps used as query to retrieve data of previous/future frames.
             query_ts = current_ts + self.delta_timestamps[data_key]
 
-            # Compute distances between each query timestamp and all timestamps of all the frames belonging to
-            # the episode.
-            dist = np.abs(query_ts[:, None] - episode_timestamps[None, :])
-            argmin_ = np.argmin(dist, axis=1)
-            min_ = dist[np.arange(dist.shape[0]), argmin_]
+            # Find the closest timestamps of the episode to each query timestamp, among the ones right before
+            # and right after it.
+            after = np.minimum(np.searchsorted(episode_timestamps, query_ts), len(episode_timestamps) - 1)
+            before = np.maximum(after - 1, 0)
+            dist_before = np.abs(query_ts - episode_timestamps[before])
+            dist_after = np.abs(query_ts - episode_timestamps[after])
+            argmin_ = np.where(dist_before <= dist_after, before, after)
+            min_ = np.minimum(dist_before, dist_after)
 
             is_pad = min_ > self.tolerance_s
 
@@ -285,15 +471,106 @@ class OnlineBuffer(torch.utils.data.Dataset):
             )
 
             # Load frames for this data key.
-            item[data_key] = self._data[data_key][episode_data_indices[argmin_]]
+            item[data_key] = self._read(data_key, (episode_start + argmin_) % self._buffer_capacity)
 
             item[f"{data_key}{OnlineBuffer.IS_PAD_POSTFIX}"] = is_pad
 
         return self._item_to_tensors(item)
 
+    def sample_batch(self, indices: np.ndarray | list[int]) -> dict[str, torch.Tensor]:
+        """Same as stacking the items `[self[idx] for idx in indices]`, but with one fancy indexing of the
+        memmaps per data key instead of going through the items one at a time.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if ((indices >= len(self)) | (indices < -len(self))).any():
+            raise IndexError
+        indices = np.where(indices < 0, indices + len(self), indices)
+
+        batch = {k: self._read(k, indices) for k in self.data_keys}
+
+        if self.delta_timestamps is not None:
+            self._sync_episode_table()
+            rows = np.searchsorted(self._episode_indices, batch[OnlineBuffer.EPISODE_INDEX_KEY])
+            # (batch_size, 1) so that they are broadcast with the (batch_size, num_deltas) query timestamps
+            episode_starts = self._episode_starts[rows][:, None]
+            episode_lengths = self._episode_lengths[rows][:, None]
+            timestamps = self._data[OnlineBuffer.TIMESTAMP_KEY]
+            first_ts = timestamps[episode_starts]
+            last_ts = timestamps[(episode_starts + episode_lengths - 1) % self._buffer_capacity]
+
+            for data_key in self.delta_timestamps:
+                # Same logic as in `__getitem__`, with a binary search in the frames of each episode.
+                query_ts = (
+                    batch[OnlineBuffer.TIMESTAMP_KEY][:, None] + self.delta_timestamps[data_key][None, :]
+                )
+                low = np.zeros_like(query_ts, dtype=np.int64)
+                high = np.broadcast_to(episode_lengths, query_ts.shape).copy()
+                for _ in range(int(episode_lengths.max()).bit_length()):
+                    is_searching = low < high
+                    mid = (low + high) // 2
+                    is_before = timestamps[(episode_starts + mid) % self._buffer_capacity] < query_ts
+                    low = np.where(is_searching & is_before, mid + 1, low)
+                    high = np.where(is_searching & ~is_before, mid, high)
+                after = np.minimum(low, episode_lengths - 1)
+                before = np.maximum(after - 1, 0)
+                dist_before = np.abs(query_ts - timestamps[(episode_starts + before) % self._buffer_capacity])
+                dist_after = np.abs(query_ts - timestamps[(episode_starts + after) % self._buffer_capacity])
+                argmin_ = np.where(dist_before <= dist_after, before, after)
+                min_ = np.minimum(dist_before, dist_after)
+
+                is_pad = min_ > self.tolerance_s
+
+                # Check violated query timestamps are all outside the episode range.
+                assert ((query_ts < first_ts) | (last_ts < query_ts) | ~is_pad).all(), (
+                    f"One or several timestamps unexpectedly violate the tolerance ({min_} > {self.tolerance_s=}"
+                    ") inside the episode range."
+                )
+
+                # Load frames for this data key.
+                batch[data_key] = self._read(data_key, (episode_starts + argmin_) % self._buffer_capacity)
+
+                batch[f"{data_key}{OnlineBuffer.IS_PAD_POSTFIX}"] = is_pad
+
+        return {k: torch.from_numpy(np.ascontiguousarray(v)) for k, v in batch.items()}
+
     def get_data_by_key(self, key: str) -> torch.Tensor:
         """Returns all data for a given data key as a Tensor."""
-        return torch.from_numpy(self._data[key][self._data[OnlineBuffer.OCCUPANCY_MASK_KEY]])
+        return torch.from_numpy(self._read(key, np.flatnonzero(self._data[OnlineBuffer.OCCUPANCY_MASK_KEY])))
+
+
+class ConcatDatasetWithOnlineBuffer(torch.utils.data.ConcatDataset):
+    """Concatenation of an offline dataset and an online buffer for the online training loop in train.py.
+
+    When used with a batch sampler, the batches are loaded with `__getitems__`: the items of the offline dataset
+    are loaded and collated as usual, while the items of the online buffer are loaded at once with
+    `OnlineBuffer.sample_batch`. The batch is then already collated, so the DataLoader should be created with
+    `collate_fn=torch.utils.data.default_convert`. Note that the items of the offline dataset come first in the
+    batch.
+    """
+
+    def __init__(self, offline_dataset: torch.utils.data.Dataset, online_dataset: OnlineBuffer):
+        super().__init__([offline_dataset, online_dataset])
+
+    def __getitems__(self, indices: list[int]) -> dict[str, torch.Tensor]:
+        offline_dataset, online_dataset = self.datasets
+        indices = np.asarray(indices)
+        is_offline = indices < self.cumulative_sizes[0]
+
+        batches = []
+        if is_offline.any():
+            offline_indices = indices[is_offline].tolist()
+            if hasattr(offline_dataset, "__getitems__"):
+                items = offline_dataset.__getitems__(offline_indices)
+            else:
+                items = [offline_dataset[idx] for idx in offline_indices]
+            batches.append(torch.utils.data.default_collate(items))
+        if not is_offline.all():
+            batches.append(online_dataset.sample_batch(indices[~is_offline] - self.cumulative_sizes[0]))
+
+        if len(batches) == 1:
+            return batches[0]
+        # only keep the keys which are provided by both datasets
+        return {k: torch.cat([batches[0][k], batches[1][k]]) for k in batches[0] if k in batches[1]}
 
 
 def compute_sampler_weights(
@@ -1,23 +1,49 @@
 """Functions to create an empty dataset, and populate it with frames."""
 # TODO(rcadene, aliberts): to adapt as class methods of next version of LeRobotDataset
 
+import bisect
 import concurrent
 import json
 import logging
 import multiprocessing
+import os
 import shutil
+import threading
+import time
+from functools import partial
 from pathlib import Path
 
-import torch
+import numpy as np
 import tqdm
 from PIL import Image
 
-from lerobot.common.datasets.compute_stats import compute_stats
+from lerobot.common.datasets.compute_stats import (
+    compute_sufficient_stats,
+    merge_sufficient_stats,
+    sufficient_stats_to_stats,
+)
+from lerobot.common.datasets.episode_buffer import (
+    EpisodeBuffer,
+    episode_to_table,
+    load_episodes,
+    write_episode_table,
+)
+from lerobot.common.datasets.frame_ring_buffer import FrameRingBuffer, SharedFrame
 from lerobot.common.datasets.lerobot_dataset import CODEBASE_VERSION, LeRobotDataset
-from lerobot.common.datasets.push_dataset_to_hub.aloha_hdf5_format import to_hf_dataset
-from lerobot.common.datasets.push_dataset_to_hub.utils import concatenate_episodes, get_default_encoding
-from lerobot.common.datasets.utils import calculate_episode_data_index, create_branch
-from lerobot.common.datasets.video_utils import encode_video_frames
+from lerobot.common.datasets.push_dataset_to_hub.utils import get_default_encoding
+from lerobot.common.datasets.utils import (
+    calculate_episode_data_index,
+    calculate_timestamps_index,
+    create_branch,
+    hf_transform_to_torch,
+    load_sufficient_stats,
+)
+from lerobot.common.datasets.video_utils import (
+    StreamingVideoEncoder,
+    compute_videos_index,
+    encode_video_frames,
+    is_ffmpeg_encoder_available,
+)
 from lerobot.common.utils.utils import log_say
 from lerobot.scripts.push_dataset_to_hub import (
     push_dataset_card_to_hub,
@@ -38,26 +64,60 @@ def safe_stop_image_writer(func):
         try:
             return func(*args, **kwargs)
         except Exception as e:
-            image_writer = kwargs.get("dataset", {}).get("image_writer")
+            dataset = kwargs.get("dataset", {})
+            image_writer = dataset.get("image_writer")
             if image_writer is not None:
                 print("Waiting for image writer to terminate...")
                 stop_image_writer(image_writer, timeout=20)
+            if "video_encoders" in dataset:
+                abort_video_encoders(dataset)
+            if "video_encoder" in dataset:
+                # the episodes which aren't encoded yet are encoded by `encode_videos` when recording is resumed
+                dataset["video_encoder"]["threads_pool"].shutdown(wait=False, cancel_futures=True)
             raise e
 
     return wrapper
 
 
+def get_image_path(key, frame_index, episode_index, videos_dir: str) -> Path:
+    return Path(videos_dir) / f"{key}_episode_{episode_index:06d}" / f"frame_{frame_index:06d}.png"
+
+
 def save_image(img_tensor, key, frame_index, episode_index, videos_dir: str):
     img = Image.fromarray(img_tensor.numpy())
-    path = Path(videos_dir) / f"{key}_episode_{episode_index:06d}" / f"frame_{frame_index:06d}.png"
+    path = get_image_path(key, frame_index, episode_index, videos_dir)
     path.parent.mkdir(parents=True, exist_ok=True)
-    img.save(str(path), quality=100)
+    # the image is renamed once written, so that a complete image is never mistaken for a partially written one
+    # (see `wait_for_episode_images`)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    img.save(str(tmp_path), format="PNG", quality=100)
+    tmp_path.replace(path)
+
+
+def save_queued_image(ring_buffers, num_dropped, image, key, frame_index, episode_index, videos_dir):
+    """Saves an image received by an image writer process, either sent through the queue or stored in a
+    `FrameRingBuffer` of the control process. The images which can't be saved are counted in `num_dropped`."""
+    try:
+        if isinstance(image, SharedFrame):
+            ring_buffer = ring_buffers[image.path]
+            try:
+                save_image(ring_buffer.get(image.slot), key, frame_index, episode_index, videos_dir)
+            finally:
+                ring_buffer.free(image.slot)
+        else:
+            save_image(image, key, frame_index, episode_index, videos_dir)
+    except Exception:
+        logging.exception(f"Failed to save the frame {frame_index} of {key} of episode {episode_index}")
+        with num_dropped.get_lock():
+            num_dropped.value += 1
 
 
-def loop_to_save_images_in_threads(image_queue, num_threads):
+def loop_to_save_images_in_threads(image_queue, num_threads, num_dropped):
     if num_threads < 1:
         raise NotImplementedError(f"Only `num_threads>=1` is supported for now, but {num_threads=} given.")
 
+    # ring buffers of the control process, opened when their first frame is received
+    ring_buffers = {}
     with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
         futures = []
         while True:
@@ -69,7 +129,20 @@ def loop_to_save_images_in_threads(image_queue, num_threads):
                 break
 
             image, key, frame_index, episode_index, videos_dir = frame_data
-            futures.append(executor.submit(save_image, image, key, frame_index, episode_index, videos_dir))
+            if isinstance(image, SharedFrame) and image.path not in ring_buffers:
+                ring_buffers[image.path] = FrameRingBuffer.open(image)
+            futures.append(
+                executor.submit(
+                    save_queued_image,
+                    ring_buffers,
+                    num_dropped,
+                    image,
+                    key,
+                    frame_index,
+                    episode_index,
+                    videos_dir,
+                )
+            )
 
         # Before exiting function, wait for all threads to complete
         with tqdm.tqdm(total=len(futures), desc="Writing images") as progress_bar:
@@ -77,7 +150,7 @@ def loop_to_save_images_in_threads(image_queue, num_threads):
             progress_bar.update(len(futures))
 
 
-def start_image_writer_processes(image_queue, num_processes, num_threads_per_process):
+def start_image_writer_processes(image_queue, num_processes, num_threads_per_process, num_dropped):
     if num_processes < 1:
         raise ValueError(f"Only `num_processes>=1` is supported, but {num_processes=} given.")
 
@@ -90,7 +163,7 @@ def start_image_writer_processes(image_queue, num_processes, num_threads_per_pro
     for _ in range(num_processes):
         process = multiprocessing.Process(
             target=loop_to_save_images_in_threads,
-            args=(image_queue, num_threads_per_process),
+            args=(image_queue, num_threads_per_process, num_dropped),
         )
         process.start()
         processes.append(process)
@@ -117,7 +190,20 @@ def stop_processes(processes, queue, timeout):
     queue.join_thread()
 
 
-def start_image_writer(num_processes, num_threads):
+# suffix of the empty file left in place of an image dropped by the image writer (see `fill_dropped_images`)
+DROPPED_IMAGE_SUFFIX = ".dropped"
+
+IMAGE_WRITER_POLICIES = ["block", "drop_oldest", "warn"]
+
+
+def start_image_writer(
+    num_processes,
+    num_threads,
+    num_ring_buffer_slots=64,
+    max_pending_images=1000,
+    policy="warn",
+    ring_buffer_max_wait_s=0,
+):
     """This function abstract away the initialisation of processes or/and threads to
     save images on disk asynchrounously, which is critical to control a robot and record data
     at a high frame rate.
@@ -129,21 +215,55 @@ def start_image_writer(num_processes, num_threads):
     The optimal number of processes and threads depends on your computer capabilities.
     We advise to use 4 threads per camera with 0 processes. If the fps is not stable, try to increase or lower
     the number of threads. If it is still not stable, try to use 1 subprocess, or more.
+
+    When `num_processes>0`, the frames of each camera are passed to the processes through a ring buffer of
+    `num_ring_buffer_slots` frames in shared memory (see `FrameRingBuffer`), instead of being pickled. When the
+    next slot of a ring buffer isn't freed by the processes within `ring_buffer_max_wait_s` seconds (by default,
+    without blocking the control loop), the frame is pickled instead, and counted as an overrun (see
+    `get_image_writer_metrics`). The frames of a camera whose ring buffer can't be allocated are all pickled.
+
+    When `num_processes=0`, at most `max_pending_images` images are queued or being written by the threads.
+    When an image is queued beyond this number, the `policy` is applied:
+    - "block": wait for an image to be written, which slows down the control loop.
+    - "drop_oldest": cancel the writing of the oldest queued image. It is replaced by the previous frame of its
+      episode once the images of the episode are written (see `fill_dropped_images`).
+    - "warn": queue the image anyway, and log a warning.
     """
     image_writer = {}
 
     if num_processes == 0:
-        futures = []
+        if max_pending_images < 1:
+            raise ValueError(f"Only `max_pending_images>=1` is supported, but {max_pending_images=} given.")
+        if policy not in IMAGE_WRITER_POLICIES:
+            raise ValueError(f"`policy` should be one of {IMAGE_WRITER_POLICIES}, but {policy=} given.")
         threads_pool = concurrent.futures.ThreadPoolExecutor(max_workers=num_threads)
-        image_writer["threads_pool"], image_writer["futures"] = threads_pool, futures
+        image_writer["threads_pool"] = threads_pool
+        # futures of the images which aren't written yet, in submission order, with the path of their image. The
+        # futures are removed once done, by `_on_image_written`.
+        image_writer["futures"] = {}
+        image_writer["lock"] = threading.Lock()
+        image_writer["max_pending_images"] = max_pending_images
+        image_writer["policy"] = policy
+        image_writer["is_full"] = False
+        image_writer["num_dropped"] = 0
+        image_writer["write_latency_s"] = None
     else:
         # TODO(rcadene): When using num_processes>1, `multiprocessing.Manager().Queue()`
         # might be better than `multiprocessing.Queue()`. Source: https://www.geeksforgeeks.org/python-multiprocessing-queue-vs-multiprocessing-manager-queue
         image_queue = multiprocessing.Queue()
+        num_dropped = multiprocessing.Value("q", 0)
         processes_pool = start_image_writer_processes(
-            image_queue, num_processes=num_processes, num_threads_per_process=num_threads
+            image_queue,
+            num_processes=num_processes,
+            num_threads_per_process=num_threads,
+            num_dropped=num_dropped,
         )
         image_writer["processes_pool"], image_writer["image_queue"] = processes_pool, image_queue
+        image_writer["num_dropped"] = num_dropped
+        # one ring buffer per camera, created at its first frame
+        image_writer["ring_buffers"] = {}
+        image_writer["num_ring_buffer_slots"] = num_ring_buffer_slots
+        image_writer["ring_buffer_max_wait_s"] = ring_buffer_max_wait_s
 
     return image_writer
 
@@ -154,22 +274,263 @@ def async_save_image(image_writer, image, key, frame_index, episode_index, video
     """
     if "threads_pool" in image_writer:
         threads_pool, futures = image_writer["threads_pool"], image_writer["futures"]
-        futures.append(threads_pool.submit(save_image, image, key, frame_index, episode_index, videos_dir))
+        _wait_for_pending_images(image_writer)
+        submit_t = time.perf_counter()
+        future = threads_pool.submit(save_image, image, key, frame_index, episode_index, videos_dir)
+        with image_writer["lock"]:
+            futures[future] = get_image_path(key, frame_index, episode_index, videos_dir)
+        future.add_done_callback(partial(_on_image_written, image_writer, submit_t))
     else:
-        image_queue = image_writer["image_queue"]
-        image_queue.put((image, key, frame_index, episode_index, videos_dir))
+        image_queue, ring_buffers = image_writer["image_queue"], image_writer["ring_buffers"]
+        if key not in ring_buffers:
+            try:
+                ring_buffers[key] = FrameRingBuffer(image.shape, image_writer["num_ring_buffer_slots"])
+            except RuntimeError as e:
+                logging.warning(
+                    f"The frames of {key} are pickled to be sent to the image writer processes: {e}"
+                )
+                ring_buffers[key] = None
+        # the frame is pickled when it doesn't fit in the ring buffer
+        shared_frame = None
+        if ring_buffers[key] is not None:
+            shared_frame = ring_buffers[key].put(image, image_writer["ring_buffer_max_wait_s"])
+        image_queue.put((shared_frame or image, key, frame_index, episode_index, videos_dir))
+
+
+def _wait_for_pending_images(image_writer):
+    # applies the policy of the image writer when `max_pending_images` images are already pending
+    futures, policy = image_writer["futures"], image_writer["policy"]
+    is_full = len(futures) >= image_writer["max_pending_images"]
+    if is_full and policy == "warn" and not image_writer["is_full"]:
+        logging.warning(
+            f"{image_writer['max_pending_images']} images are already waiting to be written. Consider "
+            "increasing the number of image writer threads."
+        )
+    image_writer["is_full"] = is_full
+    if policy == "drop_oldest" and is_full:
+        num_to_drop = len(futures) - image_writer["max_pending_images"] + 1
+        with image_writer["lock"]:
+            pending_futures = list(futures.items())
+        for future, path in pending_futures:
+            if num_to_drop == 0:
+                break
+            # the images which are being written can't be cancelled
+            if future.cancel():
+                num_to_drop -= 1
+                # the gap is filled once the other images of the episode are written
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.with_name(f"{path.name}{DROPPED_IMAGE_SUFFIX}").touch()
+    while len(futures) >= image_writer["max_pending_images"] and policy != "warn":
+        with image_writer["lock"]:
+            pending_futures = list(futures)
+        concurrent.futures.wait(pending_futures, return_when=concurrent.futures.FIRST_COMPLETED)
+
+
+def _on_image_written(image_writer, submit_t, future):
+    with image_writer["lock"]:
+        image_writer["futures"].pop(future, None)
+        if future.cancelled() or future.exception() is not None:
+            image_writer["num_dropped"] += 1
+        else:
+            image_writer["write_latency_s"] = time.perf_counter() - submit_t
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Failed to save an image: {future.exception()!r}")
+
+
+def get_image_writer_metrics(image_writer):
+    """Returns metrics of the image writer, e.g. to be displayed by `log_control_info`:
+    - "num_pending": number of images waiting to be written.
+    - "num_dropped": number of images which were dropped (see `start_image_writer`) or couldn't be written.
+    - "write_latency_s": time between the queuing and the writing of the last written image (threads only).
+    - "num_overruns": number of images which didn't fit in the ring buffers of the processes (processes only).
+    """
+    if "threads_pool" in image_writer:
+        with image_writer["lock"]:
+            return {
+                "num_pending": len(image_writer["futures"]),
+                "num_dropped": image_writer["num_dropped"],
+                "write_latency_s": image_writer["write_latency_s"],
+            }
+    ring_buffers = [
+        ring_buffer for ring_buffer in image_writer["ring_buffers"].values() if ring_buffer is not None
+    ]
+    return {
+        "num_pending": sum(ring_buffer.num_filled for ring_buffer in ring_buffers),
+        "num_overruns": sum(ring_buffer.num_overruns for ring_buffer in ring_buffers),
+        "num_dropped": image_writer["num_dropped"].value,
+    }
+
+
+def get_video_encoders_metrics(dataset):
+    """Returns metrics of the video encoders of the current episode, e.g. to be displayed by `log_control_info`:
+    - "num_pending": number of frames waiting to be encoded (see `StreamingVideoEncoder`).
+    """
+    return {"num_pending": sum(encoder.num_pending for encoder in dataset["video_encoders"].values())}
+
+
+def close_video_encoders(dataset):
+    """Waits for the videos of the current episode to be encoded (see `StreamingVideoEncoder`)."""
+    video_encoders = dataset["video_encoders"]
+    for encoder in video_encoders.values():
+        encoder.close()
+    video_encoders.clear()
+
+
+def abort_video_encoders(dataset):
+    """Stops encoding the videos of the current episode, and removes them."""
+    video_encoders = dataset["video_encoders"]
+    for encoder in video_encoders.values():
+        encoder.abort()
+    video_encoders.clear()
 
 
 def stop_image_writer(image_writer, timeout):
     if "threads_pool" in image_writer:
-        futures = image_writer["futures"]
+        with image_writer["lock"]:
+            futures = list(image_writer["futures"])
         # Before exiting function, wait for all threads to complete
         with tqdm.tqdm(total=len(futures), desc="Writing images") as progress_bar:
-            concurrent.futures.wait(futures, timeout=timeout)
-            progress_bar.update(len(futures))
+            _, not_done = concurrent.futures.wait(futures, timeout=timeout)
+            progress_bar.update(len(futures) - len(not_done))
+        metrics = get_image_writer_metrics(image_writer)
+        if len(not_done) > 0 or metrics["num_dropped"] > 0:
+            logging.warning(
+                f"{len(not_done)} images weren't written after {timeout} seconds, and {metrics['num_dropped']} "
+                "images were dropped."
+            )
     else:
         processes_pool, image_queue = image_writer["processes_pool"], image_writer["image_queue"]
         stop_processes(processes_pool, image_queue, timeout=timeout)
+        metrics = get_image_writer_metrics(image_writer)
+        if metrics["num_overruns"] > 0 or metrics["num_dropped"] > 0:
+            logging.warning(
+                f"{metrics['num_overruns']} frames didn't fit in the shared memory of the image writer, and "
+                f"{metrics['num_dropped']} frames couldn't be saved."
+            )
+        # removes the files of the ring buffers
+        image_writer["ring_buffers"].clear()
+
+
+########################################################################################
+# Asynchrounous encoding of the videos of the recorded episodes
+########################################################################################
+
+
+def _set_cpu_affinity(cpus):
+    # the ffmpeg processes started by the thread inherit its affinity
+    os.sched_setaffinity(threading.get_native_id(), cpus)
+
+
+def start_video_encoder(num_workers, max_pending_episodes, cpus=None):
+    """Starts a pool of threads encoding the videos of the recorded episodes in the background (see
+    `async_encode_episode_videos`), e.g. while the environment is reset and the next episode is recorded.
+
+    At most `max_pending_episodes` episodes are queued or being encoded. When `cpus` is provided, the ffmpeg
+    processes only run on these cpus, to leave the other cpus to the control loop and the image writer.
+    """
+    if num_workers < 1:
+        raise ValueError(f"Only `num_workers>=1` is supported, but {num_workers=} given.")
+    if max_pending_episodes < 1:
+        raise ValueError(f"Only `max_pending_episodes>=1` is supported, but {max_pending_episodes=} given.")
+
+    initializer, initargs = None, ()
+    if cpus is not None:
+        if hasattr(os, "sched_setaffinity"):
+            initializer, initargs = _set_cpu_affinity, (set(cpus),)
+        else:
+            logging.warning(
+                "Setting the cpu affinity of the video encoding isn't supported on this platform."
+            )
+
+    threads_pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=num_workers,
+        thread_name_prefix="video_encoder",
+        initializer=initializer,
+        initargs=initargs,
+    )
+    return {"threads_pool": threads_pool, "futures": [], "max_pending_episodes": max_pending_episodes}
+
+
+def fill_dropped_images(imgs_dir):
+    """Replaces the images of an episode which were dropped by the image writer (see `start_image_writer`) with
+    a copy of the previous written frame (or the first written frame for the first frames), so that the episode
+    has no missing frame."""
+    imgs_dir = Path(imgs_dir)
+    markers = sorted(imgs_dir.glob(f"frame_*.png{DROPPED_IMAGE_SUFFIX}"))
+    if len(markers) == 0:
+        return
+    written_paths = sorted(imgs_dir.glob("frame_*.png"))
+    if len(written_paths) == 0:
+        raise FileNotFoundError(f"All the images of {imgs_dir} were dropped.")
+    for marker in markers:
+        path = marker.with_suffix("")
+        # the frame indices are zero-padded, so the paths are sorted by frame index
+        i = bisect.bisect_left(written_paths, path)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        shutil.copyfile(written_paths[max(i - 1, 0)], tmp_path)
+        tmp_path.replace(path)
+        marker.unlink()
+    logging.warning(f"{len(markers)} images of {imgs_dir} were dropped, and replaced by the previous frames.")
+
+
+def wait_for_episode_images(imgs_dir, num_frames, timeout_s=20):
+    """Waits for the `num_frames` png images of an episode to be written by the image writer, or dropped, in
+    which case they are replaced by the previous frames (see `fill_dropped_images`). Raises a `TimeoutError` when
+    no image is written during `timeout_s` seconds."""
+    num_written, last_progress_t = -1, time.perf_counter()
+    while True:
+        num_written_now = len(list(imgs_dir.glob("frame_*.png"))) + len(
+            list(imgs_dir.glob(f"frame_*.png{DROPPED_IMAGE_SUFFIX}"))
+        )
+        if num_written_now >= num_frames:
+            fill_dropped_images(imgs_dir)
+            return
+        if num_written_now > num_written:
+            num_written, last_progress_t = num_written_now, time.perf_counter()
+        elif time.perf_counter() - last_progress_t > timeout_s:
+            raise TimeoutError(f"Only {num_written} of the {num_frames} images of {imgs_dir} were written.")
+        time.sleep(0.1)
+
+
+def encode_episode_videos(videos_dir, episode_index, image_keys, num_frames, fps):
+    for key in image_keys:
+        tmp_imgs_dir = videos_dir / f"{key}_episode_{episode_index:06d}"
+        video_path = videos_dir / f"{key}_episode_{episode_index:06d}.mp4"
+        if video_path.exists():
+            continue
+        wait_for_episode_images(tmp_imgs_dir, num_frames)
+        # the video is renamed once encoded, so that an interrupted encoding is done again when recording is
+        # resumed (see `encode_videos`)
+        tmp_video_path = video_path.with_name(f"{video_path.stem}.tmp.mp4")
+        encode_video_frames(tmp_imgs_dir, tmp_video_path, fps, overwrite=True)
+        tmp_video_path.replace(video_path)
+        shutil.rmtree(tmp_imgs_dir)
+
+
+def async_encode_episode_videos(video_encoder, videos_dir, episode_index, image_keys, num_frames, fps):
+    """Queues the encoding of the videos of a recorded episode, once its images are written. Blocks while
+    `max_pending_episodes` episodes are already queued or being encoded."""
+    threads_pool, futures = video_encoder["threads_pool"], video_encoder["futures"]
+    while len(futures) >= video_encoder["max_pending_episodes"]:
+        concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in [future for future in futures if future.done()]:
+            # raises the errors of the encoding
+            future.result()
+            futures.remove(future)
+    futures.append(
+        threads_pool.submit(encode_episode_videos, videos_dir, episode_index, image_keys, num_frames, fps)
+    )
+
+
+def stop_video_encoder(video_encoder):
+    """Waits for the videos of the queued episodes to be encoded."""
+    threads_pool, futures = video_encoder["threads_pool"], video_encoder["futures"]
+    with tqdm.tqdm(total=len(futures), desc="Encoding videos") as progress_bar:
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+            progress_bar.update(1)
+    futures.clear()
+    threads_pool.shutdown()
 
 
 ########################################################################################
@@ -186,7 +547,22 @@ def init_dataset(
     write_images,
     num_image_writer_processes,
     num_image_writer_threads,
+    max_pending_images=1000,
+    image_writer_policy="warn",
+    stream_video_encoding=False,
+    num_video_encoding_workers=0,
+    max_pending_video_encodings=2,
+    video_encoding_cpus=None,
 ):
+    if write_images and video and stream_video_encoding:
+        vcodec = get_default_encoding()["vcodec"]
+        if not is_ffmpeg_encoder_available(vcodec):
+            # fail before recording rather than at the first frame
+            raise RuntimeError(
+                f"Encoding the videos while recording requires `ffmpeg` with the {vcodec} encoder "
+                "(see `ffmpeg -encoders`)."
+            )
+
     local_dir = Path(root) / repo_id
     if local_dir.exists() and force_override:
         shutil.rmtree(local_dir)
@@ -217,91 +593,102 @@ def init_dataset(
         "num_episodes": num_episodes,
     }
 
-    if write_images:
+    if write_images and video and stream_video_encoding:
+        # The frames are encoded as they are recorded, instead of being saved as png images which are encoded
+        # at the end of the recording (see `encode_videos`). One encoder per camera, created at the first
+        # frame of each episode.
+        dataset["video_encoders"] = {}
+    elif write_images:
         # Initialize processes or/and threads dedicated to save images on disk asynchronously,
         # which is critical to control a robot and record data at a high frame rate.
         image_writer = start_image_writer(
             num_processes=num_image_writer_processes,
             num_threads=num_image_writer_threads,
+            max_pending_images=max_pending_images,
+            policy=image_writer_policy,
         )
         dataset["image_writer"] = image_writer
 
+        if video and num_video_encoding_workers > 0:
+            # Encode the videos of each episode in the background once it is recorded, instead of encoding the
+            # videos of all the episodes at the end of the recording.
+            dataset["video_encoder"] = start_video_encoder(
+                num_workers=num_video_encoding_workers,
+                max_pending_episodes=max_pending_video_encodings,
+                cpus=video_encoding_cpus,
+            )
+
     return dataset
 
 
 def add_frame(dataset, observation, action):
     if "current_episode" not in dataset:
-        # initialize episode dictionary
-        ep_dict = {}
-        for key in observation:
-            if key not in ep_dict:
-                ep_dict[key] = []
-        for key in action:
-            if key not in ep_dict:
-                ep_dict[key] = []
-
-        ep_dict["episode_index"] = []
-        ep_dict["frame_index"] = []
-        ep_dict["timestamp"] = []
-        ep_dict["next.done"] = []
-
-        dataset["current_episode"] = ep_dict
+        # initialize the buffers of the episode (see `EpisodeBuffer`)
+        dataset["current_episode"] = EpisodeBuffer()
         dataset["current_frame_index"] = 0
+        # the images are saved by the image writer or the video encoders, only their keys are kept
+        is_writing_images = "image_writer" in dataset or "video_encoders" in dataset
+        dataset["current_image_keys"] = [key for key in observation if "image" in key and is_writing_images]
 
-    ep_dict = dataset["current_episode"]
     episode_index = dataset["num_episodes"]
     frame_index = dataset["current_frame_index"]
     videos_dir = dataset["videos_dir"]
-    video = dataset["video"]
     fps = dataset["fps"]
 
-    ep_dict["episode_index"].append(episode_index)
-    ep_dict["frame_index"].append(frame_index)
-    ep_dict["timestamp"].append(frame_index / fps)
-    ep_dict["next.done"].append(False)
-
     img_keys = [key for key in observation if "image" in key]
     non_img_keys = [key for key in observation if "image" not in key]
 
-    # Save all observed modalities except images
-    for key in non_img_keys:
-        ep_dict[key].append(observation[key])
-
-    # Save actions
-    for key in action:
-        ep_dict[key].append(action[key])
+    # Save all observed modalities except images, and actions
+    frame = {key: observation[key] for key in non_img_keys}
+    frame.update(action)
+    frame["episode_index"] = episode_index
+    frame["frame_index"] = frame_index
+    frame["timestamp"] = np.float32(frame_index / fps)
+    frame["next.done"] = False
+    dataset["current_episode"].append(frame)
 
-    if "image_writer" not in dataset:
+    if "image_writer" not in dataset and "video_encoders" not in dataset:
         dataset["current_frame_index"] += 1
         return
 
     # Save images
-    image_writer = dataset["image_writer"]
     for key in img_keys:
-        imgs_dir = videos_dir / f"{key}_episode_{episode_index:06d}"
-        async_save_image(
-            image_writer,
-            image=observation[key],
-            key=key,
-            frame_index=frame_index,
-            episode_index=episode_index,
-            videos_dir=str(videos_dir),
-        )
-
-        if video:
-            fname = f"{key}_episode_{episode_index:06d}.mp4"
-            frame_info = {"path": f"videos/{fname}", "timestamp": frame_index / fps}
+        if "video_encoders" in dataset:
+            video_encoders = dataset["video_encoders"]
+            if key not in video_encoders:
+                video_path = videos_dir / f"{key}_episode_{episode_index:06d}.mp4"
+                video_encoders[key] = StreamingVideoEncoder(video_path, fps, **get_default_encoding())
+            video_encoders[key].add_frame(observation[key])
         else:
-            frame_info = str(imgs_dir / f"frame_{frame_index:06d}.png")
-
-        ep_dict[key].append(frame_info)
+            async_save_image(
+                dataset["image_writer"],
+                image=observation[key],
+                key=key,
+                frame_index=frame_index,
+                episode_index=episode_index,
+                videos_dir=str(videos_dir),
+            )
 
     dataset["current_frame_index"] += 1
 
 
+def get_frame_info(dataset, key, episode_index, frame_index):
+    """Returns the value of an image key of a frame in the dataset: the timestamp of the frame in the video of
+    the episode, or the path of the png image."""
+    if dataset["video"]:
+        fname = f"{key}_episode_{episode_index:06d}.mp4"
+        return {"path": f"videos/{fname}", "timestamp": frame_index / dataset["fps"]}
+    imgs_dir = dataset["videos_dir"] / f"{key}_episode_{episode_index:06d}"
+    return str(imgs_dir / f"frame_{frame_index:06d}.png")
+
+
 def delete_current_episode(dataset):
     del dataset["current_episode"]
     del dataset["current_frame_index"]
+    del dataset["current_image_keys"]
+
+    if "video_encoders" in dataset:
+        abort_video_encoders(dataset)
 
     # delete temporary images
     episode_index = dataset["num_episodes"]
@@ -312,24 +699,32 @@ def delete_current_episode(dataset):
 
 def save_current_episode(dataset):
     episode_index = dataset["num_episodes"]
-    ep_dict = dataset["current_episode"]
+    columns = dataset["current_episode"].columns
+    image_keys = dataset["current_image_keys"]
     episodes_dir = dataset["episodes_dir"]
     rec_info_path = dataset["rec_info_path"]
 
-    ep_dict["next.done"][-1] = True
+    columns["next.done"][-1] = True
 
-    for key in ep_dict:
-        if "observation" in key and "image" not in key:
-            ep_dict[key] = torch.stack(ep_dict[key])
+    if "video_encoders" in dataset:
+        close_video_encoders(dataset)
 
-    ep_dict["action"] = torch.stack(ep_dict["action"])
-    ep_dict["episode_index"] = torch.tensor(ep_dict["episode_index"])
-    ep_dict["frame_index"] = torch.tensor(ep_dict["frame_index"])
-    ep_dict["timestamp"] = torch.tensor(ep_dict["timestamp"])
-    ep_dict["next.done"] = torch.tensor(ep_dict["next.done"])
-
-    ep_path = episodes_dir / f"episode_{episode_index}.pth"
-    torch.save(ep_dict, ep_path)
+    image_columns = {
+        key: [get_frame_info(dataset, key, episode_index, i) for i in columns["frame_index"].tolist()]
+        for key in image_keys
+    }
+    ep_path = episodes_dir / f"episode_{episode_index}.arrow"
+    write_episode_table(episode_to_table(columns, image_columns, dataset["video"]), ep_path)
+
+    if "video_encoder" in dataset:
+        async_encode_episode_videos(
+            dataset["video_encoder"],
+            dataset["videos_dir"],
+            episode_index,
+            image_keys,
+            num_frames=len(columns["frame_index"]),
+            fps=dataset["fps"],
+        )
 
     rec_info = {
         "last_episode_index": episode_index,
@@ -337,8 +732,9 @@ def save_current_episode(dataset):
     with open(rec_info_path, "w") as f:
         json.dump(rec_info, f)
 
-    # force re-initialization of episode dictionnary during add_frame
+    # force re-initialization of episode buffers during add_frame
     del dataset["current_episode"]
+    del dataset["current_image_keys"]
 
     dataset["num_episodes"] += 1
 
@@ -351,7 +747,8 @@ def encode_videos(dataset, image_keys, play_sounds):
     local_dir = dataset["local_dir"]
     fps = dataset["fps"]
 
-    # Use ffmpeg to convert frames stored as png into mp4 videos
+    # Use ffmpeg to convert frames stored as png into mp4 videos. The videos encoded during the recording (see
+    # `StreamingVideoEncoder`) already exist.
     for episode_index in tqdm.tqdm(range(num_episodes)):
         for key in image_keys:
             # key = f"observation.images.{name}"
@@ -361,6 +758,7 @@ def encode_videos(dataset, image_keys, play_sounds):
             if video_path.exists():
                 # Skip if video is already encoded. Could be the case when resuming data recording.
                 continue
+            fill_dropped_images(tmp_imgs_dir)
             # note: `encode_video_frames` is a blocking call. Making it asynchronous shouldn't speedup encoding,
             # since video encoding with ffmpeg is already using multithreading.
             encode_video_frames(tmp_imgs_dir, video_path, fps, overwrite=True)
@@ -377,18 +775,18 @@ def from_dataset_to_lerobot_dataset(dataset, play_sounds):
     fps = dataset["fps"]
     repo_id = dataset["repo_id"]
 
-    ep_dicts = []
-    for episode_index in tqdm.tqdm(range(num_episodes)):
-        ep_path = episodes_dir / f"episode_{episode_index}.pth"
-        ep_dict = torch.load(ep_path)
-        ep_dicts.append(ep_dict)
-    data_dict = concatenate_episodes(ep_dicts)
+    # the episodes are memory-mapped, not loaded in memory
+    hf_dataset = load_episodes(episodes_dir, num_episodes, video)
+    hf_dataset.set_transform(hf_transform_to_torch)
 
     if video:
-        image_keys = [key for key in data_dict if "image" in key]
+        image_keys = [key for key in hf_dataset.features if "image" in key]
         encode_videos(dataset, image_keys, play_sounds)
+    else:
+        for imgs_dir in videos_dir.glob("*_episode_*"):
+            if imgs_dir.is_dir():
+                fill_dropped_images(imgs_dir)
 
-    hf_dataset = to_hf_dataset(data_dict, video)
     episode_data_index = calculate_episode_data_index(hf_dataset)
 
     info = {
@@ -410,18 +808,49 @@ def from_dataset_to_lerobot_dataset(dataset, play_sounds):
     return lerobot_dataset
 
 
-def save_lerobot_dataset_on_disk(lerobot_dataset):
+def update_sufficient_stats(lerobot_dataset):
+    """Compute the sufficient statistics of the dataset (see `compute_sufficient_stats`).
+
+    When recording is resumed, the sufficient statistics saved by the previous consolidation are only updated
+    with the frames of the new episodes, instead of decoding all the frames again.
+    """
+    meta_data_dir = lerobot_dataset.videos_dir.parent / "meta_data"
+    previous = load_sufficient_stats(meta_data_dir)
+    if previous is not None:
+        sufficient_stats, num_frames = previous
+        if num_frames == len(lerobot_dataset):
+            return sufficient_stats
+        if num_frames < len(lerobot_dataset):
+            logging.info(
+                f"Updating the dataset statistics with {len(lerobot_dataset) - num_frames} new frames"
+            )
+            new_sufficient_stats = compute_sufficient_stats(
+                lerobot_dataset, indices=range(num_frames, len(lerobot_dataset))
+            )
+            # the previous statistics can't be reused if the features of the dataset changed
+            if new_sufficient_stats.keys() == sufficient_stats.keys():
+                return merge_sufficient_stats(sufficient_stats, new_sufficient_stats)
+        logging.warning("The previous dataset statistics don't match the dataset, recomputing them.")
+
+    return compute_sufficient_stats(lerobot_dataset)
+
+
+def save_lerobot_dataset_on_disk(lerobot_dataset, sufficient_stats=None):
     hf_dataset = lerobot_dataset.hf_dataset
     info = lerobot_dataset.info
     stats = lerobot_dataset.stats
     episode_data_index = lerobot_dataset.episode_data_index
+    timestamps_index = calculate_timestamps_index(hf_dataset)
     local_dir = lerobot_dataset.videos_dir.parent
     meta_data_dir = local_dir / "meta_data"
+    videos_index = compute_videos_index(lerobot_dataset.videos_dir) if lerobot_dataset.video else None
 
     hf_dataset = hf_dataset.with_format(None)  # to remove transforms that cant be saved
     hf_dataset.save_to_disk(str(local_dir / "train"))
 
-    save_meta_data(info, stats, episode_data_index, meta_data_dir)
+    save_meta_data(
+        info, stats, episode_data_index, meta_data_dir, timestamps_index, videos_index, sufficient_stats
+    )
 
 
 def push_lerobot_dataset_to_hub(lerobot_dataset, tags):
@@ -451,16 +880,22 @@ def create_lerobot_dataset(dataset, run_compute_stats, push_to_hub, tags, play_s
         image_writer = dataset["image_writer"]
         stop_image_writer(image_writer, timeout=20)
 
+    if "video_encoder" in dataset:
+        logging.info("Waiting for the videos of the last episodes to be encoded...")
+        stop_video_encoder(dataset["video_encoder"])
+
     lerobot_dataset = from_dataset_to_lerobot_dataset(dataset, play_sounds)
 
+    sufficient_stats = None
     if run_compute_stats:
         log_say("Computing dataset statistics", play_sounds)
-        lerobot_dataset.stats = compute_stats(lerobot_dataset)
+        sufficient_stats = update_sufficient_stats(lerobot_dataset)
+        lerobot_dataset.stats = sufficient_stats_to_stats(sufficient_stats)
     else:
         logging.info("Skipping computation of the dataset statistics")
         lerobot_dataset.stats = {}
 
-    save_lerobot_dataset_on_disk(lerobot_dataset)
+    save_lerobot_dataset_on_disk(lerobot_dataset, sufficient_stats)
 
     if push_to_hub:
         push_lerobot_dataset_to_hub(lerobot_dataset, tags)
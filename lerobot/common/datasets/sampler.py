@@ -13,7 +13,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from typing import Iterator, Union
+import itertools
+from typing import Callable, Iterable, Iterator, Union
 
 import torch
 
@@ -59,3 +60,147 @@ class EpisodeAwareSampler:
 
     def __len__(self) -> int:
         return len(self.indices)
+
+
+class WeightedEpisodeAwareSampler:
+    def __init__(
+        self,
+        episode_data_indices: list[dict],
+        dataset_sizes: list[int] | None = None,
+        dataset_weights: list[float] | None = None,
+        episode_weights: list[list[float] | torch.Tensor | None] | None = None,
+        drop_n_first_frames: int = 0,
+        drop_n_last_frames: int = 0,
+        num_samples: int | None = None,
+        generator: torch.Generator | None = None,
+    ):
+        """Sampler drawing frames with replacement from a mixture of datasets, with weights per dataset and per
+        episode (e.g. to sample more from a dataset, or from successful episodes).
+
+        A frame is drawn by picking a dataset according to `dataset_weights`, then an episode of this dataset
+        according to `episode_weights`, then a frame of this episode uniformly. Only the start and the number of
+        frames of each episode are stored (instead of the indices of all the frames), and the indices are drawn
+        in vectorized chunks.
+
+        Args:
+            episode_data_indices: One `episode_data_index` per dataset (e.g. of each dataset of a
+                `MultiLeRobotDataset`), with keys 'from' and 'to' containing the start and end indices of each
+                episode. The datasets are assumed to be concatenated in this order.
+            dataset_sizes: Number of frames of each dataset, used to offset the indices of the next datasets. If
+                None, the end of the last episode of each dataset is used.
+            dataset_weights: Relative weight of each dataset. If None, the datasets are weighted by their number
+                of frames.
+            episode_weights: Relative weights of the episodes of each dataset (or None for a dataset). If None,
+                the episodes are weighted by their number of frames, so that all the frames of a dataset are
+                equally likely.
+            drop_n_first_frames: Number of frames to drop from the start of each episode.
+            drop_n_last_frames: Number of frames to drop from the end of each episode.
+            num_samples: Number of indices drawn per iteration over the sampler. If None, the total number of
+                frames which can be sampled.
+            generator: Generator used for sampling.
+        """
+        if dataset_sizes is None:
+            dataset_sizes = [int(edi["to"][-1]) if len(edi["to"]) > 0 else 0 for edi in episode_data_indices]
+        if len(dataset_sizes) != len(episode_data_indices):
+            raise ValueError("Expected one dataset size per `episode_data_index`.")
+        if episode_weights is None:
+            episode_weights = [None] * len(episode_data_indices)
+        if len(episode_weights) != len(episode_data_indices):
+            raise ValueError("Expected one list of episode weights (or None) per `episode_data_index`.")
+
+        offsets = [0, *itertools.accumulate(dataset_sizes)][:-1]
+        starts, lengths, probs = [], [], []
+        for dataset_idx, (edi, offset) in enumerate(zip(episode_data_indices, offsets, strict=True)):
+            start = torch.as_tensor(edi["from"], dtype=torch.int64) + drop_n_first_frames
+            end = torch.as_tensor(edi["to"], dtype=torch.int64) - drop_n_last_frames
+            length = (end - start).clamp(min=0)
+            if episode_weights[dataset_idx] is None:
+                weights = length.type(torch.float64)
+            else:
+                weights = torch.as_tensor(episode_weights[dataset_idx], dtype=torch.float64)
+                if weights.shape != length.shape:
+                    raise ValueError(
+                        f"Expected {len(length)} episode weights for dataset {dataset_idx}, but "
+                        f"{len(weights)} given."
+                    )
+                if (weights < 0).any():
+                    raise ValueError(f"Episode weights of dataset {dataset_idx} should be non-negative.")
+                # episodes without any frame left can't be sampled
+                weights = torch.where(length > 0, weights, 0)
+            starts.append(start + offset)
+            lengths.append(length.type(torch.int32))
+            probs.append(weights / weights.sum() if weights.sum() > 0 else weights)
+
+        num_frames = torch.tensor([length.sum().item() for length in lengths], dtype=torch.float64)
+        if dataset_weights is None:
+            dataset_weights = num_frames
+        dataset_weights = torch.tensor([float(w) for w in dataset_weights], dtype=torch.float64)
+        if dataset_weights.shape != num_frames.shape:
+            raise ValueError(f"Expected {len(num_frames)} dataset weights, but {len(dataset_weights)} given.")
+        if (dataset_weights < 0).any():
+            raise ValueError("Dataset weights should be non-negative.")
+        # datasets without any episode left can't be sampled
+        dataset_weights = torch.where(torch.stack([p.sum() for p in probs]) > 0, dataset_weights, 0)
+        if dataset_weights.sum() == 0:
+            raise ValueError("There is no frame to sample from.")
+        dataset_weights = dataset_weights / dataset_weights.sum()
+
+        # one entry per episode of all the datasets
+        self.episode_starts = torch.cat(starts)
+        self.episode_lengths = torch.cat(lengths)
+        self.episode_probs = torch.cat([w * p for w, p in zip(dataset_weights, probs, strict=True)])
+        self.num_samples = num_samples if num_samples is not None else int(num_frames.sum().item())
+        self.generator = generator
+
+    def __iter__(self) -> Iterator[int]:
+        chunk_size = 2**16
+        for chunk_start in range(0, self.num_samples, chunk_size):
+            n = min(chunk_size, self.num_samples - chunk_start)
+            episodes = torch.multinomial(self.episode_probs, n, replacement=True, generator=self.generator)
+            frames = (
+                torch.rand(n, dtype=torch.float64, generator=self.generator) * self.episode_lengths[episodes]
+            )
+            yield from (self.episode_starts[episodes] + frames.type(torch.int64)).tolist()
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+
+class PrefetchSampler:
+    def __init__(
+        self,
+        sampler: Iterable[int],
+        prefetch_fn: Callable[[list[int]], None],
+        num_prefetched_indices: int = 1000,
+    ):
+        """Sampler yielding the indices of another sampler, while calling `prefetch_fn` on the indices which
+        will be yielded next (e.g. `LeRobotDataset.prefetch_videos` to download the videos of the upcoming
+        episodes while the current ones are being loaded).
+
+        Args:
+            sampler: Sampler whose indices are yielded.
+            prefetch_fn: Function called on each chunk of upcoming indices, before the previous chunk is yielded.
+            num_prefetched_indices: Number of indices per chunk.
+        """
+        if num_prefetched_indices < 1:
+            raise ValueError(
+                f"`num_prefetched_indices` should be at least 1, but {num_prefetched_indices=} given."
+            )
+        self.sampler = sampler
+        self.prefetch_fn = prefetch_fn
+        self.num_prefetched_indices = num_prefetched_indices
+
+    def __iter__(self) -> Iterator[int]:
+        iterator = iter(self.sampler)
+        chunk = list(itertools.islice(iterator, self.num_prefetched_indices))
+        if len(chunk) > 0:
+            self.prefetch_fn(chunk)
+        while len(chunk) > 0:
+            next_chunk = list(itertools.islice(iterator, self.num_prefetched_indices))
+            if len(next_chunk) > 0:
+                self.prefetch_fn(next_chunk)
+            yield from chunk
+            chunk = next_chunk
+
+    def __len__(self) -> int:
+        return len(self.sampler)
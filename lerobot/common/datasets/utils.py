@@ -13,18 +13,26 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import contextlib
 import json
+import os
 import re
+import shutil
+import tempfile
 import warnings
+from collections import OrderedDict
 from functools import cache
 from pathlib import Path
-from typing import Dict
+from typing import Callable, Dict
 
 import datasets
+import numpy as np
 import torch
 from datasets import load_dataset, load_from_disk
 from huggingface_hub import DatasetCard, HfApi, hf_hub_download, snapshot_download
+from huggingface_hub.utils import EntryNotFoundError
 from PIL import Image as PILImage
+from safetensors import safe_open
 from safetensors.torch import load_file
 from torchvision import transforms
 
@@ -69,16 +77,20 @@ def unflatten_dict(d, sep="/"):
     return outdict
 
 
-def hf_transform_to_torch(items_dict: dict[torch.Tensor | None]):
+def hf_transform_to_torch(items_dict: dict[torch.Tensor | None], image_dtype: torch.dtype = torch.float32):
     """Get a transform function that convert items from Hugging Face dataset (pyarrow)
     to torch tensors. Importantly, images are converted from PIL, which corresponds to
     a channel last representation (h w c) of uint8 type, to a torch image representation
     with channel first (c h w) of float32 type in range [0,1].
+
+    When `image_dtype` is `torch.uint8`, images are kept as uint8 in range [0,255] (still channel first), e.g.
+    to reduce the size of the batches sent by the DataLoader workers. Use
+    `functools.partial(hf_transform_to_torch, image_dtype=torch.uint8)` as transform.
     """
     for key in items_dict:
         first_item = items_dict[key][0]
         if isinstance(first_item, PILImage.Image):
-            to_tensor = transforms.ToTensor()
+            to_tensor = transforms.PILToTensor() if image_dtype == torch.uint8 else transforms.ToTensor()
             items_dict[key] = [to_tensor(img) for img in items_dict[key]]
         elif isinstance(first_item, str):
             # TODO (michel-aractingi): add str2embedding via language tokenizer
@@ -165,6 +177,52 @@ def load_episode_data_index(repo_id, version, root) -> dict[str, torch.Tensor]:
     return load_file(path)
 
 
+def calculate_timestamps_index(hf_dataset: datasets.Dataset) -> torch.Tensor:
+    """Gather the timestamps of all the frames of the dataset into one contiguous tensor.
+
+    Combined with `episode_data_index`, it allows to retrieve the timestamps of any episode with a slice
+    instead of going through the Arrow table, e.g. `timestamps_index[from_id:to_id]`.
+    """
+    if len(hf_dataset) == 0:
+        return torch.tensor([])
+    timestamps = hf_dataset.with_format("numpy")["timestamp"]
+    return torch.from_numpy(timestamps)
+
+
+def load_timestamps_index(repo_id, version, root, hf_dataset: datasets.Dataset) -> torch.Tensor:
+    """timestamps_index contains the timestamps of all the frames of the dataset in one contiguous tensor.
+
+    It is loaded from "meta_data/timestamps_index.safetensors" when available, otherwise it is computed from
+    the "timestamp" column of `hf_dataset`.
+
+    Example:
+    ```python
+    from_id = episode_data_index["from"][episode_id].item()
+    to_id = episode_data_index["to"][episode_id].item()
+    episode_timestamps = timestamps_index[from_id:to_id]
+    ```
+    """
+    path = None
+    if root is not None:
+        path = Path(root) / repo_id / "meta_data" / "timestamps_index.safetensors"
+        if not path.exists():
+            path = None
+    else:
+        safe_version = get_hf_dataset_safe_version(repo_id, version)
+        # datasets created with a previous version of the codebase don't store it
+        with contextlib.suppress(EntryNotFoundError):
+            path = hf_hub_download(
+                repo_id, "meta_data/timestamps_index.safetensors", repo_type="dataset", revision=safe_version
+            )
+
+    if path is not None:
+        timestamps_index = load_file(path)["timestamp"]
+        if len(timestamps_index) == len(hf_dataset):
+            return timestamps_index
+
+    return calculate_timestamps_index(hf_dataset)
+
+
 def load_stats(repo_id, version, root) -> dict[str, dict[str, torch.Tensor]]:
     """stats contains the statistics per modality computed over the full dataset, such as max, min, mean, std
 
@@ -185,6 +243,26 @@ def load_stats(repo_id, version, root) -> dict[str, dict[str, torch.Tensor]]:
     return unflatten_dict(stats)
 
 
+def load_sufficient_stats(meta_data_dir: Path) -> tuple[dict[str, dict[str, torch.Tensor]], int] | None:
+    """sufficient_stats contains the statistics from which stats can be updated with new frames without
+    recomputing them over the full dataset (see `merge_sufficient_stats`), and the number of frames they were
+    computed on. They are only stored by datasets recorded locally.
+
+    Example:
+    ```python
+    sufficient_stats, num_frames = load_sufficient_stats(meta_data_dir)
+    new_sufficient_stats = compute_sufficient_stats(dataset, indices=range(num_frames, len(dataset)))
+    stats = sufficient_stats_to_stats(merge_sufficient_stats(sufficient_stats, new_sufficient_stats))
+    ```
+    """
+    path = Path(meta_data_dir) / "sufficient_stats.safetensors"
+    if not path.exists():
+        return None
+    with safe_open(path, framework="pt") as f:
+        num_frames = int(f.metadata()["num_frames"])
+    return unflatten_dict(load_file(path)), num_frames
+
+
 def load_info(repo_id, version, root) -> dict:
     """info contains useful information regarding the dataset that are not stored elsewhere
 
@@ -204,11 +282,53 @@ def load_info(repo_id, version, root) -> dict:
     return info
 
 
-def load_videos(repo_id, version, root) -> Path:
+def load_videos_index(repo_id, version, root) -> dict[str, dict] | None:
+    """videos_index contains the timestamps of the key frames of each video, which are used to decide whether
+    a video decoder should seek or keep decoding (see `VideoDecoder`). Returns None when the dataset doesn't
+    store it, in which case it is computed when a video is opened for the first time.
+
+    Example:
+    ```python
+    keyframes_ts = videos_index["videos/observation.image_episode_000000.mp4"]["keyframes_ts"]
+    ```
+    """
+    path = None
+    if root is not None:
+        path = Path(root) / repo_id / "meta_data" / "videos_index.json"
+        if not path.exists():
+            return None
+    else:
+        safe_version = get_hf_dataset_safe_version(repo_id, version)
+        # datasets created with a previous version of the codebase don't store it
+        with contextlib.suppress(EntryNotFoundError):
+            path = hf_hub_download(
+                repo_id, "meta_data/videos_index.json", repo_type="dataset", revision=safe_version
+            )
+        if path is None:
+            return None
+
+    with open(path) as f:
+        videos_index = json.load(f)
+    return videos_index
+
+
+def load_videos(repo_id, version, root, lazy: bool = False) -> Path:
+    """Returns the directory of the mp4 files of the dataset.
+
+    When the dataset is on the hub, all its videos are downloaded, unless `lazy` is True. In that case, only the
+    directory where the videos are downloaded in the cache of the hub is returned, and the videos are expected
+    to be downloaded when they are first accessed (see `VideoFetcher`).
+    """
     if root is not None:
         path = Path(root) / repo_id / "videos"
+    elif lazy:
+        safe_version = get_hf_dataset_safe_version(repo_id, version)
+        # the files of a revision are all stored in the same snapshot directory of the cache
+        info_path = hf_hub_download(
+            repo_id, "meta_data/info.json", repo_type="dataset", revision=safe_version
+        )
+        path = Path(info_path).parents[1] / "videos"
     else:
-        # TODO(rcadene): we download the whole repo here. see if we can avoid this
         safe_version = get_hf_dataset_safe_version(repo_id, version)
         repo_dir = snapshot_download(repo_id, repo_type="dataset", revision=safe_version)
         path = Path(repo_dir) / "videos"
@@ -222,6 +342,8 @@ def load_previous_and_future_frames(
     episode_data_index: dict[str, torch.Tensor],
     delta_timestamps: dict[str, list[float]],
     tolerance_s: float,
+    timestamps_index: torch.Tensor | None = None,
+    columns: dict[str, np.ndarray] | None = None,
 ) -> dict[torch.Tensor]:
     """
     Given a current item in the dataset containing a timestamp (e.g. 0.6 seconds), and a list of time differences of
@@ -249,6 +371,11 @@ def load_previous_and_future_frames(
     - tolerance_s (float, optional): The tolerance level (in seconds) used to determine if a data point is close enough to the query
       timestamp by asserting `tol > difference`. It is suggested to set `tol` to a smaller value than the
       smallest expected inter-frame period, but large enough to account for jitter.
+    - timestamps_index (torch.Tensor, optional): The timestamps of all the frames of the dataset in one contiguous
+      tensor (see `load_timestamps_index`). When provided, the timestamps of the episode are sliced from it instead
+      of being loaded from `hf_dataset`, so that the cost of this function doesn't depend on the episode length.
+    - columns (dict, optional): Columns of the dataset stored as arrays (see `ColumnarMemmapStorage`). The frames of
+      the modalities which are in `columns` are read from them instead of `hf_dataset`.
 
     Returns:
     - The same item with the queried frames for each modality specified in delta_timestamps, with an additional key for
@@ -262,11 +389,13 @@ def load_previous_and_future_frames(
     ep_id = item["episode_index"].item()
     ep_data_id_from = episode_data_index["from"][ep_id].item()
     ep_data_id_to = episode_data_index["to"][ep_id].item()
-    ep_data_ids = torch.arange(ep_data_id_from, ep_data_id_to, 1)
 
     # load timestamps
-    ep_timestamps = hf_dataset.select_columns("timestamp")[ep_data_id_from:ep_data_id_to]["timestamp"]
-    ep_timestamps = torch.stack(ep_timestamps)
+    if timestamps_index is not None:
+        ep_timestamps = timestamps_index[ep_data_id_from:ep_data_id_to]
+    else:
+        ep_timestamps = hf_dataset.select_columns("timestamp")[ep_data_id_from:ep_data_id_to]["timestamp"]
+        ep_timestamps = torch.stack(ep_timestamps)
 
     # we make the assumption that the timestamps are sorted
     ep_first_ts = ep_timestamps[0]
@@ -278,9 +407,8 @@ def load_previous_and_future_frames(
         delta_ts = delta_timestamps[key]
         query_ts = current_ts + torch.tensor(delta_ts)
 
-        # compute distances between each query timestamp and all timestamps of all the frames belonging to the episode
-        dist = torch.cdist(query_ts[:, None], ep_timestamps[:, None], p=1)
-        min_, argmin_ = dist.min(1)
+        # find the closest frame of the episode for each query timestamp
+        min_, argmin_ = find_closest_timestamps(query_ts, ep_timestamps)
 
         # TODO(rcadene): synchronize timestamps + interpolation if needed
 
@@ -293,9 +421,13 @@ def load_previous_and_future_frames(
         )
 
         # get dataset indices corresponding to frames to be loaded
-        data_ids = ep_data_ids[argmin_]
+        data_ids = ep_data_id_from + argmin_
 
         # load frames modality
+        if columns is not None and key in columns:
+            item[key] = torch.from_numpy(columns[key][data_ids.numpy()])
+            item[f"{key}_is_pad"] = is_pad
+            continue
         item[key] = hf_dataset.select_columns(key)[data_ids][key]
 
         if isinstance(item[key][0], dict) and "path" in item[key][0]:
@@ -309,6 +441,153 @@ def load_previous_and_future_frames(
     return item
 
 
+def find_closest_timestamps(
+    query_ts: torch.Tensor,
+    timestamps: torch.Tensor,
+    from_ids: torch.Tensor | None = None,
+    to_ids: torch.Tensor | None = None,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """For each query timestamp, find the closest timestamp in a sorted tensor of timestamps.
+
+    It relies on a binary search and only compares each query timestamp to its two neighbours, instead of
+    computing the distances to all the timestamps.
+
+    When `from_ids` and `to_ids` are provided (one per query timestamp), each query timestamp is only searched
+    in `timestamps[from_id:to_id]`, which is expected to be sorted. This allows to search the frames of many
+    episodes at once in the contiguous `timestamps_index` of a dataset.
+
+    Returns:
+    - The distance between each query timestamp and its closest timestamp.
+    - The index in `timestamps` of the closest timestamp. In case of a tie, the smallest index is returned.
+    """
+    query_ts = query_ts.to(timestamps.dtype)
+    if from_ids is None or to_ids is None:
+        from_ids = torch.zeros(query_ts.shape, dtype=torch.long)
+        to_ids = torch.full(query_ts.shape, len(timestamps), dtype=torch.long)
+        right = torch.searchsorted(timestamps, query_ts)
+    else:
+        # vectorized binary search of the first index `i` in `[from_id, to_id)` such that
+        # `timestamps[i] >= query_ts`, or `to_id` if there is none (same as `torch.searchsorted`)
+        low, high = from_ids.clone(), to_ids.clone()
+        while (is_active := low < high).any():
+            mid = (low + high) // 2
+            go_right = is_active & (timestamps[mid.clamp(max=len(timestamps) - 1)] < query_ts)
+            low = torch.where(go_right, mid + 1, low)
+            high = torch.where(is_active & ~go_right, mid, high)
+        right = low
+    right = torch.minimum(right, to_ids - 1)
+    left = torch.maximum(right - 1, from_ids)
+    dist_left = (query_ts - timestamps[left]).abs()
+    dist_right = (query_ts - timestamps[right]).abs()
+    is_left = dist_left <= dist_right
+    min_ = torch.where(is_left, dist_left, dist_right)
+    argmin_ = torch.where(is_left, left, right)
+    return min_, argmin_
+
+
+def load_previous_and_future_frames_batch(
+    batch: dict[str, list],
+    hf_dataset: datasets.Dataset,
+    episode_data_index: dict[str, torch.Tensor],
+    delta_timestamps: dict[str, list[float]],
+    tolerance_s: float,
+    timestamps_index: torch.Tensor,
+    columns: dict[str, np.ndarray] | None = None,
+) -> dict[str, torch.Tensor | list]:
+    """Batched version of `load_previous_and_future_frames`.
+
+    `batch` is the result of `hf_dataset[indices]` (a dictionary of lists, one element per item). The frames of
+    all the items are looked up at once in `timestamps_index`, then for each modality all the frames are loaded
+    from `hf_dataset` with a single query (or from `columns` for the modalities which are in `columns`).
+
+    Returns:
+    - The same batch with, for each modality specified in delta_timestamps, a tensor of shape
+      (batch_size, len(delta_timestamps[key]), ...) (or a list of lists of video frame dictionaries in video mode),
+      and an additional boolean tensor of shape (batch_size, len(delta_timestamps[key])) for each modality
+      (e.g. "observation.image_is_pad").
+    """
+    ep_ids = torch.stack(batch["episode_index"])
+    ep_data_ids_from = episode_data_index["from"][ep_ids]
+    ep_data_ids_to = episode_data_index["to"][ep_ids]
+    ep_first_ts = timestamps_index[ep_data_ids_from]
+    ep_last_ts = timestamps_index[ep_data_ids_to - 1]
+    current_ts = torch.stack(batch["timestamp"])
+
+    for key in delta_timestamps:
+        # get timestamps used as query to retrieve data of previous/future frames, shape (batch_size, num_deltas)
+        delta_ts = torch.tensor(delta_timestamps[key])
+        query_ts = current_ts[:, None] + delta_ts[None, :]
+        num_deltas = len(delta_ts)
+
+        min_, argmin_ = find_closest_timestamps(
+            query_ts.flatten(),
+            timestamps_index,
+            ep_data_ids_from.repeat_interleave(num_deltas),
+            ep_data_ids_to.repeat_interleave(num_deltas),
+        )
+        min_, data_ids = min_.view(-1, num_deltas), argmin_.view(-1, num_deltas)
+
+        is_pad = min_ > tolerance_s
+
+        # check violated query timestamps are all outside the episode range
+        is_outside = (query_ts < ep_first_ts[:, None]) | (ep_last_ts[:, None] < query_ts)
+        assert is_outside[is_pad].all(), (
+            f"One or several timestamps unexpectedly violate the tolerance ({min_[is_pad & ~is_outside]} > "
+            f"{tolerance_s=}) inside episode range. This might be due to synchronization issues with timestamps "
+            "during data collection."
+        )
+
+        # load frames modality of all the items at once
+        if columns is not None and key in columns:
+            batch[key] = torch.from_numpy(columns[key][data_ids.numpy()])
+            batch[f"{key}_is_pad"] = is_pad
+            continue
+        frames = hf_dataset.select_columns(key)[data_ids.flatten().tolist()][key]
+
+        if isinstance(frames[0], dict) and "path" in frames[0]:
+            # video mode where frame are expressed as dict of path and timestamp
+            batch[key] = [frames[i : i + num_deltas] for i in range(0, len(frames), num_deltas)]
+        else:
+            frames = torch.stack(frames)
+            batch[key] = frames.view(-1, num_deltas, *frames.shape[1:])
+
+        batch[f"{key}_is_pad"] = is_pad
+
+    return batch
+
+
+def _cached_by_fingerprint(
+    cache: OrderedDict, hf_dataset: datasets.Dataset, compute: Callable, maxsize: int = 8
+):
+    """Returns `compute(hf_dataset)`, cached by the fingerprint of the dataset in the least recently used `cache`.
+
+    Datasets loaded from the same files have the same fingerprint, so that loading a split (or a dataset of a
+    `MultiLeRobotDataset`) again doesn't recompute its episode indices.
+    """
+    key = hf_dataset._fingerprint
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    cache[key] = compute(hf_dataset)
+    if len(cache) > maxsize:
+        cache.popitem(last=False)
+    return cache[key]
+
+
+def _get_episode_index_column(hf_dataset: datasets.Dataset) -> np.ndarray:
+    return np.asarray(hf_dataset.with_format("numpy")["episode_index"])
+
+
+def _compute_episode_data_index(hf_dataset: datasets.Dataset) -> tuple[np.ndarray, np.ndarray]:
+    episode_index = _get_episode_index_column(hf_dataset)
+    # an episode starts at each row whose episode index differs from the one of the previous row
+    starts = np.flatnonzero(np.diff(episode_index)) + 1
+    return np.concatenate([[0], starts]), np.concatenate([starts, [len(episode_index)]])
+
+
+_episode_data_index_cache = OrderedDict()
+
+
 def calculate_episode_data_index(hf_dataset: datasets.Dataset) -> Dict[str, torch.Tensor]:
     """
     Calculate episode data index for the provided HuggingFace Dataset. Relies on episode_index column of hf_dataset.
@@ -320,21 +599,19 @@ def calculate_episode_data_index(hf_dataset: datasets.Dataset) -> Dict[str, torc
     - episode_data_index: A dictionary containing the data index for each episode. The dictionary has two keys:
         - "from": A tensor containing the starting index of each episode.
         - "to": A tensor containing the ending index of each episode.
-    """
-    episode_data_index = {"from": [], "to": []}
 
-    current_episode = None
-    """
     The episode_index is a list of integers, each representing the episode index of the corresponding example.
     For instance, the following is a valid episode_index:
       [0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 2]
 
-    Below, we iterate through the episode_index and populate the episode_data_index dictionary with the starting and
-    ending index of each episode. For the episode_index above, the episode_data_index dictionary will look like this:
+    A new episode starts at every change of episode index, so that the episode_data_index dictionary for the
+    episode_index above is:
         {
             "from": [0, 3, 7],
             "to": [3, 7, 12]
         }
+
+    The episode indices are read at once from the Arrow table, and the result is cached by dataset fingerprint.
     """
     if len(hf_dataset) == 0:
         episode_data_index = {
@@ -342,25 +619,19 @@ def calculate_episode_data_index(hf_dataset: datasets.Dataset) -> Dict[str, torc
             "to": torch.tensor([]),
         }
         return episode_data_index
-    for idx, episode_idx in enumerate(hf_dataset["episode_index"]):
-        if episode_idx != current_episode:
-            # We encountered a new episode, so we append its starting location to the "from" list
-            episode_data_index["from"].append(idx)
-            # If this is not the first episode, we append the ending location of the previous episode to the "to" list
-            if current_episode is not None:
-                episode_data_index["to"].append(idx)
-            # Let's keep track of the current episode index
-            current_episode = episode_idx
-        else:
-            # We are still in the same episode, so there is nothing for us to do here
-            pass
-    # We have reached the end of the dataset, so we append the ending location of the last episode to the "to" list
-    episode_data_index["to"].append(idx + 1)
+    from_ids, to_ids = _cached_by_fingerprint(
+        _episode_data_index_cache, hf_dataset, _compute_episode_data_index
+    )
+    return {"from": torch.from_numpy(from_ids.copy()), "to": torch.from_numpy(to_ids.copy())}
+
+
+def _compute_reset_episode_index(hf_dataset: datasets.Dataset) -> np.ndarray:
+    # position of the episode index of each row among the sorted unique episode indices
+    _, reset_episode_index = np.unique(_get_episode_index_column(hf_dataset), return_inverse=True)
+    return reset_episode_index.astype(np.int64)
 
-    for k in ["from", "to"]:
-        episode_data_index[k] = torch.tensor(episode_data_index[k])
 
-    return episode_data_index
+_reset_episode_index_cache = OrderedDict()
 
 
 def reset_episode_index(hf_dataset: datasets.Dataset) -> datasets.Dataset:
@@ -369,22 +640,18 @@ def reset_episode_index(hf_dataset: datasets.Dataset) -> datasets.Dataset:
     `episode_data_index` (and related functionality such as `load_previous_and_future_frames`) requires the
     `episode_index` to be sorted, continuous (1,1,1 and not 1,2,1) and start at 0.
 
-    This brings the `episode_index` to the required format.
+    This brings the `episode_index` to the required format. The column is replaced at once in the Arrow table,
+    and the new episode indices are cached by dataset fingerprint.
     """
     if len(hf_dataset) == 0:
         return hf_dataset
-    unique_episode_idxs = torch.stack(hf_dataset["episode_index"]).unique().tolist()
-    episode_idx_to_reset_idx_mapping = {
-        ep_id: reset_ep_id for reset_ep_id, ep_id in enumerate(unique_episode_idxs)
-    }
-
-    def modify_ep_idx_func(example):
-        example["episode_index"] = episode_idx_to_reset_idx_mapping[example["episode_index"].item()]
-        return example
-
-    hf_dataset = hf_dataset.map(modify_ep_idx_func)
-
-    return hf_dataset
+    episode_index = _cached_by_fingerprint(
+        _reset_episode_index_cache, hf_dataset, _compute_reset_episode_index
+    )
+    column_names = hf_dataset.column_names
+    hf_dataset = hf_dataset.remove_columns("episode_index").add_column("episode_index", episode_index)
+    # keep the original order of the columns
+    return hf_dataset.select_columns(column_names)
 
 
 def cycle(iterable):
@@ -400,6 +667,50 @@ def cycle(iterable):
             iterator = iter(iterable)
 
 
+def check_disk_space(required_space: int, directory: Path):
+    """Same check as `_make_memmap_safe` in online_buffer.py, for several memmaps at once."""
+    stats = os.statvfs(directory)
+    available_space = stats.f_bavail * stats.f_frsize  # bytes
+    if required_space >= available_space * 0.8:
+        raise RuntimeError(f"You're about to take up {required_space} of {available_space} bytes available.")
+
+
+def make_build_dir(target_dir: Path) -> Path:
+    """Creates an empty directory with a unique name next to `target_dir`, in which the content of `target_dir`
+    (e.g. a cache) is built before being moved into place with `move_build_dir`. Its name is unique, so that
+    several processes (e.g. with DDP) can build the same cache at once."""
+    target_dir = Path(target_dir)
+    target_dir.parent.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(prefix=f"{target_dir.name}.tmp.", dir=target_dir.parent))
+
+
+def move_build_dir(build_dir: Path, target_dir: Path, is_valid: Callable[[], bool]):
+    """Replaces `target_dir` by `build_dir` (see `make_build_dir`) with atomic renames.
+
+    When another process has already moved a valid directory into place (as checked by `is_valid`), it is kept
+    and `build_dir` is discarded.
+    """
+    build_dir, target_dir = Path(build_dir), Path(target_dir)
+    if is_valid():
+        shutil.rmtree(build_dir)
+        return
+    # the outdated directory is moved aside rather than removed in place, so that `target_dir` never has a
+    # partial content
+    stale_dir = Path(tempfile.mkdtemp(prefix=f"{target_dir.name}.stale.", dir=target_dir.parent))
+    try:
+        with contextlib.suppress(FileNotFoundError):
+            target_dir.rename(stale_dir / target_dir.name)
+        try:
+            build_dir.rename(target_dir)
+        except OSError:
+            # another process moved its directory into place in the meantime
+            shutil.rmtree(build_dir)
+            if not target_dir.is_dir():
+                raise
+    finally:
+        shutil.rmtree(stale_dir, ignore_errors=True)
+
+
 def create_branch(repo_id, *, branch: str, repo_type: str | None = None):
     """Create a branch on a existing Hugging Face repo. Delete the branch if it already
     exists before creating it.
@@ -13,18 +13,30 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import itertools
 import logging
+import os
+import queue
+import shutil
 import subprocess
+import threading
 import warnings
 from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, suppress
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, ClassVar
+from typing import Any, ClassVar, Iterator
 
+import av
+import numpy as np
 import pyarrow as pa
 import torch
 import torchvision
 from datasets.features.features import register_feature
+from huggingface_hub import hf_hub_download
+
+from lerobot.common.datasets.utils import find_closest_timestamps
 
 
 def load_from_videos(
@@ -33,43 +45,526 @@ def load_from_videos(
     videos_dir: Path,
     tolerance_s: float,
     backend: str = "pyav",
+    decoder_pool: "VideoDecoderPool | None" = None,
+    image_dtype: torch.dtype = torch.float32,
+    video_fetcher: "VideoFetcher | None" = None,
 ):
     """Note: When using data workers (e.g. DataLoader with num_workers>0), do not call this function
     in the main process (e.g. by using a second Dataloader with num_workers=0). It will result in a Segmentation Fault.
     This probably happens because a memory reference to the video loader is created in the main process and a
     subprocess fails to access it.
+
+    All the frames requested from the same video are decoded in one pass. When a `decoder_pool` is provided,
+    videos are kept open between calls (see `VideoDecoderPool`), and the videos of the different cameras are
+    decoded concurrently in the threads of the pool.
+
+    The frames are float32 in [0,1] range, or uint8 in [0,255] range when `image_dtype` is `torch.uint8`.
+
+    When a `video_fetcher` is provided, the videos are fetched from the hub when they are first accessed, instead
+    of being expected in `videos_dir`.
     """
     # since video path already contains "videos" (e.g. videos_dir="data/videos", path="videos/episode_0.mp4")
     data_dir = videos_dir.parent
 
+    # group the requested frames by video, keeping their position to restore the original order
+    # Note: multiple frames are expected when delta_timestamps is not None, and they can be spread over
+    # several videos
+    requests = []
     for key in video_frame_keys:
+        frames = item[key] if isinstance(item[key], list) else [item[key]]
+        positions_per_path = {}
+        for position, frame in enumerate(frames):
+            positions_per_path.setdefault(frame["path"], []).append(position)
+        for path, positions in positions_per_path.items():
+            timestamps = [frames[position]["timestamp"] for position in positions]
+            video_path = video_fetcher.fetch(path) if video_fetcher is not None else data_dir / path
+            requests.append((key, video_path, positions, timestamps))
+
+    def decode(request):
+        _, video_path, _, timestamps = request
+        return decode_video_frames_torchvision(
+            video_path, timestamps, tolerance_s, backend, decoder_pool=decoder_pool, image_dtype=image_dtype
+        )
+
+    if decoder_pool is not None and decoder_pool.num_threads > 1 and len(requests) > 1:
+        decoded_frames = list(decoder_pool.executor.map(decode, requests))
+    else:
+        decoded_frames = [decode(request) for request in requests]
+
+    frames_per_key = {}
+    for (key, _, positions, _), frames in zip(requests, decoded_frames, strict=True):
+        frames_per_key.setdefault(key, {}).update(zip(positions, frames, strict=True))
+
+    for key in video_frame_keys:
+        frames = frames_per_key[key]
         if isinstance(item[key], list):
-            # load multiple frames at once (expected when delta_timestamps is not None)
-            timestamps = [frame["timestamp"] for frame in item[key]]
-            paths = [frame["path"] for frame in item[key]]
-            if len(set(paths)) > 1:
-                raise NotImplementedError("All video paths are expected to be the same for now.")
-            video_path = data_dir / paths[0]
-
-            frames = decode_video_frames_torchvision(video_path, timestamps, tolerance_s, backend)
-            item[key] = frames
+            item[key] = torch.stack([frames[position] for position in range(len(frames))])
         else:
-            # load one frame
-            timestamps = [item[key]["timestamp"]]
-            video_path = data_dir / item[key]["path"]
-
-            frames = decode_video_frames_torchvision(video_path, timestamps, tolerance_s, backend)
             item[key] = frames[0]
 
     return item
 
 
+def get_video_shape(video_path: str | Path) -> tuple[int, int, int]:
+    """Returns the number of frames, the height and the width of a video.
+
+    The frames are counted from the packets of the video stream, no frame is decoded.
+    """
+    with av.open(str(video_path)) as container:
+        stream = container.streams.video[0]
+        height, width = stream.codec_context.height, stream.codec_context.width
+        num_frames = sum(1 for packet in container.demux(stream) if packet.size > 0)
+    return num_frames, height, width
+
+
+def get_video_index(video_path: str | Path) -> dict[str, list[float]]:
+    """Returns the timestamps (in seconds) of all the frames ("frames_ts") and of the key frames ("keyframes_ts")
+    of a video.
+
+    Only the packets of the video stream are read, no frame is decoded. The timestamps are the same as the ones
+    of the decoded frames.
+    """
+    frames_ts, keyframes_ts = [], []
+    with av.open(str(video_path)) as container:
+        stream = container.streams.video[0]
+        for packet in container.demux(stream):
+            if packet.pts is None:
+                continue
+            frames_ts.append(float(packet.pts * stream.time_base))
+            if packet.is_keyframe:
+                keyframes_ts.append(frames_ts[-1])
+    return {"frames_ts": sorted(frames_ts), "keyframes_ts": sorted(keyframes_ts)}
+
+
+def compute_videos_index(videos_dir: Path) -> dict[str, dict[str, list[float]]]:
+    """Index the frames and the key frames of all the mp4 videos of a dataset (see `get_video_index`).
+
+    The keys are the video paths relative to the dataset directory, as they are stored in `VideoFrame`
+    (e.g. "videos/observation.image_episode_000000.mp4").
+    """
+    videos_dir = Path(videos_dir)
+    return {
+        str(video_path.relative_to(videos_dir.parent)): get_video_index(video_path)
+        for video_path in sorted(videos_dir.glob("*.mp4"))
+    }
+
+
+class VideoDecoder:
+    """Keeps a video open to decode frames at several timestamps without reopening the video each time.
+
+    The frames decoded since the last seek are kept, so that a request for frames which have already been
+    decoded, or which are after the current position and before the next key frame, doesn't require to seek
+    back to the previous key frame and to decode the group of pictures again.
+
+    Args:
+        video_path: Path to the mp4 file.
+        backend: Backend of `torchvision.io.VideoReader`, "pyav" or "video_reader".
+        keyframes_ts: Timestamps of the key frames of the video (see `get_video_index`). When None,
+            the decoder always seeks to the previous key frame, unless all the requested frames are cached.
+        max_cached_frames: Number of most recently decoded frames kept between two calls to `decode`.
+        frames_ts: Timestamps of all the frames of the video (see `get_video_index`). When provided (with
+            `keyframes_ts`), frames can be decoded by frame number (see `decode_frames`).
+    """
+
+    def __init__(
+        self,
+        video_path: str | Path,
+        backend: str = "pyav",
+        keyframes_ts: list[float] | None = None,
+        max_cached_frames: int = 4,
+        frames_ts: list[float] | None = None,
+    ):
+        self.video_path = str(video_path)
+        self.backend = backend
+        self.keyframes_ts = torch.tensor(keyframes_ts) if keyframes_ts is not None else None
+        # float64 like the timestamps of the decoded frames, to match them exactly
+        self.all_frames_ts = torch.tensor(frames_ts, dtype=torch.float64) if frames_ts is not None else None
+        self.max_cached_frames = max_cached_frames
+
+        torchvision.set_video_backend(backend)
+        # TODO(rcadene): also load audio stream at the same time
+        self.reader = torchvision.io.VideoReader(self.video_path, "video")
+
+        # a decoder can only be used by one thread at a time
+        self.lock = threading.Lock()
+
+        # frames decoded consecutively since the last seek, in increasing order of timestamps
+        self.frames = []
+        self.frames_ts = []
+        self.is_exhausted = False
+
+    def _must_seek(self, first_ts: float) -> bool:
+        if len(self.frames_ts) == 0 or first_ts < self.frames_ts[0]:
+            return True
+        if first_ts <= self.frames_ts[-1] or self.is_exhausted:
+            # the requested frames start inside the cached frames
+            return False
+        if self.keyframes_ts is None:
+            return True
+        # keep decoding from the current position when seeking would land before it
+        previous_keyframes_ts = self.keyframes_ts[self.keyframes_ts <= first_ts]
+        return len(previous_keyframes_ts) > 0 and previous_keyframes_ts[-1].item() > self.frames_ts[-1]
+
+    def decode(
+        self, timestamps: list[float], log_loaded_timestamps: bool = False
+    ) -> tuple[list[torch.Tensor], list[float]]:
+        """Decodes the video until the last requested timestamp.
+
+        Returns the decoded frames (uint8, channel first) and their timestamps. They include at least the
+        frames preceding or equal to the first requested timestamp, and all the frames until the first frame
+        with a timestamp greater or equal to the last requested timestamp.
+        """
+        # set the first and last requested timestamps
+        # Note: previous timestamps are usually loaded, since we need to access the previous key frame
+        first_ts = timestamps[0]
+        last_ts = timestamps[-1]
+
+        if self._must_seek(first_ts):
+            # access closest key frame of the first requested frame
+            # Note: closest key frame timestamp is usally smaller than `first_ts` (e.g. key frame can be the first frame of the video)
+            # for details on what `seek` is doing see: https://pyav.basswood-io.com/docs/stable/api/container.html?highlight=inputcontainer#av.container.InputContainer.seek
+            keyframes_only = self.backend == "pyav"  # pyav doesnt support accuracte seek
+            self.reader.seek(first_ts, keyframes_only=keyframes_only)
+            self.frames, self.frames_ts = [], []
+            self.is_exhausted = False
+
+        # load all frames until last requested frame
+        while not self.is_exhausted and (len(self.frames_ts) == 0 or self.frames_ts[-1] < last_ts):
+            try:
+                frame = next(self.reader)
+            except StopIteration:
+                self.is_exhausted = True
+                break
+            current_ts = frame["pts"]
+            if log_loaded_timestamps:
+                logging.info(f"frame loaded at timestamp={current_ts:.4f}")
+            self.frames.append(frame["data"])
+            self.frames_ts.append(current_ts)
+
+        loaded_frames, loaded_ts = self.frames, self.frames_ts
+        self.frames = self.frames[-self.max_cached_frames :]
+        self.frames_ts = self.frames_ts[-self.max_cached_frames :]
+        return loaded_frames, loaded_ts
+
+    def decode_frames(self, frame_ids: list[int]) -> list[torch.Tensor]:
+        """Decodes the frames of the given frame numbers (see `frames_ts`), returned in the same order.
+
+        The requested frames are decoded in increasing order. When a key frame lies between two consecutive
+        requested frames, the decoder seeks to it instead of decoding all the frames in between.
+        """
+        if self.all_frames_ts is None or self.keyframes_ts is None:
+            raise ValueError("Decoding frames by frame number requires `frames_ts` and `keyframes_ts`.")
+        sorted_ids = sorted(set(frame_ids))
+        requested_ts = self.all_frames_ts[sorted_ids].tolist()
+
+        # split the requested frames in groups separated by key frames
+        groups = [[requested_ts[0]]]
+        for previous_ts, ts in itertools.pairwise(requested_ts):
+            if ((previous_ts < self.keyframes_ts) & (self.keyframes_ts <= ts)).any():
+                groups.append([])
+            groups[-1].append(ts)
+
+        frames_per_ts = {}
+        for group in groups:
+            loaded_frames, loaded_ts = self.decode(group)
+            frames_per_ts.update(zip(loaded_ts, loaded_frames, strict=True))
+        # the timestamps of the decoded frames are the same as the ones of the index
+        missing_ts = [ts for ts in requested_ts if ts not in frames_per_ts]
+        assert len(missing_ts) == 0, f"The frames at {missing_ts} weren't decoded from {self.video_path}."
+        frames_per_id = {
+            frame_id: frames_per_ts[ts] for frame_id, ts in zip(sorted_ids, requested_ts, strict=True)
+        }
+        return [frames_per_id[frame_id] for frame_id in frame_ids]
+
+    def close(self):
+        if self.backend == "pyav":
+            self.reader.container.close()
+        self.reader = None
+        self.frames, self.frames_ts = [], []
+
+
+class VideoDecoderPool:
+    """Least recently used pool of open `VideoDecoder`s, keyed by video path.
+
+    At most `max_open_decoders` videos are kept open, in addition to the ones being used by other threads.
+    The frames and key frames of each video are indexed once, either from `videos_index` (see
+    `compute_videos_index`) or when the video is opened for the first time.
+
+    The pool also provides a pool of `num_threads` threads (by default, up to 4 depending on the number of cpus)
+    to decode several videos concurrently (e.g. the videos of the different cameras of an item, see
+    `load_from_videos`). Video decoding mostly releases the GIL.
+
+    Note: Decoders are never shared across processes. Each DataLoader worker opens its own decoders, and the
+    decoders inherited from a parent process are discarded without being used (see `load_from_videos`).
+    """
+
+    def __init__(
+        self,
+        max_open_decoders: int = 8,
+        videos_index: dict[str, dict] | None = None,
+        num_threads: int | None = None,
+    ):
+        if max_open_decoders < 1:
+            raise ValueError(f"`max_open_decoders` should be at least 1, but {max_open_decoders=} given.")
+        if num_threads is None:
+            num_threads = min(4, os.cpu_count() or 1)
+        if num_threads < 1:
+            raise ValueError(f"`num_threads` should be at least 1, but {num_threads=} given.")
+        self.max_open_decoders = max_open_decoders
+        self.num_threads = num_threads
+        self.keyframes_index = {}
+        self.frames_index = {}
+        if videos_index is not None:
+            self.keyframes_index = {path: index["keyframes_ts"] for path, index in videos_index.items()}
+            # the videos index of datasets created with a previous version of the codebase only has key frames
+            self.frames_index = {
+                path: index["frames_ts"] for path, index in videos_index.items() if "frames_ts" in index
+            }
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._decoders = OrderedDict()
+        self._num_users = {}
+        self._executor = None
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            # decoders and threads inherited from the parent process (e.g. when forking DataLoader workers)
+            self._reset()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        self._check_process()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.num_threads, thread_name_prefix="video_decoder"
+                )
+            return self._executor
+
+    @contextmanager
+    def use(self, video_path: str | Path, backend: str = "pyav") -> Iterator[VideoDecoder]:
+        """Context manager providing an open decoder of the video, for the exclusive use of the caller."""
+        self._check_process()
+        video_path = str(video_path)
+        key = (video_path, backend)
+
+        with self._lock:
+            decoder = self._decoders.get(key)
+            if decoder is not None:
+                self._decoders.move_to_end(key)
+                self._num_users[key] = self._num_users.get(key, 0) + 1
+
+        if decoder is None:
+            # open the video outside of the lock, to not block the other threads
+            if video_path not in self.keyframes_index or video_path not in self.frames_index:
+                video_index = get_video_index(video_path)
+                self.keyframes_index[video_path] = video_index["keyframes_ts"]
+                self.frames_index[video_path] = video_index["frames_ts"]
+            new_decoder = VideoDecoder(
+                video_path,
+                backend,
+                self.keyframes_index[video_path],
+                frames_ts=self.frames_index[video_path],
+            )
+            with self._lock:
+                decoder = self._decoders.setdefault(key, new_decoder)
+                self._decoders.move_to_end(key)
+                self._num_users[key] = self._num_users.get(key, 0) + 1
+            if decoder is not new_decoder:
+                # another thread opened the same video in the meantime
+                new_decoder.close()
+
+        try:
+            with decoder.lock:
+                yield decoder
+        finally:
+            with self._lock:
+                self._num_users[key] -= 1
+                if self._num_users[key] == 0:
+                    del self._num_users[key]
+                self._close_least_recently_used()
+
+    def _close_least_recently_used(self):
+        num_to_close = len(self._decoders) - self.max_open_decoders
+        for key in list(self._decoders):
+            if num_to_close <= 0:
+                break
+            if key not in self._num_users:
+                self._decoders.pop(key).close()
+                num_to_close -= 1
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+        with self._lock:
+            for decoder in self._decoders.values():
+                decoder.close()
+            self._decoders = OrderedDict()
+
+    def __len__(self):
+        return len(self._decoders)
+
+    def __getstate__(self):
+        # open decoders, locks and threads can't be pickled (e.g. when spawning DataLoader workers)
+        state = self.__dict__.copy()
+        for key in ["_lock", "_decoders", "_num_users", "_executor"]:
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+
+class VideoFetcher:
+    """Downloads the mp4 files of a dataset on the hub one at a time, when they are first accessed.
+
+    Instead of downloading all the videos of the dataset upfront, a video is downloaded (into the cache of the
+    hub) the first time one of its frames is loaded (see `load_from_videos`), or in the background threads of
+    the fetcher when it is prefetched, e.g. for the upcoming episodes of a sampler (see `PrefetchSampler`).
+
+    The local paths of the fetched videos are remembered, so that accessing a video again doesn't query the
+    hub. Concurrent fetches of the same video (by several threads, or several DataLoader workers) wait for the
+    same download.
+
+    Args:
+        repo_id: Name of the dataset on the hub.
+        revision: Revision of the dataset (see `get_hf_dataset_safe_version`).
+        num_threads: Number of videos downloaded concurrently when prefetching.
+    """
+
+    def __init__(self, repo_id: str, revision: str | None = None, num_threads: int = 4):
+        if num_threads < 1:
+            raise ValueError(f"`num_threads` should be at least 1, but {num_threads=} given.")
+        self.repo_id = repo_id
+        self.revision = revision
+        self.num_threads = num_threads
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._local_paths = {}
+        self._futures = {}
+        self._executor = None
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            # threads inherited from the parent process (e.g. when forking DataLoader workers)
+            self._reset()
+
+    def _download(self, path: str) -> Path:
+        # the download is locked by the hub cache, so that other processes wait for it instead of downloading
+        # the same file
+        try:
+            local_path = Path(
+                hf_hub_download(self.repo_id, path, repo_type="dataset", revision=self.revision)
+            )
+        finally:
+            # a failed download is retried at the next access
+            with self._lock:
+                self._futures.pop(path, None)
+        with self._lock:
+            self._local_paths[path] = local_path
+        return local_path
+
+    def fetch(self, path: str) -> Path:
+        """Returns the local path of a video (e.g. "videos/observation.image_episode_000000.mp4"), after
+        downloading it if needed."""
+        self._check_process()
+        with self._lock:
+            local_path = self._local_paths.get(path)
+            future = self._futures.get(path)
+        if local_path is not None:
+            return local_path
+        if future is not None and not future.cancelled():
+            return future.result()
+        return self._download(path)
+
+    def prefetch(self, paths: list[str]) -> list[Future]:
+        """Starts downloading the videos which haven't been fetched yet, in the background threads."""
+        self._check_process()
+        futures = []
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.num_threads, thread_name_prefix="video_fetcher"
+                )
+            for path in paths:
+                if path in self._local_paths:
+                    continue
+                if path not in self._futures:
+                    self._futures[path] = self._executor.submit(self._download, path)
+                futures.append(self._futures[path])
+        return futures
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            # the pending downloads are cancelled, the videos are downloaded again when they are accessed
+            self._futures = {}
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    def __getstate__(self):
+        # locks, futures and threads can't be pickled (e.g. when spawning DataLoader workers)
+        state = self.__dict__.copy()
+        for key in ["_lock", "_futures", "_executor"]:
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        local_paths = state.pop("_local_paths")
+        self.__dict__.update(state)
+        self._reset()
+        self._local_paths = local_paths
+
+
+def _decode_indexed_video_frames(
+    decoder: VideoDecoder,
+    timestamps: list[float],
+    tolerance_s: float,
+    log_loaded_timestamps: bool = False,
+    image_dtype: torch.dtype = torch.float32,
+) -> torch.Tensor:
+    """Same as `decode_video_frames_torchvision`, with a decoder whose frames are indexed: the closest frame of
+    each requested timestamp is found in the index before decoding, and only these frames are decoded."""
+    query_ts = torch.tensor(timestamps, dtype=torch.float64)
+    min_, argmin_ = find_closest_timestamps(query_ts, decoder.all_frames_ts)
+
+    is_within_tol = min_ < tolerance_s
+    assert is_within_tol.all(), (
+        f"One or several query timestamps unexpectedly violate the tolerance ({min_[~is_within_tol]} > {tolerance_s=})."
+        "It means that the closest frame that can be loaded from the video is too far away in time."
+        "This might be due to synchronization issues with timestamps during data collection."
+        "To be safe, we advise to ignore this item during training."
+        f"\nqueried timestamps: {query_ts}"
+        f"\nvideo: {decoder.video_path}"
+        f"\nbackend: {decoder.backend}"
+    )
+    if log_loaded_timestamps:
+        logging.info(f"closest_ts={decoder.all_frames_ts[argmin_]}")
+
+    closest_frames = torch.stack(decoder.decode_frames(argmin_.tolist()))
+    if image_dtype != torch.uint8:
+        # convert to the pytorch format which is float32 in [0,1] range (and channel first)
+        closest_frames = closest_frames.type(torch.float32) / 255
+    return closest_frames
+
+
 def decode_video_frames_torchvision(
     video_path: str,
     timestamps: list[float],
     tolerance_s: float,
     backend: str = "pyav",
     log_loaded_timestamps: bool = False,
+    decoder_pool: VideoDecoderPool | None = None,
+    image_dtype: torch.dtype = torch.float32,
 ) -> torch.Tensor:
     """Loads frames associated to the requested timestamps of a video
 
@@ -89,45 +584,29 @@ def decode_video_frames_torchvision(
     that key frame. As a consequence, to access a requested frame, we need to load the preceding key frame,
     and all subsequent frames until reaching the requested frame. The number of key frames in a video
     can be adjusted during encoding to take into account decoding time and video size in bytes.
+
+    When a `decoder_pool` is provided, the video is kept open after decoding, so that the next requests on the
+    same video don't have to reopen it, and can reuse the frames already decoded (see `VideoDecoder`). The frames
+    of the video are also indexed, so that the requested timestamps are resolved to frame numbers before
+    decoding, and the decoder seeks to the key frames between the requested frames instead of decoding through
+    them (see `VideoDecoder.decode_frames`).
+
+    The frames are returned as float32 in [0,1] range, or as uint8 in [0,255] range when `image_dtype` is
+    `torch.uint8` (e.g. to be converted to float32 on the GPU instead, see `Normalize`).
     """
     video_path = str(video_path)
 
-    # set backend
-    keyframes_only = False
-    torchvision.set_video_backend(backend)
-    if backend == "pyav":
-        keyframes_only = True  # pyav doesnt support accuracte seek
-
-    # set a video stream reader
-    # TODO(rcadene): also load audio stream at the same time
-    reader = torchvision.io.VideoReader(video_path, "video")
-
-    # set the first and last requested timestamps
-    # Note: previous timestamps are usually loaded, since we need to access the previous key frame
-    first_ts = timestamps[0]
-    last_ts = timestamps[-1]
-
-    # access closest key frame of the first requested frame
-    # Note: closest key frame timestamp is usally smaller than `first_ts` (e.g. key frame can be the first frame of the video)
-    # for details on what `seek` is doing see: https://pyav.basswood-io.com/docs/stable/api/container.html?highlight=inputcontainer#av.container.InputContainer.seek
-    reader.seek(first_ts, keyframes_only=keyframes_only)
-
-    # load all frames until last requested frame
-    loaded_frames = []
-    loaded_ts = []
-    for frame in reader:
-        current_ts = frame["pts"]
-        if log_loaded_timestamps:
-            logging.info(f"frame loaded at timestamp={current_ts:.4f}")
-        loaded_frames.append(frame["data"])
-        loaded_ts.append(current_ts)
-        if current_ts >= last_ts:
-            break
-
-    if backend == "pyav":
-        reader.container.close()
-
-    reader = None
+    if decoder_pool is not None:
+        with decoder_pool.use(video_path, backend) as decoder:
+            if decoder.all_frames_ts is not None:
+                return _decode_indexed_video_frames(
+                    decoder, timestamps, tolerance_s, log_loaded_timestamps, image_dtype
+                )
+            loaded_frames, loaded_ts = decoder.decode(timestamps, log_loaded_timestamps)
+    else:
+        decoder = VideoDecoder(video_path, backend)
+        loaded_frames, loaded_ts = decoder.decode(timestamps, log_loaded_timestamps)
+        decoder.close()
 
     query_ts = torch.tensor(timestamps)
     loaded_ts = torch.tensor(loaded_ts)
@@ -155,34 +634,25 @@ def decode_video_frames_torchvision(
     if log_loaded_timestamps:
         logging.info(f"{closest_ts=}")
 
-    # convert to the pytorch format which is float32 in [0,1] range (and channel first)
-    closest_frames = closest_frames.type(torch.float32) / 255
+    if image_dtype != torch.uint8:
+        # convert to the pytorch format which is float32 in [0,1] range (and channel first)
+        closest_frames = closest_frames.type(torch.float32) / 255
 
     assert len(timestamps) == len(closest_frames)
     return closest_frames
 
 
-def encode_video_frames(
-    imgs_dir: Path,
-    video_path: Path,
-    fps: int,
-    vcodec: str = "libsvtav1",
-    pix_fmt: str = "yuv420p",
-    g: int | None = 2,
-    crf: int | None = 30,
-    fast_decode: int = 0,
-    log_level: str | None = "error",
-    overwrite: bool = False,
-) -> None:
-    """More info on ffmpeg arguments tuning on `benchmark/video/README.md`"""
-    video_path = Path(video_path)
-    video_path.parent.mkdir(parents=True, exist_ok=True)
-
+def _get_ffmpeg_encoding_args(
+    vcodec: str,
+    pix_fmt: str,
+    g: int | None,
+    crf: int | None,
+    fast_decode: int,
+    log_level: str | None,
+) -> list[str]:
+    """Returns the ffmpeg arguments of the output encoding (see `encode_video_frames`)."""
     ffmpeg_args = OrderedDict(
         [
-            ("-f", "image2"),
-            ("-r", str(fps)),
-            ("-i", str(imgs_dir / "frame_%06d.png")),
             ("-vcodec", vcodec),
             ("-pix_fmt", pix_fmt),
         ]
@@ -202,7 +672,45 @@ def encode_video_frames(
     if log_level is not None:
         ffmpeg_args["-loglevel"] = str(log_level)
 
-    ffmpeg_args = [item for pair in ffmpeg_args.items() for item in pair]
+    return [item for pair in ffmpeg_args.items() for item in pair]
+
+
+def is_ffmpeg_encoder_available(vcodec: str) -> bool:
+    """Returns True if the `ffmpeg` executable is installed and supports the video encoder `vcodec`."""
+    if shutil.which("ffmpeg") is None:
+        return False
+    encoders = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True, stdin=subprocess.DEVNULL
+    ).stdout
+    # lines like " V....D libsvtav1            SVT-AV1(Scalable Video Technology for AV1) encoder (codec av1)"
+    return any(line.split()[1:2] == [vcodec] for line in encoders.splitlines())
+
+
+def encode_video_frames(
+    imgs_dir: Path,
+    video_path: Path,
+    fps: int,
+    vcodec: str = "libsvtav1",
+    pix_fmt: str = "yuv420p",
+    g: int | None = 2,
+    crf: int | None = 30,
+    fast_decode: int = 0,
+    log_level: str | None = "error",
+    overwrite: bool = False,
+) -> None:
+    """More info on ffmpeg arguments tuning on `benchmark/video/README.md`"""
+    video_path = Path(video_path)
+    video_path.parent.mkdir(parents=True, exist_ok=True)
+
+    ffmpeg_args = [
+        "-f",
+        "image2",
+        "-r",
+        str(fps),
+        "-i",
+        str(imgs_dir / "frame_%06d.png"),
+        *_get_ffmpeg_encoding_args(vcodec, pix_fmt, g, crf, fast_decode, log_level),
+    ]
     if overwrite:
         ffmpeg_args.append("-y")
 
@@ -217,6 +725,129 @@ def encode_video_frames(
         )
 
 
+class StreamingVideoEncoder:
+    """Encodes the frames of a video as they are recorded, instead of saving them as png images to be encoded
+    with `encode_video_frames` at the end of the recording.
+
+    The frames are piped as raw rgb24 frames into an `ffmpeg` process, with the encoding parameters of
+    `encode_video_frames`, so the same encoders are available. They are written to the pipe by a background
+    thread, so that `add_frame` doesn't block the control loop, unless `max_queued_frames` frames are already
+    waiting to be encoded (e.g. 60 raw 640x480 frames take 55MB). The number of queued frames is `num_pending`.
+    The video is written to a temporary file which is renamed to `video_path` by `close`, once all the frames are
+    encoded. An interrupted recording thus never leaves a truncated video at `video_path`.
+
+    The timestamp of the i-th added frame is `i / fps`.
+    """
+
+    def __init__(
+        self,
+        video_path: Path,
+        fps: int,
+        vcodec: str = "libsvtav1",
+        pix_fmt: str = "yuv420p",
+        g: int | None = 2,
+        crf: int | None = 30,
+        fast_decode: int = 0,
+        log_level: str | None = "error",
+        max_queued_frames: int = 60,
+    ):
+        self.video_path = Path(video_path)
+        self.tmp_video_path = self.video_path.with_name(f"{self.video_path.stem}.tmp{self.video_path.suffix}")
+        self.fps = fps
+        self.encoding_args = _get_ffmpeg_encoding_args(vcodec, pix_fmt, g, crf, fast_decode, log_level)
+
+        self.num_frames = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_queued_frames)
+        self._thread = threading.Thread(target=self._encode_loop, name="video_encoder", daemon=True)
+        self._thread.start()
+
+    def _get_ffmpeg_cmd(self, height: int, width: int) -> list[str]:
+        input_args = ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(self.fps)]
+        return ["ffmpeg", *input_args, "-i", "-", *self.encoding_args, "-y", str(self.tmp_video_path)]
+
+    def _encode_loop(self):
+        process, shape, image = None, None, None
+        try:
+            while True:
+                image = self._queue.get()
+                # `None` is sent by `close`, `False` by `abort`
+                if image is None or image is False:
+                    break
+                if process is None:
+                    self.tmp_video_path.parent.mkdir(parents=True, exist_ok=True)
+                    shape = image.shape
+                    ffmpeg_cmd = self._get_ffmpeg_cmd(*shape[:2])
+                    process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE)
+                elif image.shape != shape:
+                    raise ValueError(f"The frames of the video have a shape {shape}, not {image.shape}.")
+                try:
+                    process.stdin.write(image.data)
+                except BrokenPipeError:
+                    # ffmpeg exited, its error is logged
+                    raise subprocess.CalledProcessError(process.wait(), ffmpeg_cmd) from None
+            if process is not None and image is None:
+                # ffmpeg encodes the frames it buffered once its input is closed
+                process.stdin.close()
+                if process.wait() != 0:
+                    raise subprocess.CalledProcessError(process.returncode, ffmpeg_cmd)
+        except Exception as e:
+            self._error = e
+        finally:
+            if process is not None:
+                # ffmpeg is still running when the encoding is aborted or failed
+                if process.poll() is None:
+                    process.kill()
+                process.wait()
+                with suppress(BrokenPipeError):
+                    process.stdin.close()
+        # unblock `close` and `abort` when the encoding failed before they were called
+        while image is not None and image is not False:
+            image = self._queue.get()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise RuntimeError(f"Video encoding of {self.video_path} failed.") from self._error
+
+    @property
+    def num_pending(self) -> int:
+        """Number of frames waiting to be encoded."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def add_frame(self, image: torch.Tensor):
+        """Queues an image (uint8, channel last) to be encoded as the next frame of the video. Blocks while
+        `max_queued_frames` frames are waiting to be encoded."""
+        self._check_error()
+        if self._queue is None:
+            raise RuntimeError(f"The video encoder of {self.video_path} is closed.")
+        self._queue.put(np.ascontiguousarray(image))
+        self.num_frames += 1
+
+    def close(self):
+        """Waits for all the frames to be encoded, and moves the video to `video_path`."""
+        if self._queue is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._queue = None
+        self._check_error()
+        if self.num_frames == 0:
+            raise ValueError(f"No frame was added to {self.video_path}.")
+        self.tmp_video_path.replace(self.video_path)
+
+    def abort(self):
+        """Stops encoding without waiting for the queued frames, and removes the partially encoded video."""
+        if self._queue is None:
+            return
+        # the queued frames are discarded
+        with self._queue.mutex:
+            self._queue.queue.clear()
+        self._queue.put(False)
+        self._thread.join()
+        self._queue = None
+        self.tmp_video_path.unlink(missing_ok=True)
+
+
 @dataclass
 class VideoFrame:
     # TODO(rcadene, lhoestq): move to Hugging Face `datasets` repo
@@ -87,6 +87,11 @@ def create_stats_buffers(
     return stats_buffers
 
 
+def uint8_images_to_float(images: Tensor) -> Tensor:
+    """Converts uint8 images in [0,255] range to float32 in [0,1] range, the format expected by the policies."""
+    return images.type(torch.float32) / 255
+
+
 def _no_stats_error_str(name: str) -> str:
     return (
         f"`{name}` is infinity. You should either initialize with `stats` as an argument, or use a "
@@ -95,7 +100,11 @@ def _no_stats_error_str(name: str) -> str:
 
 
 class Normalize(nn.Module):
-    """Normalizes data (e.g. "observation.image") for more stable and faster convergence during training."""
+    """Normalizes data (e.g. "observation.image") for more stable and faster convergence during training.
+
+    Images can be provided as uint8 in [0,255] range (e.g. from a `LeRobotDataset` with `image_dtype=torch.uint8`).
+    They are converted to float32 in [0,1] range, on their device, before being normalized.
+    """
 
     def __init__(
         self,
@@ -136,6 +145,9 @@ class Normalize(nn.Module):
         for key, mode in self.modes.items():
             buffer = getattr(self, "buffer_" + key.replace(".", "_"))
 
+            if "image" in key and batch[key].dtype == torch.uint8:
+                batch[key] = uint8_images_to_float(batch[key])
+
             if mode == "mean_std":
                 mean = buffer["mean"]
                 std = buffer["std"]
@@ -15,7 +15,12 @@ import torch
 import tqdm
 from termcolor import colored
 
-from lerobot.common.datasets.populate_dataset import add_frame, safe_stop_image_writer
+from lerobot.common.datasets.populate_dataset import (
+    add_frame,
+    get_image_writer_metrics,
+    get_video_encoders_metrics,
+    safe_stop_image_writer,
+)
 from lerobot.common.policies.factory import make_policy
 from lerobot.common.robot_devices.robots.utils import Robot
 from lerobot.common.robot_devices.utils import busy_wait
@@ -23,7 +28,15 @@ from lerobot.common.utils.utils import get_safe_torch_device, init_hydra_config,
 from lerobot.scripts.eval import get_pretrained_policy_path
 
 
-def log_control_info(robot: Robot, dt_s, episode_index=None, frame_index=None, fps=None):
+def log_control_info(
+    robot: Robot,
+    dt_s,
+    episode_index=None,
+    frame_index=None,
+    fps=None,
+    image_writer_metrics=None,
+    video_encoders_metrics=None,
+):
     log_items = []
     if episode_index is not None:
         log_items.append(f"ep:{episode_index}")
@@ -63,6 +76,22 @@ def log_control_info(robot: Robot, dt_s, episode_index=None, frame_index=None, f
             if key in robot.logs:
                 log_dt(f"dtR{name}", robot.logs[key])
 
+    # images waiting to be written by the image writer (see `get_image_writer_metrics`)
+    if image_writer_metrics:
+        log_items.append(f"imgQ:{image_writer_metrics['num_pending']}")
+        if image_writer_metrics.get("write_latency_s") is not None:
+            log_dt("dtWimg", image_writer_metrics["write_latency_s"])
+        num_lost = image_writer_metrics["num_dropped"] + image_writer_metrics.get("num_overruns", 0)
+        if num_lost > 0:
+            info_str = f"imgDrop:{image_writer_metrics['num_dropped']}"
+            if "num_overruns" in image_writer_metrics:
+                info_str += f" imgOvr:{image_writer_metrics['num_overruns']}"
+            log_items.append(colored(info_str, "yellow"))
+
+    # frames waiting to be encoded by the video encoders (see `get_video_encoders_metrics`)
+    if video_encoders_metrics:
+        log_items.append(f"vidQ:{video_encoders_metrics['num_pending']}")
+
     info_str = " ".join(log_items)
     logging.info(info_str)
 
@@ -281,7 +310,18 @@ def control_loop(
             busy_wait(1 / fps - dt_s)
 
         dt_s = time.perf_counter() - start_loop_t
-        log_control_info(robot, dt_s, fps=fps)
+        image_writer_metrics, video_encoders_metrics = None, None
+        if dataset is not None and "image_writer" in dataset:
+            image_writer_metrics = get_image_writer_metrics(dataset["image_writer"])
+        if dataset is not None and "video_encoders" in dataset:
+            video_encoders_metrics = get_video_encoders_metrics(dataset)
+        log_control_info(
+            robot,
+            dt_s,
+            fps=fps,
+            image_writer_metrics=image_writer_metrics,
+            video_encoders_metrics=video_encoders_metrics,
+        )
 
         timestamp = time.perf_counter() - start_episode_t
         if events["exit_early"]:
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# Copyright 2024 The HuggingFace Inc. team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Decode the videos of a LeRobotDataset once into a cache of uint8 memmaps, so that training with
+`frame_cache=memmap` doesn't have to decode them (see `lerobot/common/datasets/frame_cache.py`).
+
+The cache is otherwise built by the first `LeRobotDataset(..., frame_cache="memmap")`. Building it in advance
+is useful to not delay the start of a training, or to build it once for several trainings.
+
+Examples:
+
+- Cache the frames at the resolution of the videos:
+```
+python lerobot/scripts/cache_video_frames.py \
+    --repo-id lerobot/pusht
+```
+
+- Cache the frames of a dataset stored locally, resized to a policy resolution:
+```
+python lerobot/scripts/cache_video_frames.py \
+    --repo-id lerobot/aloha_sim_insertion_human \
+    --root data \
+    --resolution observation.images.top 240 320
+```
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+from lerobot.common.datasets.lerobot_dataset import LeRobotDataset
+from lerobot.common.utils.utils import init_logging
+
+
+def cache_video_frames(
+    repo_id: str,
+    root: Path | None = None,
+    cache_dir: Path | None = None,
+    resolution: list[list[str]] | None = None,
+    video_backend: str | None = None,
+):
+    resolutions = None
+    if resolution is not None:
+        resolutions = {key: (int(height), int(width)) for key, height, width in resolution}
+
+    dataset = LeRobotDataset(
+        repo_id,
+        root=root,
+        video_backend=video_backend,
+        frame_cache="memmap",
+        frame_cache_dir=cache_dir,
+        frame_cache_resolutions=resolutions,
+    )
+    if dataset.frame_cache is None:
+        logging.info(f"{repo_id} doesn't contain videos, there is nothing to cache.")
+        return
+    logging.info(f"The video frames of {repo_id} are cached in {dataset.frame_cache.cache_dir}")
+
+
+def main():
+    init_logging()
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--repo-id",
+        type=str,
+        required=True,
+        help="Name of hugging face repositery containing a LeRobotDataset dataset (e.g. `lerobot/pusht`).",
+    )
+    parser.add_argument(
+        "--root",
+        type=Path,
+        default=None,
+        help="Root directory for a dataset stored locally (e.g. `--root data`). By default, the dataset will be loaded from hugging face cache folder, or downloaded from the hub if available.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help="Directory of the frame cache. By default, it is stored next to the videos of the dataset.",
+    )
+    parser.add_argument(
+        "--resolution",
+        nargs=3,
+        action="append",
+        metavar=("KEY", "HEIGHT", "WIDTH"),
+        help=(
+            "Resolution of the cached frames of a video key, e.g. the resolution of the inputs of a policy. "
+            "Can be repeated for several keys. By default, the frames keep the resolution of the videos."
+        ),
+    )
+    parser.add_argument(
+        "--video-backend",
+        type=str,
+        default=None,
+        help="Backend used to decode the videos, 'pyav' (default) or 'video_reader'.",
+    )
+
+    args = parser.parse_args()
+    cache_video_frames(**vars(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -211,6 +211,12 @@ def record(
     tags=None,
     num_image_writer_processes=0,
     num_image_writer_threads_per_camera=4,
+    max_pending_images=1000,
+    image_writer_policy="warn",
+    stream_video_encoding=False,
+    num_video_encoding_workers=0,
+    max_pending_video_encodings=2,
+    video_encoding_cpus=None,
     force_override=False,
     display_cameras=True,
     play_sounds=True,
@@ -245,6 +251,12 @@ def record(
         write_images=robot.has_camera,
         num_image_writer_processes=num_image_writer_processes,
         num_image_writer_threads=num_image_writer_threads_per_camera * robot.num_cameras,
+        max_pending_images=max_pending_images,
+        image_writer_policy=image_writer_policy,
+        stream_video_encoding=stream_video_encoding,
+        num_video_encoding_workers=num_video_encoding_workers,
+        max_pending_video_encodings=max_pending_video_encodings,
+        video_encoding_cpus=video_encoding_cpus,
     )
 
     if not robot.is_connected:
@@ -457,6 +469,60 @@ if __name__ == "__main__":
             "Not enough threads might cause low camera fps."
         ),
     )
+    parser_record.add_argument(
+        "--max-pending-images",
+        type=int,
+        default=1000,
+        help=(
+            "Maximum number of images waiting to be written by the image writer threads (with "
+            "`--num-image-writer-processes 0`), beyond which `--image-writer-policy` is applied."
+        ),
+    )
+    parser_record.add_argument(
+        "--image-writer-policy",
+        type=str,
+        default="warn",
+        choices=["block", "drop_oldest", "warn"],
+        help=(
+            "What to do when more than `--max-pending-images` images are waiting to be written: wait for the "
+            "image writer (which slows down the control loop), drop the oldest waiting image (the episode misses "
+            "an image), or only log a warning."
+        ),
+    )
+    parser_record.add_argument(
+        "--stream-video-encoding",
+        type=int,
+        default=0,
+        help=(
+            "When set to 1 (and `--video 1`), the frames of each camera are encoded into the video of the episode "
+            "as they are recorded, instead of being saved as png images which are encoded at the end of the "
+            "recording. The videos are ready at the end of each episode."
+        ),
+    )
+    parser_record.add_argument(
+        "--num-video-encoding-workers",
+        type=int,
+        default=0,
+        help=(
+            "Number of threads encoding the videos of the recorded episodes in the background, while the next "
+            "episodes are recorded. Set to 0 to encode the videos of all the episodes at the end of the recording."
+        ),
+    )
+    parser_record.add_argument(
+        "--max-pending-video-encodings",
+        type=int,
+        default=2,
+        help=(
+            "Maximum number of recorded episodes waiting for their videos to be encoded in the background. "
+            "Saving an episode waits for the encoding of the oldest one beyond this number."
+        ),
+    )
+    parser_record.add_argument(
+        "--video-encoding-cpus",
+        type=int,
+        nargs="*",
+        help="Ids of the cpus the background video encoding runs on (e.g. `--video-encoding-cpus 4 5 6 7`).",
+    )
     parser_record.add_argument(
         "--force-override",
         type=int,
@@ -504,7 +570,7 @@ if __name__ == "__main__":
     control_mode = args.mode
     robot_path = args.robot_path
     robot_overrides = args.robot_overrides
-    
+
     kwargs = vars(args)
     del kwargs["mode"]
     del kwargs["robot_path"]
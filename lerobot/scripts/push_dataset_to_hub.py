@@ -56,7 +56,13 @@ from safetensors.torch import save_file
 from lerobot.common.datasets.compute_stats import compute_stats
 from lerobot.common.datasets.lerobot_dataset import CODEBASE_VERSION, LeRobotDataset
 from lerobot.common.datasets.push_dataset_to_hub.utils import check_repo_id
-from lerobot.common.datasets.utils import create_branch, create_lerobot_dataset_card, flatten_dict
+from lerobot.common.datasets.utils import (
+    calculate_timestamps_index,
+    create_branch,
+    create_lerobot_dataset_card,
+    flatten_dict,
+)
+from lerobot.common.datasets.video_utils import compute_videos_index
 
 
 def get_from_raw_to_lerobot_format_fn(raw_format: str):
@@ -83,7 +89,13 @@ def get_from_raw_to_lerobot_format_fn(raw_format: str):
 
 
 def save_meta_data(
-    info: dict[str, Any], stats: dict, episode_data_index: dict[str, list], meta_data_dir: Path
+    info: dict[str, Any],
+    stats: dict,
+    episode_data_index: dict[str, list],
+    meta_data_dir: Path,
+    timestamps_index: torch.Tensor | None = None,
+    videos_index: dict[str, dict] | None = None,
+    sufficient_stats: dict | None = None,
 ):
     meta_data_dir.mkdir(parents=True, exist_ok=True)
 
@@ -101,6 +113,25 @@ def save_meta_data(
     ep_data_idx_path = meta_data_dir / "episode_data_index.safetensors"
     save_file(episode_data_index, ep_data_idx_path)
 
+    # save timestamps_index
+    if timestamps_index is not None:
+        timestamps_index_path = meta_data_dir / "timestamps_index.safetensors"
+        save_file({"timestamp": timestamps_index}, timestamps_index_path)
+
+    # save videos_index
+    if videos_index is not None:
+        videos_index_path = meta_data_dir / "videos_index.json"
+        with open(str(videos_index_path), "w") as f:
+            json.dump(videos_index, f)
+
+    # save sufficient_stats, with the number of frames they were computed on to update them incrementally
+    if sufficient_stats is not None:
+        num_frames = episode_data_index["to"][-1].item() if len(episode_data_index["to"]) > 0 else 0
+        sufficient_stats_path = meta_data_dir / "sufficient_stats.safetensors"
+        save_file(
+            flatten_dict(sufficient_stats), sufficient_stats_path, metadata={"num_frames": str(num_frames)}
+        )
+
 
 def push_meta_data_to_hub(repo_id: str, meta_data_dir: str | Path, revision: str | None):
     """Expect all meta data files to be all stored in a single "meta_data" directory.
@@ -234,7 +265,9 @@ def push_dataset_to_hub(
 
     if push_to_hub or local_dir:
         # mandatory for upload
-        save_meta_data(info, stats, episode_data_index, meta_data_dir)
+        timestamps_index = calculate_timestamps_index(hf_dataset)
+        videos_index = compute_videos_index(videos_dir) if video else None
+        save_meta_data(info, stats, episode_data_index, meta_data_dir, timestamps_index, videos_index)
 
     if push_to_hub:
         hf_dataset.push_to_hub(repo_id, revision="main")
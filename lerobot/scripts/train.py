@@ -33,12 +33,17 @@ from torch.cuda.amp import GradScaler
 
 from lerobot.common.datasets.factory import make_dataset, resolve_delta_timestamps
 from lerobot.common.datasets.lerobot_dataset import MultiLeRobotDataset
-from lerobot.common.datasets.online_buffer import OnlineBuffer, compute_sampler_weights
-from lerobot.common.datasets.sampler import EpisodeAwareSampler
+from lerobot.common.datasets.online_buffer import (
+    ConcatDatasetWithOnlineBuffer,
+    OnlineBuffer,
+    compute_sampler_weights,
+)
+from lerobot.common.datasets.sampler import EpisodeAwareSampler, PrefetchSampler, WeightedEpisodeAwareSampler
 from lerobot.common.datasets.utils import cycle
 from lerobot.common.envs.factory import make_env
 from lerobot.common.logger import Logger, log_output_dir
 from lerobot.common.policies.factory import make_policy
+from lerobot.common.policies.normalize import uint8_images_to_float
 from lerobot.common.policies.policy_protocol import PolicyWithUpdate
 from lerobot.common.policies.utils import get_device_from_parameters
 from lerobot.common.utils.utils import (
@@ -245,6 +250,9 @@ def train(cfg: DictConfig, out_dir: str | None = None, job_name: str | None = No
 
     if cfg.training.online_steps > 0 and isinstance(cfg.dataset_repo_id, ListConfig):
         raise NotImplementedError("Online training with LeRobotMultiDataset is not implemented.")
+    if cfg.training.online_steps > 0 and cfg.get("image_dtype", "float32") != "float32":
+        # the images of the online buffer are float32, and can't be mixed with uint8 images in a batch
+        raise NotImplementedError("Online training with `image_dtype` other than float32 is not implemented.")
 
     # If we are resuming a run, we need to check that a checkpoint exists in the log directory, and we need
     # to check for any differences between the provided config and the checkpoint's config.
@@ -398,7 +406,17 @@ def train(cfg: DictConfig, out_dir: str | None = None, job_name: str | None = No
             logging.info("Resume training")
 
     # create dataloader for offline training
-    if cfg.training.get("drop_n_last_frames"):
+    if isinstance(offline_dataset, MultiLeRobotDataset) and (
+        cfg.training.get("dataset_weights") is not None or cfg.training.get("drop_n_last_frames")
+    ):
+        shuffle = False
+        sampler = WeightedEpisodeAwareSampler(
+            offline_dataset.episode_data_indices,
+            dataset_sizes=np.diff([0, *offline_dataset.cumulative_sizes]).tolist(),
+            dataset_weights=cfg.training.get("dataset_weights"),
+            drop_n_last_frames=cfg.training.get("drop_n_last_frames", 0),
+        )
+    elif cfg.training.get("drop_n_last_frames"):
         shuffle = False
         sampler = EpisodeAwareSampler(
             offline_dataset.episode_data_index,
@@ -408,6 +426,12 @@ def train(cfg: DictConfig, out_dir: str | None = None, job_name: str | None = No
     else:
         shuffle = True
         sampler = None
+    if getattr(offline_dataset, "video_fetcher", None) is not None:
+        # download the videos of the upcoming episodes in the background
+        if sampler is None:
+            shuffle = False
+            sampler = torch.utils.data.RandomSampler(offline_dataset)
+        sampler = PrefetchSampler(sampler, offline_dataset.prefetch_videos)
     dataloader = torch.utils.data.DataLoader(
         offline_dataset,
         num_workers=cfg.training.num_workers,
@@ -431,6 +455,9 @@ def train(cfg: DictConfig, out_dir: str | None = None, job_name: str | None = No
 
         for key in batch:
             batch[key] = batch[key].to(device, non_blocking=True)
+            if "image" in key and batch[key].dtype == torch.uint8:
+                # images loaded as uint8 to reduce data transfers are converted on the device
+                batch[key] = uint8_images_to_float(batch[key])
 
         train_info = update_policy(
             policy,
@@ -475,10 +502,18 @@ def train(cfg: DictConfig, out_dir: str | None = None, job_name: str | None = No
             "was made. This is because the online buffer is updated on disk during training, independently "
             "of our explicit checkpointing mechanisms."
         )
+    online_buffer_image_codec = cfg.training.get("online_buffer_image_codec")
     online_dataset = OnlineBuffer(
         online_buffer_path,
         data_spec={
-            **{k: {"shape": v, "dtype": np.dtype("float32")} for k, v in policy.config.input_shapes.items()},
+            **{
+                k: {
+                    "shape": v,
+                    "dtype": np.dtype("float32"),
+                    **({"codec": online_buffer_image_codec} if "image" in k else {}),
+                }
+                for k, v in policy.config.input_shapes.items()
+            },
             **{k: {"shape": v, "dtype": np.dtype("float32")} for k, v in policy.config.output_shapes.items()},
             "next.reward": {"shape": (), "dtype": np.dtype("float32")},
             "next.done": {"shape": (), "dtype": np.dtype("?")},
@@ -494,7 +529,7 @@ def train(cfg: DictConfig, out_dir: str | None = None, job_name: str | None = No
     online_rollout_policy = deepcopy(policy) if cfg.training.do_online_rollout_async else policy
 
     # Create dataloader for online training.
-    concat_dataset = torch.utils.data.ConcatDataset([offline_dataset, online_dataset])
+    concat_dataset = ConcatDatasetWithOnlineBuffer(offline_dataset, online_dataset)
     sampler_weights = compute_sampler_weights(
         offline_dataset,
         offline_drop_n_last_frames=cfg.training.get("drop_n_last_frames", 0),
@@ -512,13 +547,14 @@ def train(cfg: DictConfig, out_dir: str | None = None, job_name: str | None = No
     
     # TODO michel_aractingi temp fix for incosistent keys
 
+    # The batches are sampled all at once from the online buffer (see `ConcatDatasetWithOnlineBuffer`), so they
+    # are already collated.
     dataloader = torch.utils.data.DataLoader(
         concat_dataset,
-        batch_size=cfg.training.batch_size,
+        batch_sampler=torch.utils.data.BatchSampler(sampler, cfg.training.batch_size, drop_last=True),
         num_workers=cfg.training.num_workers,
-        sampler=sampler,
+        collate_fn=torch.utils.data.default_convert,
         pin_memory=device.type != "cpu",
-        drop_last=True,
     )
     dl_iter = cycle(dataloader)
 
@@ -13,36 +13,87 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import contextlib
 import json
 import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
 from copy import deepcopy
+from functools import partial
 from itertools import chain
 from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
 
 import einops
+import numpy as np
 import pytest
 import torch
-from datasets import Dataset
+from datasets import Dataset, Features, Sequence, Value
 from huggingface_hub import HfApi
+from PIL import Image
 from safetensors.torch import load_file
 
 import lerobot
 from lerobot.common.datasets.compute_stats import (
     aggregate_stats,
     compute_stats,
+    compute_sufficient_stats,
     get_stats_einops_patterns,
+    merge_sufficient_stats,
+    sufficient_stats_to_stats,
 )
 from lerobot.common.datasets.factory import make_dataset
+from lerobot.common.datasets.frame_cache import VideoFrameCache
+from lerobot.common.datasets.frame_ring_buffer import FrameRingBuffer
+from lerobot.common.datasets.image_cache import DecodedImageCache
+from lerobot.common.datasets.iterable_dataset import LeRobotIterableDataset
 from lerobot.common.datasets.lerobot_dataset import LeRobotDataset, MultiLeRobotDataset
+from lerobot.common.datasets.memmap_storage import ColumnarMemmapStorage
+from lerobot.common.datasets.populate_dataset import (
+    add_frame,
+    async_save_image,
+    delete_current_episode,
+    from_dataset_to_lerobot_dataset,
+    get_image_writer_metrics,
+    get_video_encoders_metrics,
+    init_dataset,
+    save_current_episode,
+    save_image,
+    start_image_writer,
+    stop_image_writer,
+    stop_video_encoder,
+    update_sufficient_stats,
+)
+from lerobot.common.datasets.push_dataset_to_hub.aloha_hdf5_format import to_hf_dataset
+from lerobot.common.datasets.push_dataset_to_hub.utils import concatenate_episodes, get_default_encoding
 from lerobot.common.datasets.utils import (
+    calculate_episode_data_index,
+    calculate_timestamps_index,
     create_branch,
+    find_closest_timestamps,
     flatten_dict,
     hf_transform_to_torch,
     load_previous_and_future_frames,
+    load_sufficient_stats,
     unflatten_dict,
 )
+from lerobot.common.datasets.video_utils import (
+    StreamingVideoEncoder,
+    VideoDecoder,
+    VideoDecoderPool,
+    VideoFetcher,
+    VideoFrame,
+    decode_video_frames_torchvision,
+    get_video_index,
+    load_from_videos,
+)
 from lerobot.common.utils.utils import init_hydra_config, seeded_context
-from tests.utils import DEFAULT_CONFIG_PATH, DEVICE
+from lerobot.scripts.push_dataset_to_hub import save_meta_data
+from tests.utils import DEFAULT_CONFIG_PATH, DEVICE, make_spoof_video, require_ffmpeg_encoder
 
 
 @pytest.mark.parametrize(
@@ -148,6 +199,15 @@ def test_multilerobotdataset_frames():
         for k in sub_dataset_item:
             assert torch.equal(sub_dataset_item[k], dataset_item[k])
 
+    # Check that the batched path routes indices spread over all the datasets like `__getitem__`.
+    with seeded_context(0):
+        indices = torch.randperm(len(dataset))[:32].tolist()
+    for idx, item in zip(indices, dataset.__getitems__(indices), strict=True):
+        expected_item = dataset[idx]
+        assert item.keys() == expected_item.keys()
+        for k in item:
+            assert torch.equal(item[k], expected_item[k])
+
 
 def test_compute_stats_on_xarm():
     """Check that the statistics are computed correctly according to the stats_patterns property.
@@ -274,6 +334,606 @@ def test_load_previous_and_future_frames_outside_tolerance_outside_episode_range
     ), "Padding does not match expected values"
 
 
+def test_load_previous_and_future_frames_with_timestamps_index():
+    """Check that using a precomputed `timestamps_index` gives the same frames as reading the timestamps of the
+    episode from the dataset."""
+    hf_dataset = Dataset.from_dict(
+        {
+            "timestamp": [0.0, 0.1, 0.2, 0.0, 0.1, 0.2, 0.3, 0.4],
+            "index": [0, 1, 2, 3, 4, 5, 6, 7],
+            "episode_index": [0, 0, 0, 1, 1, 1, 1, 1],
+        }
+    )
+    hf_dataset.set_transform(hf_transform_to_torch)
+    episode_data_index = {
+        "from": torch.tensor([0, 3]),
+        "to": torch.tensor([3, 8]),
+    }
+    timestamps_index = calculate_timestamps_index(hf_dataset)
+    assert torch.allclose(timestamps_index, torch.stack(hf_dataset["timestamp"]))
+
+    delta_timestamps = {"index": [-0.3, -0.1, 0, 0.1, 0.21, 0.5]}
+    tol = 0.04
+    for i in range(len(hf_dataset)):
+        expected = load_previous_and_future_frames(
+            hf_dataset[i], hf_dataset, episode_data_index, delta_timestamps, tol
+        )
+        item = load_previous_and_future_frames(
+            hf_dataset[i], hf_dataset, episode_data_index, delta_timestamps, tol, timestamps_index
+        )
+        assert torch.equal(item["index"], expected["index"])
+        assert torch.equal(item["index_is_pad"], expected["index_is_pad"])
+
+
+def test_find_closest_timestamps():
+    """Check that the binary search matches an exhaustive search over all the timestamps."""
+    with seeded_context(0):
+        timestamps = torch.sort(torch.rand(50)).values
+        query_ts = torch.rand(20) * 1.4 - 0.2
+    query_ts = torch.cat([query_ts, timestamps[:5]])
+    dist = torch.cdist(query_ts[:, None], timestamps[:, None], p=1)
+    expected_min, expected_argmin = dist.min(1)
+    min_, argmin_ = find_closest_timestamps(query_ts, timestamps)
+    assert torch.equal(argmin_, expected_argmin)
+    assert torch.allclose(min_, expected_min)
+
+
+def test_find_closest_timestamps_in_episodes():
+    """Check that searching many episodes at once matches searching each episode separately."""
+    timestamps = torch.tensor([0.0, 0.1, 0.2, 0.0, 0.1, 0.2, 0.3, 0.0, 0.1])
+    from_ids = torch.tensor([0, 0, 3, 3, 3, 7, 7])
+    to_ids = torch.tensor([3, 3, 7, 7, 7, 9, 9])
+    query_ts = torch.tensor([-0.1, 0.16, 0.04, 0.3, 0.5, 0.06, 0.1])
+    min_, argmin_ = find_closest_timestamps(query_ts, timestamps, from_ids, to_ids)
+    for i in range(len(query_ts)):
+        ep_timestamps = timestamps[from_ids[i] : to_ids[i]]
+        expected_min, expected_argmin = find_closest_timestamps(query_ts[i : i + 1], ep_timestamps)
+        assert argmin_[i] == from_ids[i] + expected_argmin[0]
+        assert torch.allclose(min_[i], expected_min[0])
+
+
+@pytest.mark.parametrize(
+    "delta_timestamps", [None, {"index": [-0.3, -0.1, 0, 0.1, 0.21, 0.5], "a": [0, 0.1]}]
+)
+def test_getitems(delta_timestamps):
+    """Check that the batched `__getitems__` returns the same items as `__getitem__`."""
+    hf_dataset = Dataset.from_dict(
+        {
+            "timestamp": [0.0, 0.1, 0.2, 0.0, 0.1, 0.2, 0.3, 0.4],
+            "index": [0, 1, 2, 3, 4, 5, 6, 7],
+            "episode_index": [0, 0, 0, 1, 1, 1, 1, 1],
+            "a": [[float(i), float(-i)] for i in range(8)],
+        }
+    )
+    hf_dataset.set_transform(hf_transform_to_torch)
+    dataset = LeRobotDataset.from_preloaded(
+        hf_dataset=hf_dataset,
+        episode_data_index={"from": torch.tensor([0, 3]), "to": torch.tensor([3, 8])},
+        timestamps_index=calculate_timestamps_index(hf_dataset),
+        info={"fps": 10},
+        delta_timestamps=delta_timestamps,
+    )
+    indices = [7, 0, 3, 3, 5, 2]
+    items = dataset.__getitems__(indices)
+    assert len(items) == len(indices)
+    for idx, item in zip(indices, items, strict=True):
+        expected_item = dataset[idx]
+        assert item.keys() == expected_item.keys()
+        for key in item:
+            assert item[key].dtype == expected_item[key].dtype
+            assert torch.equal(item[key], expected_item[key]), f"{key=} for {idx=}"
+
+
+@pytest.mark.parametrize(
+    "delta_timestamps", [None, {"index": [-0.3, -0.1, 0, 0.1, 0.21, 0.5], "a": [0, 0.1]}]
+)
+def test_columnar_memmap_storage(tmp_path, delta_timestamps):
+    """Check that the items read from the columnar storage are the same as the ones read from the Arrow table."""
+    hf_dataset = Dataset.from_dict(
+        {
+            "timestamp": [0.0, 0.1, 0.2, 0.0, 0.1, 0.2, 0.3, 0.4],
+            "index": [0, 1, 2, 3, 4, 5, 6, 7],
+            "episode_index": [0, 0, 0, 1, 1, 1, 1, 1],
+            "next.done": [False, False, True, False, False, False, False, True],
+            "a": [[float(i), float(-i)] for i in range(8)],
+            "language_instruction": [f"task {i}" for i in range(8)],
+        }
+    )
+    hf_dataset.set_transform(hf_transform_to_torch)
+    kwargs = {
+        "hf_dataset": hf_dataset,
+        "episode_data_index": {"from": torch.tensor([0, 3]), "to": torch.tensor([3, 8])},
+        "timestamps_index": calculate_timestamps_index(hf_dataset),
+        "info": {"fps": 10},
+        "delta_timestamps": delta_timestamps,
+    }
+    dataset = LeRobotDataset.from_preloaded(**kwargs)
+    memmap_dataset = LeRobotDataset.from_preloaded(**kwargs)
+    memmap_dataset.storage = ColumnarMemmapStorage(tmp_path / "columns", hf_dataset)
+    assert memmap_dataset.storage.column_names == ["timestamp", "index", "episode_index", "next.done", "a"]
+
+    indices = [7, 0, 3, 3, 5, 2]
+    items = memmap_dataset.__getitems__(indices)
+    for idx, item in zip(indices, items, strict=True):
+        for memmap_item in [item, memmap_dataset[idx]]:
+            expected_item = dataset[idx]
+            assert memmap_item.keys() == expected_item.keys()
+            for key in expected_item:
+                if key == "language_instruction":
+                    assert memmap_item[key] == expected_item[key]
+                    continue
+                assert memmap_item[key].dtype == expected_item[key].dtype
+                assert torch.equal(memmap_item[key], expected_item[key]), f"{key=} for {idx=}"
+
+    # the storage is reused as long as it matches the dataset
+    with patch.object(ColumnarMemmapStorage, "build") as build_fn:
+        ColumnarMemmapStorage(tmp_path / "columns", hf_dataset)
+    build_fn.assert_not_called()
+
+
+def test_video_decoder_pool(tmp_path):
+    """Check that decoding with a pool of open videos gives the same frames as reopening the video for each
+    request, for sequential, backward and random accesses."""
+    fps = 10
+    num_frames = 40
+    video_paths = [tmp_path / f"episode_{i}.mp4" for i in range(3)]
+    for video_path in video_paths:
+        make_spoof_video(video_path, num_frames, fps, g=8)
+    assert get_video_index(video_paths[0])["keyframes_ts"] == [i / fps for i in range(0, num_frames, 8)]
+
+    tol = 1 / fps - 1e-4
+    requests = [(video_paths[0], [i / fps]) for i in range(num_frames)]
+    requests += [(video_paths[0], [(i - 2) / fps, i / fps]) for i in range(num_frames - 1, 1, -3)]
+    with seeded_context(0):
+        for _ in range(30):
+            i = torch.randint(0, num_frames, ()).item()
+            requests.append((video_paths[torch.randint(0, 3, ()).item()], [i / fps]))
+
+    decoder_pool = VideoDecoderPool(max_open_decoders=2)
+    for video_path, timestamps in requests:
+        expected_frames = decode_video_frames_torchvision(video_path, timestamps, tol)
+        frames = decode_video_frames_torchvision(video_path, timestamps, tol, decoder_pool=decoder_pool)
+        assert torch.equal(frames, expected_frames)
+        assert len(decoder_pool) <= 2
+    decoder_pool.close()
+    assert len(decoder_pool) == 0
+
+
+def test_video_decoder_decode_frames(tmp_path):
+    """Check that the frames decoded by frame number from the index of a video are the ones decoded by
+    timestamp, in the requested order, and that the decoder seeks to the key frames between the requested
+    frames."""
+    fps = 10
+    num_frames = 40
+    video_path = tmp_path / "episode_0.mp4"
+    make_spoof_video(video_path, num_frames, fps, g=8)
+    index = get_video_index(video_path)
+    assert index["frames_ts"] == [i / fps for i in range(num_frames)]
+    assert index["keyframes_ts"] == [i / fps for i in range(0, num_frames, 8)]
+
+    tol = 1 / fps - 1e-4
+    for frame_ids in [[3], [1, 2, 3], [30, 2, 31, 2], [39, 0], [5, 17, 25, 33]]:
+        decoder = VideoDecoder(video_path, keyframes_ts=index["keyframes_ts"], frames_ts=index["frames_ts"])
+        with patch.object(decoder.reader, "seek", wraps=decoder.reader.seek) as seek:
+            frames = torch.stack(decoder.decode_frames(frame_ids))
+        decoder.close()
+        expected_frames = torch.cat(
+            [decode_video_frames_torchvision(video_path, [i / fps], tol) for i in frame_ids]
+        )
+        assert torch.equal(frames, (expected_frames * 255).round().to(torch.uint8))
+        # at most one seek per group of requested frames sharing a key frame
+        assert seek.call_count <= len({i // 8 for i in frame_ids})
+
+
+@pytest.mark.parametrize("num_threads", [None, 1, 3])
+def test_load_from_videos(tmp_path, num_threads):
+    """Check that the frames of several cameras, including a window of frames spread over two videos, are
+    decoded in the requested order, with and without a pool of decoders."""
+    fps = 10
+    num_frames = 20
+    videos_dir = tmp_path / "videos"
+    for name in ["cam_low_episode_0", "cam_low_episode_1", "cam_high_episode_0"]:
+        make_spoof_video(videos_dir / f"{name}.mp4", num_frames, fps, g=4)
+
+    tol = 1 / fps - 1e-4
+    frames = [("cam_low_episode_0", 18), ("cam_low_episode_0", 19), ("cam_low_episode_1", 0)]
+    frames += [("cam_low_episode_1", 1), ("cam_low_episode_0", 19)]
+    item = {
+        "observation.images.low": [
+            {"path": f"videos/{name}.mp4", "timestamp": i / fps} for name, i in frames
+        ],
+        "observation.images.high": {"path": "videos/cam_high_episode_0.mp4", "timestamp": 5 / fps},
+    }
+    decoder_pool = None if num_threads is None else VideoDecoderPool(num_threads=num_threads)
+    item = load_from_videos(item, list(item), videos_dir, tol, decoder_pool=decoder_pool)
+
+    expected_frames = torch.cat(
+        [decode_video_frames_torchvision(videos_dir / f"{name}.mp4", [i / fps], tol) for name, i in frames]
+    )
+    assert torch.equal(item["observation.images.low"], expected_frames)
+    expected_frame = decode_video_frames_torchvision(videos_dir / "cam_high_episode_0.mp4", [5 / fps], tol)
+    assert torch.equal(item["observation.images.high"], expected_frame[0])
+    if decoder_pool is not None:
+        decoder_pool.close()
+
+
+def test_video_fetcher(tmp_path):
+    """Check that the videos are only downloaded when they are accessed or prefetched, and only once, with a
+    local directory standing in for the hub."""
+    fps = 10
+    num_frames = 5
+    hub_dir = tmp_path / "hub"
+    for ep_idx in range(3):
+        make_spoof_video(hub_dir / f"videos/observation.image_episode_{ep_idx:06d}.mp4", num_frames, fps)
+    hf_dataset = Dataset.from_dict(
+        {
+            "observation.image": [
+                {"path": f"videos/observation.image_episode_{ep_idx:06d}.mp4", "timestamp": i / fps}
+                for ep_idx in range(3)
+                for i in range(num_frames)
+            ],
+            "episode_index": [ep_idx for ep_idx in range(3) for _ in range(num_frames)],
+        },
+        features=Features({"observation.image": VideoFrame(), "episode_index": Value("int64")}),
+    )
+    hf_dataset.set_transform(hf_transform_to_torch)
+
+    cache_dir = tmp_path / "cache"
+    downloaded_paths = []
+
+    def hf_hub_download(repo_id, filename, repo_type, revision):
+        downloaded_paths.append(filename)
+        (cache_dir / filename).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(hub_dir / filename, cache_dir / filename)
+        return str(cache_dir / filename)
+
+    dataset = LeRobotDataset.from_preloaded(
+        hf_dataset=hf_dataset,
+        episode_data_index=calculate_episode_data_index(hf_dataset),
+        info={"fps": fps, "video": True},
+        videos_dir=cache_dir / "videos",
+    )
+    dataset.video_fetcher = VideoFetcher("lerobot/test_video_fetcher")
+    expected_dataset = LeRobotDataset.from_preloaded(
+        hf_dataset=hf_dataset,
+        episode_data_index=calculate_episode_data_index(hf_dataset),
+        info={"fps": fps, "video": True},
+        videos_dir=hub_dir / "videos",
+    )
+    with patch("lerobot.common.datasets.video_utils.hf_hub_download", side_effect=hf_hub_download):
+        for idx in [6, 8, 5]:
+            assert torch.equal(dataset[idx]["observation.image"], expected_dataset[idx]["observation.image"])
+        assert downloaded_paths == ["videos/observation.image_episode_000001.mp4"]
+
+        for future in dataset.video_fetcher.prefetch(["videos/observation.image_episode_000002.mp4"]):
+            future.result()
+        dataset.prefetch_videos([1, 12, 7])
+        dataset.video_fetcher.close()
+        assert torch.equal(dataset[0]["observation.image"], expected_dataset[0]["observation.image"])
+    assert sorted(downloaded_paths) == [
+        f"videos/observation.image_episode_{ep_idx:06d}.mp4" for ep_idx in range(3)
+    ]
+
+
+def test_video_fetcher_close_cancels_prefetches(tmp_path):
+    """Check that the videos whose prefetch was cancelled by `close` are downloaded when they are accessed."""
+    downloaded_paths = []
+    download_started = threading.Event()
+    unblock_download = threading.Event()
+
+    def hf_hub_download(repo_id, filename, repo_type, revision):
+        download_started.set()
+        unblock_download.wait(timeout=10)
+        downloaded_paths.append(filename)
+        return str(tmp_path / filename)
+
+    video_fetcher = VideoFetcher("lerobot/test_video_fetcher", num_threads=1)
+    with patch("lerobot.common.datasets.video_utils.hf_hub_download", side_effect=hf_hub_download):
+        first, pending = video_fetcher.prefetch(["videos/a.mp4", "videos/b.mp4"])
+        # the second download waits for the only thread of the fetcher
+        assert download_started.wait(timeout=10)
+        # `close` cancels the pending download, then waits for the running one
+        threading.Timer(0.1, unblock_download.set).start()
+        video_fetcher.close()
+        assert pending.cancelled()
+        assert first.result() == tmp_path / "videos/a.mp4"
+        assert video_fetcher.fetch("videos/b.mp4") == tmp_path / "videos/b.mp4"
+        # the fetcher can prefetch again after being closed
+        for future in video_fetcher.prefetch(["videos/c.mp4"]):
+            future.result()
+        video_fetcher.close()
+    assert downloaded_paths == ["videos/a.mp4", "videos/b.mp4", "videos/c.mp4"]
+
+
+def test_video_frame_cache(tmp_path):
+    """Check that the frames read from the cache are the decoded frames, and that the cache is rebuilt when the
+    encoding of the videos changes."""
+    fps = 10
+    num_frames = 12
+    videos_dir = tmp_path / "videos"
+    for ep_idx in range(2):
+        make_spoof_video(videos_dir / f"observation.image_episode_{ep_idx:06d}.mp4", num_frames, fps, g=4)
+    hf_dataset = Dataset.from_dict(
+        {
+            "observation.image": [
+                {"path": f"videos/observation.image_episode_{ep_idx:06d}.mp4", "timestamp": i / fps}
+                for ep_idx in range(2)
+                for i in range(num_frames)
+            ],
+        },
+        features=Features({"observation.image": VideoFrame()}),
+    )
+    info = {"fps": fps, "video": True, "encoding": {"vcodec": "mpeg4", "g": 4}}
+    tol = 1 / fps - 1e-4
+
+    cache_dir = tmp_path / "frame_cache"
+    frame_cache = VideoFrameCache(cache_dir, videos_dir, hf_dataset, info)
+    item = {"observation.image": [hf_dataset[i]["observation.image"] for i in [3, 11, 12, 13]]}
+    cached_item = frame_cache.load(dict(item), ["observation.image"], tol)
+    expected_item = load_from_videos(dict(item), ["observation.image"], videos_dir, tol)
+    assert torch.equal(cached_item["observation.image"], expected_item["observation.image"])
+
+    # the cache is reused as long as the dataset doesn't change
+    mtime = (cache_dir / "frame_cache_info.json").stat().st_mtime_ns
+    VideoFrameCache(cache_dir, videos_dir, hf_dataset, info)
+    assert (cache_dir / "frame_cache_info.json").stat().st_mtime_ns == mtime
+
+    # a process finishing its build after another one did reuses the cache of the latter, and doesn't leave
+    # its own build behind
+    frame_cache.build()
+    assert (cache_dir / "frame_cache_info.json").stat().st_mtime_ns == mtime
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["frame_cache", "videos"]
+
+    # the cache is rebuilt when the encoding or the resolution changes
+    info["encoding"]["g"] = 2
+    frame_cache = VideoFrameCache(cache_dir, videos_dir, hf_dataset, info, {"observation.image": (24, 32)})
+    assert (cache_dir / "frame_cache_info.json").stat().st_mtime_ns != mtime
+    item = frame_cache.load(
+        {"observation.image": hf_dataset[5]["observation.image"]}, ["observation.image"], tol
+    )
+    assert item["observation.image"].shape == (3, 24, 32)
+    torch.testing.assert_close(
+        item["observation.image"], torch.full((3, 24, 32), 5 / 255), atol=2 / 255, rtol=0
+    )
+
+
+@pytest.mark.parametrize("layout", ["arrow", "parquet"])
+def test_iterable_dataset(tmp_path, layout):
+    """Check that streaming the shards of a local dataset, with episodes spread over several shards, yields the
+    same items as `LeRobotDataset`, each of them once."""
+    fps = 10
+    ep_lengths = [7, 12, 3, 9]
+    repo_id = "lerobot/test_iterable"
+    dataset_dir = tmp_path / repo_id
+    for ep_idx, num_frames in enumerate(ep_lengths):
+        make_spoof_video(dataset_dir / f"videos/observation.image_episode_{ep_idx:06d}.mp4", num_frames, fps)
+    rows = [(ep_idx, i) for ep_idx, num_frames in enumerate(ep_lengths) for i in range(num_frames)]
+    hf_dataset = Dataset.from_dict(
+        {
+            "observation.image": [
+                {"path": f"videos/observation.image_episode_{ep_idx:06d}.mp4", "timestamp": i / fps}
+                for ep_idx, i in rows
+            ],
+            "action": [[float(index), float(i)] for index, (_, i) in enumerate(rows)],
+            "timestamp": [i / fps for _, i in rows],
+            "episode_index": [ep_idx for ep_idx, _ in rows],
+            "index": list(range(len(rows))),
+        },
+        features=Features(
+            {
+                "observation.image": VideoFrame(),
+                "action": Sequence(Value("float32")),
+                "timestamp": Value("float32"),
+                "episode_index": Value("int64"),
+                "index": Value("int64"),
+            }
+        ),
+    )
+    hf_dataset.save_to_disk(str(dataset_dir / "train"), num_shards=3)
+    if layout == "parquet":
+        for i in range(3):
+            hf_dataset.shard(3, i, contiguous=True).to_parquet(
+                dataset_dir / f"data/train-{i:05d}-of-00003.parquet"
+            )
+    ep_to = torch.tensor(ep_lengths).cumsum(0)
+    save_meta_data(
+        {"fps": fps, "video": True},
+        {},
+        {"from": (ep_to - torch.tensor(ep_lengths)).tolist(), "to": ep_to.tolist()},
+        dataset_dir / "meta_data",
+    )
+
+    delta_timestamps = {"observation.image": [-0.2, 0], "action": [-0.1, 0, 0.1, 0.2]}
+    dataset = LeRobotDataset(repo_id, root=tmp_path, delta_timestamps=delta_timestamps)
+    iterable_dataset = LeRobotIterableDataset(repo_id, root=tmp_path, delta_timestamps=delta_timestamps)
+    if layout == "parquet":
+        shutil.rmtree(dataset_dir / "train")
+        iterable_dataset = LeRobotIterableDataset(repo_id, root=tmp_path, delta_timestamps=delta_timestamps)
+    assert len(iterable_dataset.shards) == 3
+    assert len(iterable_dataset) == len(dataset)
+
+    iterable_dataset.shuffle = False
+    assert [item["index"].item() for item in iterable_dataset] == list(range(len(dataset)))
+
+    # chunks of consecutive episodes spread over several shards
+    iterable_dataset.chunk_size = 10
+    assert iterable_dataset._make_chunks() == [(0, 19), (19, 31)]
+    iterable_dataset.shuffle = True
+    iterable_dataset.shuffle_buffer_size = 5
+
+    # the shuffle buffer holds undecoded rows, the frames of an item are decoded once it is drawn from it
+    items = iter(iterable_dataset)
+    with patch(
+        "lerobot.common.datasets.iterable_dataset.load_from_videos", wraps=load_from_videos
+    ) as load_from_videos_fn:
+        next(items)
+    assert load_from_videos_fn.call_count == 1
+    items.close()
+
+    dataloader = torch.utils.data.DataLoader(iterable_dataset, batch_size=None, num_workers=2)
+    items = sorted(dataloader, key=lambda item: item["index"].item())
+    assert [item["index"].item() for item in items] == list(range(len(dataset)))
+    for item in items:
+        expected_item = dataset[item["index"].item()]
+        assert item.keys() == expected_item.keys()
+        for key in item:
+            assert torch.equal(item[key], expected_item[key]), f"{key=} for index={item['index']}"
+
+
+def test_iterable_dataset_chunks(tmp_path):
+    """Check that the episodes of a dataset with a single shard are split between the workers, and that their
+    order changes between epochs."""
+    ep_lengths = [5, 3, 8, 4, 6, 2, 7, 5]
+    repo_id = "lerobot/test_iterable_chunks"
+    dataset_dir = tmp_path / repo_id
+    episode_index = [ep_idx for ep_idx, num_frames in enumerate(ep_lengths) for _ in range(num_frames)]
+    Dataset.from_dict(
+        {
+            "timestamp": [i / 10 for num_frames in ep_lengths for i in range(num_frames)],
+            "episode_index": episode_index,
+            "index": list(range(len(episode_index))),
+        },
+        features=Features(
+            {"timestamp": Value("float32"), "episode_index": Value("int64"), "index": Value("int64")}
+        ),
+    ).save_to_disk(str(dataset_dir / "train"), num_shards=1)
+    ep_to = torch.tensor(ep_lengths).cumsum(0)
+    save_meta_data(
+        {"fps": 10, "video": False},
+        {},
+        {"from": (ep_to - torch.tensor(ep_lengths)).tolist(), "to": ep_to.tolist()},
+        dataset_dir / "meta_data",
+    )
+    # the items are only shuffled by the order of the chunks, of one episode each
+    iterable_dataset = LeRobotIterableDataset(repo_id, root=tmp_path, shuffle_buffer_size=1, chunk_size=1)
+    assert len(iterable_dataset.shards) == 1
+
+    def get_episode_order(worker_id: int, epoch: int) -> list[int]:
+        iterable_dataset.set_epoch(epoch)
+        worker_info = SimpleNamespace(id=worker_id, num_workers=2)
+        with patch("torch.utils.data.get_worker_info", return_value=worker_info):
+            episode_indices = [item["episode_index"].item() for item in iterable_dataset]
+        return list(dict.fromkeys(episode_indices))
+
+    orders = {epoch: [get_episode_order(worker_id, epoch) for worker_id in range(2)] for epoch in range(2)}
+    for epoch in range(2):
+        assert all(len(order) == len(ep_lengths) // 2 for order in orders[epoch])
+        assert sorted(orders[epoch][0] + orders[epoch][1]) == list(range(len(ep_lengths)))
+    assert orders[0] != orders[1]
+
+
+@pytest.mark.parametrize("max_num_bytes", [10**6, 5 * 3 * 8 * 8])
+def test_decoded_image_cache(max_num_bytes):
+    """Check that the images read from the cache are the decoded images, that they are decoded once when the
+    dataset fits in the cache, and that the cache is shared by the DataLoader workers."""
+    with seeded_context(0):
+        images = torch.randint(0, 256, (8, 3, 8, 8), dtype=torch.uint8)
+    hf_dataset = Dataset.from_dict(
+        {
+            "observation.image": [Image.fromarray(img.permute(1, 2, 0).numpy()) for img in images],
+            "timestamp": [0.0, 0.1, 0.2, 0.0, 0.1, 0.2, 0.3, 0.4],
+            "episode_index": [0, 0, 0, 1, 1, 1, 1, 1],
+        }
+    )
+    hf_dataset.set_transform(hf_transform_to_torch)
+    kwargs = {
+        "hf_dataset": hf_dataset,
+        "episode_data_index": {"from": torch.tensor([0, 3]), "to": torch.tensor([3, 8])},
+        "timestamps_index": calculate_timestamps_index(hf_dataset),
+        "info": {"fps": 10},
+    }
+    image_cache = DecodedImageCache(hf_dataset, max_num_bytes)
+    assert image_cache.num_slots == min(8, max_num_bytes // (3 * 8 * 8))
+
+    for delta_timestamps in [None, {"observation.image": [-0.1, 0, 0.1]}]:
+        dataset = LeRobotDataset.from_preloaded(**kwargs, delta_timestamps=delta_timestamps)
+        cached_dataset = LeRobotDataset.from_preloaded(**kwargs, delta_timestamps=delta_timestamps)
+        cached_dataset.image_cache = image_cache
+        indices = [7, 0, 3, 3, 5, 2, 6]
+        for _ in range(2):
+            cached_items = [cached_dataset[idx] for idx in indices] + cached_dataset.__getitems__(indices)
+            for cached_item, idx in zip(cached_items, indices + indices, strict=True):
+                expected_item = dataset[idx]
+                assert cached_item.keys() == expected_item.keys()
+                for key in expected_item:
+                    assert cached_item[key].dtype == expected_item[key].dtype
+                    assert torch.equal(cached_item[key], expected_item[key]), f"{key=} for {idx=}"
+
+    if image_cache.num_slots == 8:
+        # the images are all cached by now
+        with patch.object(DecodedImageCache, "_decode", side_effect=AssertionError):
+            cached_dataset[4]
+        image_cache = DecodedImageCache(hf_dataset, max_num_bytes)
+        cached_dataset.image_cache = image_cache
+        dataloader = torch.utils.data.DataLoader(cached_dataset, batch_size=2, num_workers=2)
+        for _ in dataloader:
+            pass
+        # the images decoded by the workers are in the cache of the main process
+        with patch.object(DecodedImageCache, "_decode", side_effect=AssertionError):
+            assert torch.equal(cached_dataset[5]["observation.image"], dataset[5]["observation.image"])
+
+
+def _write_image_cache_slot(image_cache: DecodedImageCache, idx: int, written):
+    image_cache.get("observation.image", np.array([idx]))
+    written.set()
+
+
+def test_decoded_image_cache_slot_writers():
+    """Check that the writers of a slot of the cache wait for each other, and that a slot is not read while it
+    is written."""
+    fcntl = pytest.importorskip("fcntl")
+    images = torch.randint(0, 256, (2, 3, 8, 8), dtype=torch.uint8)
+    hf_dataset = Dataset.from_dict(
+        {"observation.image": [Image.fromarray(img.permute(1, 2, 0).numpy()) for img in images]}
+    )
+    # both rows share the only slot of the cache
+    image_cache = DecodedImageCache(hf_dataset, max_num_bytes=3 * 8 * 8, to_float32=False)
+    assert image_cache.num_slots == 1
+    image_cache.get("observation.image", np.array([0]))
+    _, tags, tags_file = image_cache._memmaps["observation.image"]
+
+    # another process writing the slot waits for the lock of the slot, held here like by a writer
+    fcntl.lockf(tags_file, fcntl.LOCK_EX, tags.itemsize * 2, 0, os.SEEK_SET)
+    ctx = multiprocessing.get_context("fork")
+    written = ctx.Event()
+    writer = ctx.Process(target=_write_image_cache_slot, args=(image_cache, 1, written))
+    writer.start()
+    assert not written.wait(timeout=0.5)
+    fcntl.lockf(tags_file, fcntl.LOCK_UN, tags.itemsize * 2, 0, os.SEEK_SET)
+    assert written.wait(timeout=30)
+    writer.join(timeout=30)
+    assert tags[0].tolist() == [1, 4]
+
+    # a slot whose sequence number is odd is being written, its image is decoded instead of being read
+    with patch.object(DecodedImageCache, "_write"):
+        tags[0, 1] += 1
+        with patch.object(DecodedImageCache, "_decode", wraps=image_cache._decode) as decode_fn:
+            image = image_cache.get("observation.image", np.array([1]))[0]
+        decode_fn.assert_called_once()
+    assert np.array_equal(image, images[1].numpy())
+
+
+def test_uint8_images(tmp_path):
+    """Check that images and video frames can be loaded as uint8, in the same [0,255] range as they are stored."""
+    images = torch.randint(0, 256, (2, 3, 8, 8), dtype=torch.uint8)
+    hf_dataset = Dataset.from_dict(
+        {"observation.image": [Image.fromarray(img.permute(1, 2, 0).numpy()) for img in images]}
+    )
+    hf_dataset.set_transform(partial(hf_transform_to_torch, image_dtype=torch.uint8))
+    item = hf_dataset[1]
+    assert item["observation.image"].dtype == torch.uint8
+    assert torch.equal(item["observation.image"], images[1])
+
+    fps = 10
+    video_path = tmp_path / "episode_0.mp4"
+    make_spoof_video(video_path, 10, fps)
+    tol = 1 / fps - 1e-4
+    frames = decode_video_frames_torchvision(video_path, [0.2, 0.3], tol, image_dtype=torch.uint8)
+    expected_frames = decode_video_frames_torchvision(video_path, [0.2, 0.3], tol)
+    assert frames.dtype == torch.uint8
+    assert torch.equal(frames.type(torch.float32) / 255, expected_frames)
+
+
 def test_flatten_unflatten_dict():
     d = {
         "obs": {
@@ -396,6 +1056,411 @@ def test_aggregate_stats():
         assert torch.allclose(stats[data_key]["std"], torch.std(data, correction=0))
 
 
+def test_compute_stats_sharded():
+    """Checks that merging the statistics of shards and batches matches the statistics of all the data."""
+    with seeded_context(0):
+        data_a = torch.rand(50, dtype=torch.float32) * 10
+        data_b = torch.rand(50, 3, dtype=torch.float32) - 100
+
+    hf_dataset = Dataset.from_dict({"a": data_a, "b": data_b, "index": torch.arange(50)})
+    hf_dataset.set_transform(hf_transform_to_torch)
+    dataset = LeRobotDataset.from_preloaded("d", hf_dataset=hf_dataset)
+
+    sufficient_stats = [
+        compute_sufficient_stats(dataset, batch_size=7, num_workers=0, num_shards=3, shard_index=i)
+        for i in range(3)
+    ]
+    assert sum(ss["a"]["count"] for ss in sufficient_stats) == 50
+    sharded_stats = sufficient_stats_to_stats(
+        merge_sufficient_stats(
+            merge_sufficient_stats(sufficient_stats[0], sufficient_stats[1]), sufficient_stats[2]
+        )
+    )
+    stats = compute_stats(dataset, batch_size=7, num_workers=2)
+
+    for data_key, data, pattern in [("a", data_a, "n -> 1"), ("b", data_b, "n c -> c")]:
+        for computed_stats in [stats, sharded_stats]:
+            for agg_fn in ["mean", "min", "max"]:
+                assert torch.allclose(computed_stats[data_key][agg_fn], einops.reduce(data, pattern, agg_fn))
+            assert torch.allclose(computed_stats[data_key]["std"], torch.std(data, dim=0, correction=0))
+
+
+def test_update_sufficient_stats(tmp_path):
+    """Checks that the statistics of a dataset are updated with the frames of new episodes only."""
+    with seeded_context(0):
+        data_a = torch.rand(50, dtype=torch.float32)
+        data_b = torch.rand(50, 3, dtype=torch.float32)
+    hf_dataset = Dataset.from_dict({"a": data_a, "b": data_b, "index": torch.arange(50)})
+    hf_dataset.set_transform(hf_transform_to_torch)
+    dataset = LeRobotDataset.from_preloaded("d", hf_dataset=hf_dataset, videos_dir=tmp_path / "videos")
+
+    # statistics saved after recording the first episode
+    sufficient_stats = compute_sufficient_stats(dataset, num_workers=0, indices=range(30))
+    save_meta_data(
+        {}, {}, {"from": [0], "to": [30]}, tmp_path / "meta_data", sufficient_stats=sufficient_stats
+    )
+    loaded_sufficient_stats, num_frames = load_sufficient_stats(tmp_path / "meta_data")
+    assert num_frames == 30
+
+    with patch(
+        "lerobot.common.datasets.populate_dataset.compute_sufficient_stats", wraps=compute_sufficient_stats
+    ) as compute_fn:
+        stats = sufficient_stats_to_stats(update_sufficient_stats(dataset))
+    assert list(compute_fn.call_args.kwargs["indices"]) == list(range(30, 50))
+
+    for data_key, data, pattern in [("a", data_a, "n -> 1"), ("b", data_b, "n c -> c")]:
+        for agg_fn in ["mean", "min", "max"]:
+            assert torch.allclose(stats[data_key][agg_fn], einops.reduce(data, pattern, agg_fn))
+        assert torch.allclose(stats[data_key]["std"], torch.std(data, dim=0, correction=0))
+
+
+@require_ffmpeg_encoder(get_default_encoding()["vcodec"])
+def test_stream_video_encoding(tmp_path):
+    """Checks that the videos of the recorded episodes are encoded during the recording with the default encoding,
+    and that the video of a re-recorded episode is discarded."""
+    fps = 10
+    dataset = init_dataset("user/repo", tmp_path, False, fps, True, True, 0, 1, stream_video_encoding=True)
+    assert "image_writer" not in dataset
+    for episode_index, num_frames in [(0, 12), (1, 5), (1, 8)]:
+        for i in range(num_frames):
+            image = torch.full((48, 64, 3), 10 * i + episode_index, dtype=torch.uint8)
+            add_frame(dataset, {"observation.image": image}, {"action": torch.zeros(2)})
+        if dataset["num_episodes"] == 1 and num_frames == 5:
+            delete_current_episode(dataset)
+        else:
+            save_current_episode(dataset)
+
+    videos_dir = dataset["videos_dir"]
+    video_paths = sorted(videos_dir.iterdir())
+    assert [p.name for p in video_paths] == [f"observation.image_episode_00000{i}.mp4" for i in range(2)]
+    tol = 1 / fps - 1e-4
+    for episode_index, (video_path, num_frames) in enumerate(zip(video_paths, [12, 8], strict=True)):
+        assert get_video_index(video_path)["frames_ts"] == [i / fps for i in range(num_frames)]
+        frames = decode_video_frames_torchvision(
+            video_path, [i / fps for i in range(num_frames)], tol, image_dtype=torch.uint8
+        )
+        expected_values = torch.arange(num_frames) * 10 + episode_index
+        assert (frames.float().mean(dim=(1, 2, 3)) - expected_values).abs().max() < 2
+
+
+def test_stream_video_encoding_without_encoder(tmp_path):
+    """Checks that the recording fails before it starts when ffmpeg can't encode the videos while recording."""
+    with (
+        patch("lerobot.common.datasets.populate_dataset.is_ffmpeg_encoder_available", return_value=False),
+        pytest.raises(RuntimeError, match="requires `ffmpeg`"),
+    ):
+        init_dataset("user/repo", tmp_path, False, 10, True, True, 0, 1, stream_video_encoding=True)
+    assert not (tmp_path / "user/repo").exists()
+
+
+def test_stream_video_encoding_bounded_queue(tmp_path):
+    """Checks that adding a frame blocks while the queue of frames waiting to be encoded is full, and that the
+    queued frames are counted by the metrics."""
+    encoding = threading.Event()
+    resume_encoding = threading.Event()
+
+    class FfmpegProcess:
+        def __init__(self, cmd, stdin):
+            self.stdin = self
+            self.returncode = None
+
+        def write(self, data):
+            encoding.set()
+            resume_encoding.wait(timeout=10)
+
+        def close(self):
+            pass
+
+        def poll(self):
+            return self.returncode
+
+        def wait(self):
+            self.returncode = 0
+            return self.returncode
+
+        kill = wait
+
+    image = torch.zeros((48, 64, 3), dtype=torch.uint8)
+    with patch("lerobot.common.datasets.video_utils.subprocess.Popen", FfmpegProcess):
+        encoder = StreamingVideoEncoder(tmp_path / "video.mp4", 10, max_queued_frames=2)
+        encoder.add_frame(image)
+        assert encoding.wait(timeout=10)
+        encoder.add_frame(image)
+        encoder.add_frame(image)
+        assert get_video_encoders_metrics({"video_encoders": {"observation.image": encoder}}) == {
+            "num_pending": 2
+        }
+        add_thread = threading.Thread(target=encoder.add_frame, args=(image,))
+        add_thread.start()
+        add_thread.join(timeout=0.2)
+        assert add_thread.is_alive()
+        resume_encoding.set()
+        add_thread.join(timeout=10)
+        assert not add_thread.is_alive()
+        encoder.abort()
+    assert encoder.num_frames == 4
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="Requires setting the cpu affinity")
+def test_background_video_encoding(tmp_path):
+    """Checks that the videos of the recorded episodes are encoded in the background once all their images are
+    written, on the requested cpus."""
+    fps = 10
+    num_frames = 5
+    encoded = []
+
+    def encode_video_frames(imgs_dir, video_path, fps, overwrite):
+        assert sorted(p.name for p in imgs_dir.iterdir()) == [f"frame_{i:06d}.png" for i in range(num_frames)]
+        encoded.append((video_path.name, os.sched_getaffinity(0)))
+        video_path.touch()
+
+    dataset = init_dataset(
+        "user/repo",
+        tmp_path,
+        False,
+        fps,
+        True,
+        True,
+        0,
+        2,
+        num_video_encoding_workers=1,
+        max_pending_video_encodings=1,
+        video_encoding_cpus=[0],
+    )
+    with patch(
+        "lerobot.common.datasets.populate_dataset.encode_video_frames", side_effect=encode_video_frames
+    ):
+        for _ in range(3):
+            for i in range(num_frames):
+                image = torch.full((48, 64, 3), i, dtype=torch.uint8)
+                add_frame(dataset, {"observation.image": image}, {"action": torch.zeros(2)})
+            save_current_episode(dataset)
+            assert len(dataset["video_encoder"]["futures"]) <= 1
+        stop_image_writer(dataset["image_writer"], timeout=20)
+        stop_video_encoder(dataset["video_encoder"])
+
+    expected_names = [f"observation.image_episode_00000{i}.mp4" for i in range(3)]
+    assert sorted(name for name, _ in encoded) == [
+        name.replace(".mp4", ".tmp.mp4") for name in expected_names
+    ]
+    assert all(cpus == {0} for _, cpus in encoded)
+    assert sorted(p.name for p in dataset["videos_dir"].iterdir()) == expected_names
+
+
+def test_frame_ring_buffer():
+    """Checks that the slots of a ring buffer are reused once freed, and that the frames which don't fit are
+    counted as overruns."""
+    ring_buffer = FrameRingBuffer((4, 6, 3), num_slots=2)
+    images = [torch.full((4, 6, 3), i, dtype=torch.uint8) for i in range(3)]
+    shared_frames = [ring_buffer.put(image) for image in images]
+    assert [f.slot for f in shared_frames[:2]] == [0, 1]
+    assert shared_frames[2] is None
+    assert ring_buffer.put(torch.zeros(4, 6, 1, dtype=torch.uint8)) is None
+    assert ring_buffer.num_overruns == 2
+    assert ring_buffer.num_filled == 2
+
+    # the frames are read in place by other processes
+    other_ring_buffer = FrameRingBuffer.open(shared_frames[1])
+    assert torch.equal(other_ring_buffer.get(1), images[1])
+    other_ring_buffer.free(0)
+    assert ring_buffer.put(images[2]).slot == 0
+    assert torch.equal(other_ring_buffer.get(0), images[2])
+    # the frame is put once the next slot is freed, when waiting for it
+    threading.Timer(0.1, other_ring_buffer.free, args=(1,)).start()
+    assert ring_buffer.put(images[0], max_wait_s=10).slot == 1
+
+    path = ring_buffer.path
+    del ring_buffer
+    assert not path.exists()
+
+    # the ring buffer is created in the temporary directory when it doesn't fit in /dev/shm
+    with patch("lerobot.common.datasets.frame_ring_buffer.shutil.disk_usage") as disk_usage:
+        disk_usage.return_value.free = 100
+        ring_buffer = FrameRingBuffer((4, 6, 3), num_slots=2)
+    assert ring_buffer.path.parent == Path(tempfile.gettempdir())
+
+
+@pytest.mark.parametrize("has_shared_memory", [True, False])
+def test_image_writer_processes(tmp_path, has_shared_memory):
+    """Checks that the images sent to the image writer processes, through their ring buffers or pickled, are
+    all saved, including when there is no space for the ring buffers."""
+    image_writer = start_image_writer(num_processes=2, num_threads=2, num_ring_buffer_slots=4)
+    expected_images = {}
+    no_space = patch.object(FrameRingBuffer, "_get_dir", side_effect=RuntimeError("No space left."))
+    with contextlib.nullcontext() if has_shared_memory else no_space:
+        for frame_index in range(20):
+            for key, shape in [
+                ("observation.images.low", (48, 64, 3)),
+                ("observation.images.high", (24, 32, 3)),
+            ]:
+                if key == "observation.images.high" and frame_index == 10:
+                    # frames which don't have the shape of the ring buffer are pickled
+                    shape = (12, 16, 3)
+                image = torch.randint(0, 256, shape, dtype=torch.uint8)
+                async_save_image(image_writer, image, key, frame_index, 0, str(tmp_path))
+                expected_images[tmp_path / f"{key}_episode_000000" / f"frame_{frame_index:06d}.png"] = image
+    if not has_shared_memory:
+        # all the frames are pickled
+        assert list(image_writer["ring_buffers"].values()) == [None, None]
+    ring_buffer_paths = [
+        ring_buffer.path for ring_buffer in image_writer["ring_buffers"].values() if ring_buffer is not None
+    ]
+    stop_image_writer(image_writer, timeout=20)
+
+    metrics = get_image_writer_metrics(image_writer)
+    assert metrics["num_dropped"] == 0
+    assert not any(path.exists() for path in ring_buffer_paths)
+    for path, image in expected_images.items():
+        assert torch.equal(torch.from_numpy(np.array(Image.open(path))), image)
+
+
+@pytest.mark.parametrize("policy", ["block", "drop_oldest", "warn"])
+def test_image_writer_threads_policy(tmp_path, policy):
+    """Checks that the number of images waiting to be written by the image writer threads is bounded, or only
+    warned about, depending on the policy."""
+    is_writable = threading.Event()
+
+    def save_image(*args):
+        is_writable.wait()
+
+    max_pending_images = 3
+    image_writer = start_image_writer(
+        num_processes=0, num_threads=1, max_pending_images=max_pending_images, policy=policy
+    )
+    num_pending = []
+    with patch("lerobot.common.datasets.populate_dataset.save_image", side_effect=save_image):
+        if policy == "block":
+            # the writing of the images is unblocked while the control loop is blocked
+            threading.Timer(0.2, is_writable.set).start()
+        for frame_index in range(6):
+            image = torch.zeros(4, 6, 3, dtype=torch.uint8)
+            async_save_image(image_writer, image, "observation.image", frame_index, 0, str(tmp_path))
+            num_pending.append(get_image_writer_metrics(image_writer)["num_pending"])
+        is_writable.set()
+        stop_image_writer(image_writer, timeout=20)
+
+    metrics = get_image_writer_metrics(image_writer)
+    assert metrics["num_pending"] == 0
+    assert metrics["write_latency_s"] is not None
+    if policy == "warn":
+        assert num_pending == [1, 2, 3, 4, 5, 6]
+        assert metrics["num_dropped"] == 0
+    else:
+        assert max(num_pending) == max_pending_images
+        # the first image is being written, it can't be dropped
+        assert metrics["num_dropped"] == (3 if policy == "drop_oldest" else 0)
+
+
+@pytest.mark.parametrize("mode", ["images", "videos", "background_videos"])
+def test_image_writer_drop_oldest_fills_gaps(tmp_path, mode):
+    """Checks that the images dropped by the image writer are replaced by the previous frame of their episode,
+    in the image datasets and in the videos, encoded at the end of the recording or in the background."""
+    fps = 10
+    num_frames = 5
+    is_writable = threading.Event()
+    encoded_values = []
+
+    def blocking_save_image(*args):
+        is_writable.wait()
+        save_image(*args)
+
+    def encode_video_frames(imgs_dir, video_path, fps, overwrite):
+        paths = sorted(imgs_dir.iterdir())
+        assert [p.name for p in paths] == [f"frame_{i:06d}.png" for i in range(num_frames)]
+        encoded_values.extend(np.asarray(Image.open(p))[0, 0, 0].item() for p in paths)
+        video_path.touch()
+
+    dataset = init_dataset(
+        "user/repo",
+        tmp_path,
+        False,
+        fps,
+        mode != "images",
+        True,
+        0,
+        1,
+        max_pending_images=2,
+        image_writer_policy="drop_oldest",
+        num_video_encoding_workers=1 if mode == "background_videos" else 0,
+    )
+    with (
+        patch("lerobot.common.datasets.populate_dataset.save_image", side_effect=blocking_save_image),
+        patch(
+            "lerobot.common.datasets.populate_dataset.encode_video_frames", side_effect=encode_video_frames
+        ),
+    ):
+        # the first image is being written, so the next ones are dropped until the last one
+        for i in range(num_frames):
+            image = torch.full((8, 8, 3), 10 * i, dtype=torch.uint8)
+            add_frame(dataset, {"observation.image": image}, {"action": torch.zeros(2)})
+        save_current_episode(dataset)
+        is_writable.set()
+        stop_image_writer(dataset["image_writer"], timeout=20)
+        if mode == "background_videos":
+            stop_video_encoder(dataset["video_encoder"])
+        lerobot_dataset = from_dataset_to_lerobot_dataset(dataset, play_sounds=False)
+    assert get_image_writer_metrics(dataset["image_writer"])["num_dropped"] == num_frames - 2
+
+    # the frames 1 to 3 are copies of the frame 0
+    expected_values = [0, 0, 0, 0, 10 * (num_frames - 1)]
+    if mode == "images":
+        values = [
+            round(lerobot_dataset[i]["observation.image"][0, 0, 0].item() * 255) for i in range(num_frames)
+        ]
+        assert values == expected_values
+    else:
+        assert encoded_values == expected_values
+
+
+def test_episode_buffer_storage(tmp_path):
+    """Checks that the episodes recorded in columnar buffers are consolidated into the same dataset as the
+    episodes saved as `.pth` files by previous versions, which are still loaded."""
+    fps = 10
+    dataset = init_dataset("user/repo", tmp_path, False, fps, False, True, 0, 1)
+    ep_dicts = []
+    for episode_index, num_frames in enumerate([3, 2500, 7]):
+        ep_dict = {key: [] for key in ["observation.images.top", "observation.state", "action"]}
+        for frame_index in range(num_frames):
+            observation = {
+                "observation.images.top": torch.full((4, 6, 3), frame_index % 256, dtype=torch.uint8),
+                "observation.state": torch.rand(6),
+            }
+            action = {"action": torch.rand(6)}
+            add_frame(dataset, observation, action)
+            imgs_dir = dataset["videos_dir"] / f"observation.images.top_episode_{episode_index:06d}"
+            ep_dict["observation.images.top"].append(str(imgs_dir / f"frame_{frame_index:06d}.png"))
+            ep_dict["observation.state"].append(observation["observation.state"])
+            ep_dict["action"].append(action["action"])
+        save_current_episode(dataset)
+
+        ep_dict = {
+            key: torch.stack(value) if key != "observation.images.top" else value
+            for key, value in ep_dict.items()
+        }
+        ep_dict["episode_index"] = torch.full((num_frames,), episode_index)
+        ep_dict["frame_index"] = torch.arange(num_frames)
+        ep_dict["timestamp"] = torch.arange(num_frames) / fps
+        ep_dict["next.done"] = torch.arange(num_frames) == num_frames - 1
+        ep_dicts.append(ep_dict)
+    stop_image_writer(dataset["image_writer"], timeout=20)
+
+    # the first episode was saved by a previous version
+    (dataset["episodes_dir"] / "episode_0.arrow").unlink()
+    torch.save(ep_dicts[0], dataset["episodes_dir"] / "episode_0.pth")
+
+    lerobot_dataset = from_dataset_to_lerobot_dataset(dataset, play_sounds=False)
+    expected_hf_dataset = to_hf_dataset(concatenate_episodes(ep_dicts), video=False)
+    assert lerobot_dataset.hf_dataset.features == expected_hf_dataset.features
+    assert lerobot_dataset.hf_dataset.data.table.equals(expected_hf_dataset.data.table)
+    assert (dataset["episodes_dir"] / "episode_0.arrow").exists()
+    assert torch.equal(lerobot_dataset.episode_data_index["to"], torch.tensor([3, 2503, 2510]))
+    for idx in [0, 1500, 2509]:
+        item, expected_item = lerobot_dataset[idx], expected_hf_dataset[idx]
+        assert item.keys() == expected_item.keys()
+        for key in item:
+            assert torch.equal(item[key], expected_item[key])
+
+
 @pytest.mark.skip("Requires internet access")
 def test_create_branch():
     api = HfApi()
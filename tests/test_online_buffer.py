@@ -13,7 +13,9 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.d
+import multiprocessing
 from copy import deepcopy
+from pathlib import Path
 from uuid import uuid4
 
 import numpy as np
@@ -22,7 +24,11 @@ import torch
 from datasets import Dataset
 
 from lerobot.common.datasets.lerobot_dataset import LeRobotDataset
-from lerobot.common.datasets.online_buffer import OnlineBuffer, compute_sampler_weights
+from lerobot.common.datasets.online_buffer import (
+    ConcatDatasetWithOnlineBuffer,
+    OnlineBuffer,
+    compute_sampler_weights,
+)
 from lerobot.common.datasets.utils import hf_transform_to_torch
 
 # Some constants for OnlineBuffer tests.
@@ -156,6 +162,80 @@ def test_fifo():
         assert np.array_equal(item[data_key].numpy(), expected_data[data_key][i])
 
 
+@pytest.mark.parametrize("reload", [None, "r+", "legacy"])
+def test_num_samples_and_num_episodes(reload: str | None):
+    """Checks the number of samples and episodes in the buffer, including after reloading it from disk.
+
+    For "legacy", the buffer is reloaded without the memmaps of the number of samples and episodes, as written by
+    a previous version of the buffer.
+    """
+    buffer, write_dir = make_new_buffer()
+    assert len(buffer) == 0 and buffer.num_episodes == 0
+    buffer.add_data(make_spoof_data_frames(n_episodes=3, n_frames_per_episode=25))
+    assert len(buffer) == 75 and buffer.num_episodes == 3
+    # The first episode and the first 10 frames of the second episode are overwritten.
+    buffer.add_data(make_spoof_data_frames(n_episodes=1, n_frames_per_episode=60))
+    assert len(buffer) == buffer_capacity and buffer.num_episodes == 3
+
+    if reload is not None:
+        del buffer
+        if reload == "legacy":
+            (Path(write_dir) / OnlineBuffer.NUM_SAMPLES_KEY).unlink()
+            (Path(write_dir) / OnlineBuffer.NUM_EPISODES_KEY).unlink()
+        buffer, _ = make_new_buffer(write_dir)
+        assert len(buffer) == buffer_capacity and buffer.num_episodes == 3
+
+    buffer.add_data(make_spoof_data_frames(n_episodes=2, n_frames_per_episode=20))
+    assert len(buffer) == buffer_capacity and buffer.num_episodes == 3
+    assert len(buffer) == np.count_nonzero(buffer._data[OnlineBuffer.OCCUPANCY_MASK_KEY])
+    assert buffer.num_episodes == len(np.unique(buffer.get_data_by_key(OnlineBuffer.EPISODE_INDEX_KEY)))
+
+
+@pytest.mark.parametrize("codec", ["png", "jpeg"])
+def test_image_codec(codec: str):
+    """Checks that images stored with an image codec are decoded when read, including after wraparound."""
+    image_shape = (3, 16, 24)
+    buffer = OnlineBuffer(
+        f"/tmp/online_buffer_{uuid4().hex}",
+        data_spec={
+            "image": {"shape": image_shape, "dtype": np.dtype("float32"), "codec": codec},
+            data_key: {"shape": data_shape, "dtype": np.dtype("float32")},
+        },
+        buffer_capacity=buffer_capacity,
+        fps=fps,
+        delta_timestamps={"image": [-0.1, 0]},
+    )
+    # smooth images so that jpeg compression doesn't alter them much
+    images = []
+    for i in range(150):
+        grid = np.linspace(0, 1, image_shape[1] * image_shape[2]).reshape(image_shape[1:])
+        images.append(np.stack([grid, np.roll(grid, i, axis=1), np.full_like(grid, i / 150)]))
+    images = np.round(np.stack(images) * 255).astype(np.float32) / 255
+    new_data = make_spoof_data_frames(n_episodes=5, n_frames_per_episode=30)
+    new_data["image"] = images
+    buffer.add_data(new_data)
+
+    atol = 0 if codec == "png" else 0.1
+    for idx in [0, 7, 31, 99]:
+        index = buffer[idx]["index"].item()
+        item = buffer[idx]
+        assert item["image"].dtype == torch.float32
+        assert torch.allclose(item["image"][1], torch.from_numpy(images[index]), atol=atol)
+        assert torch.allclose(
+            item["image"][0], torch.from_numpy(images[max(index - 1, index // 30 * 30)]), atol=atol
+        )
+    batch = buffer.sample_batch([0, 7, 31, 99])
+    assert batch["image"].shape == (4, 2, *image_shape)
+    assert torch.equal(batch["image"][2], buffer[31]["image"])
+
+    with pytest.raises(ValueError):
+        OnlineBuffer(
+            f"/tmp/online_buffer_{uuid4().hex}",
+            data_spec={"image": {"shape": image_shape, "dtype": np.dtype("uint8"), "codec": "mp4"}},
+            buffer_capacity=buffer_capacity,
+        )
+
+
 def test_delta_timestamps_within_tolerance():
     """Check that getting an item with delta_timestamps within tolerance succeeds.
 
@@ -211,6 +291,133 @@ def test_delta_timestamps_outside_tolerance_outside_episode_range():
     ), "Padding does not match expected values"
 
 
+@pytest.mark.parametrize("do_reload", [False, True])
+def test_delta_timestamps_after_wraparound(do_reload: bool):
+    """Check that frames are retrieved within their episode when the oldest episodes were partially overwritten.
+
+    If do_reload we delete the buffer object and load the buffer back from disk before reading.
+    """
+    buffer, write_dir = make_new_buffer(delta_timestamps={"index": [-0.1, 0, 0.1]})
+    n_frames_per_episode = 30
+    buffer.add_data(make_spoof_data_frames(n_episodes=3, n_frames_per_episode=n_frames_per_episode))
+    buffer.add_data(make_spoof_data_frames(n_episodes=2, n_frames_per_episode=n_frames_per_episode))
+    # The first episode and the first 20 frames of the second episode were overwritten.
+    n_overwritten = 5 * n_frames_per_episode - buffer_capacity
+    if do_reload:
+        del buffer
+        buffer, _ = make_new_buffer(write_dir, delta_timestamps={"index": [-0.1, 0, 0.1]})
+
+    assert len(buffer) == buffer_capacity
+    for item in buffer:
+        index = item["index"][1].item()
+        episode_start = index // n_frames_per_episode * n_frames_per_episode
+        first_index = max(episode_start, n_overwritten)
+        last_index = episode_start + n_frames_per_episode - 1
+        query_index = index + torch.tensor([-1, 0, 1])
+        assert torch.equal(item["index"], query_index.clip(first_index, last_index))
+        assert torch.equal(item["index_is_pad"], (query_index < first_index) | (query_index > last_index))
+
+
+def _read_index_in_forked_reader(buffer: OnlineBuffer, data_added, items_queue):
+    data_added.wait()
+    try:
+        items_queue.put([buffer.num_episodes] + [buffer[idx]["index"].tolist() for idx in range(len(buffer))])
+    except Exception as e:
+        items_queue.put(repr(e))
+
+
+def test_delta_timestamps_in_forked_reader():
+    """Check that a process forked before data was added (like a DataLoader worker) reads the frames of the
+    episodes in the buffer once it wrapped around, and not the ones of its copy of the episode table."""
+    buffer, _ = make_new_buffer(delta_timestamps={"index": [-0.1, 0, 0.1]})
+    buffer.add_data(make_spoof_data_frames(n_episodes=2, n_frames_per_episode=2))
+    ctx = multiprocessing.get_context("fork")
+    data_added, items_queue = ctx.Event(), ctx.Queue()
+    reader = ctx.Process(target=_read_index_in_forked_reader, args=(buffer, data_added, items_queue))
+    reader.start()
+    # The buffer wraps around, and the first episodes are overwritten.
+    for _ in range(4):
+        buffer.add_data(make_spoof_data_frames(n_episodes=3, n_frames_per_episode=10))
+    data_added.set()
+    items = items_queue.get(timeout=30)
+    reader.join(timeout=30)
+    assert isinstance(items, list), items
+    num_episodes, *items = items
+    assert num_episodes == buffer.num_episodes == 10
+    assert len(items) == buffer_capacity
+    for idx, item in enumerate(items):
+        assert item == buffer[idx]["index"].tolist()
+
+
+def test_sample_batch():
+    """Check that sampling a batch gives the same result as stacking the items, including after wraparound."""
+    buffer, _ = make_new_buffer(delta_timestamps={"index": [-0.2, 0, 0.1], data_key: [-0.1, 0]})
+    buffer.add_data(make_spoof_data_frames(n_episodes=3, n_frames_per_episode=30))
+    buffer.add_data(make_spoof_data_frames(n_episodes=2, n_frames_per_episode=15))
+    indices = [0, 1, 9, 10, 42, 67, 89, 99, 55]
+    batch = buffer.sample_batch(indices)
+    expected_batch = torch.utils.data.default_collate([buffer[idx] for idx in indices])
+    assert batch.keys() == expected_batch.keys()
+    for k in expected_batch:
+        assert torch.equal(batch[k], expected_batch[k])
+    with pytest.raises(IndexError):
+        buffer.sample_batch([0, buffer_capacity])
+
+
+def test_concat_dataset_with_online_buffer():
+    offline_dataset = LeRobotDataset.from_preloaded(
+        hf_dataset=Dataset.from_dict({"index": list(range(6)), "timestamp": [0.0] * 6})
+    )
+    offline_dataset.hf_dataset.set_transform(hf_transform_to_torch)
+    online_dataset, _ = make_new_buffer()
+    online_dataset.add_data(make_spoof_data_frames(n_episodes=2, n_frames_per_episode=5))
+    concat_dataset = ConcatDatasetWithOnlineBuffer(offline_dataset, online_dataset)
+
+    dataloader = torch.utils.data.DataLoader(
+        concat_dataset,
+        batch_sampler=[[7, 1, 12, 3], [15, 8], [0, 5]],
+        collate_fn=torch.utils.data.default_convert,
+    )
+    batches = list(dataloader)
+    # The offline items come first, and only the keys common to both datasets are kept.
+    assert batches[0].keys() == {"index", "timestamp"}
+    assert torch.equal(batches[0]["index"], torch.tensor([1, 3, 1, 6]))
+    assert torch.equal(batches[1]["index"], torch.tensor([9, 2]))
+    assert data_key in batches[1]
+    assert torch.equal(batches[2]["index"], torch.tensor([0, 5]))
+
+
+def test_concat_dataset_with_online_buffer_in_workers():
+    """Check that the persistent DataLoader workers of the online training loop, forked before data is added to
+    the online buffer, sample the frames of the episodes in the buffer once it wrapped around."""
+    offline_dataset = LeRobotDataset.from_preloaded(
+        hf_dataset=Dataset.from_dict({"index": list(range(6)), "timestamp": [0.0] * 6})
+    )
+    offline_dataset.hf_dataset.set_transform(hf_transform_to_torch)
+    online_dataset, _ = make_new_buffer(delta_timestamps={"index": [-0.1, 0, 0.1]})
+    online_dataset.add_data(make_spoof_data_frames(n_episodes=2, n_frames_per_episode=2))
+    concat_dataset = ConcatDatasetWithOnlineBuffer(offline_dataset, online_dataset)
+    batch_sampler = [[6, 7], [8, 9]]
+    dataloader = torch.utils.data.DataLoader(
+        concat_dataset,
+        batch_sampler=batch_sampler,
+        num_workers=2,
+        collate_fn=torch.utils.data.default_convert,
+        multiprocessing_context="fork",
+        persistent_workers=True,
+    )
+    assert len(list(dataloader)) == 2
+
+    # The buffer wraps around, and the first episodes are overwritten.
+    for _ in range(4):
+        online_dataset.add_data(make_spoof_data_frames(n_episodes=3, n_frames_per_episode=10))
+    batch_sampler[:] = [list(range(6 + i, 6 + buffer_capacity, 10)) for i in range(10)]
+    for batch, indices in zip(dataloader, batch_sampler, strict=True):
+        expected_batch = online_dataset.sample_batch(np.array(indices) - 6)
+        assert torch.equal(batch["index"], expected_batch["index"])
+        assert torch.equal(batch["index_is_pad"], expected_batch["index_is_pad"])
+
+
 # Arbitrarily set small dataset sizes, making sure to have uneven sizes.
 @pytest.mark.parametrize("offline_dataset_size", [0, 6])
 @pytest.mark.parametrize("online_dataset_size", [0, 4])
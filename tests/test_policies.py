@@ -351,6 +351,20 @@ def test_normalize(insert_temporal_dim):
     unnormalize(output_batch)
 
 
+def test_normalize_uint8_images():
+    """Check that uint8 images are normalized like the same images in float32 and [0,1] range."""
+    shapes = {"observation.image": [3, 8, 8]}
+    modes = {"observation.image": "mean_std"}
+    stats = {"observation.image": {"mean": torch.rand(3, 1, 1), "std": torch.rand(3, 1, 1) + 0.1}}
+    normalize = Normalize(shapes, modes, stats=stats)
+
+    images = torch.randint(0, 256, (2, 3, 8, 8), dtype=torch.uint8)
+    normalized = normalize({"observation.image": images})["observation.image"]
+    expected = normalize({"observation.image": images.type(torch.float32) / 255})["observation.image"]
+    assert normalized.dtype == torch.float32
+    torch.testing.assert_close(normalized, expected)
+
+
 @pytest.mark.parametrize(
     "env_name, policy_name, extra_overrides, file_name_extra",
     [
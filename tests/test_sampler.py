@@ -13,9 +13,11 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import pytest
+import torch
 from datasets import Dataset
 
-from lerobot.common.datasets.sampler import EpisodeAwareSampler
+from lerobot.common.datasets.sampler import EpisodeAwareSampler, PrefetchSampler, WeightedEpisodeAwareSampler
 from lerobot.common.datasets.utils import (
     calculate_episode_data_index,
     hf_transform_to_torch,
@@ -88,3 +90,71 @@ def test_shuffle():
     assert sampler.indices == [0, 1, 2, 3, 4, 5]
     assert len(sampler) == 6
     assert set(sampler) == {0, 1, 2, 3, 4, 5}
+
+
+def test_weighted_sampler_mixture():
+    episode_data_indices = [
+        {"from": torch.tensor([0, 2, 3]), "to": torch.tensor([2, 3, 6])},
+        {"from": torch.tensor([0]), "to": torch.tensor([4])},
+    ]
+    sampler = WeightedEpisodeAwareSampler(episode_data_indices, drop_n_last_frames=1)
+    # the indices of the second dataset are offset by the size of the first one
+    assert len(sampler) == 6
+    assert set(sampler) <= {0, 3, 4, 6, 7, 8}
+
+    generator = torch.Generator().manual_seed(0)
+    sampler = WeightedEpisodeAwareSampler(
+        episode_data_indices,
+        dataset_weights=[3, 1],
+        episode_weights=[[1, 0, 0], None],
+        num_samples=20000,
+        generator=generator,
+    )
+    indices = torch.tensor(list(sampler))
+    assert set(indices.tolist()) == {0, 1, 6, 7, 8, 9}
+    # 3/4 of the samples from the first episode of the first dataset, uniformly over its frames
+    torch.testing.assert_close((indices < 6).double().mean().item(), 0.75, atol=0.02, rtol=0)
+    torch.testing.assert_close((indices == 0).double().mean().item(), 0.375, atol=0.02, rtol=0)
+
+
+def test_weighted_sampler_uniform_frames():
+    episode_data_indices = [{"from": torch.tensor([0, 1]), "to": torch.tensor([1, 10])}]
+    sampler = WeightedEpisodeAwareSampler(
+        episode_data_indices, num_samples=20000, generator=torch.Generator().manual_seed(0)
+    )
+    counts = torch.bincount(torch.tensor(list(sampler)), minlength=10)
+    torch.testing.assert_close(
+        counts.double() / 20000, torch.full((10,), 0.1, dtype=torch.float64), atol=0.01, rtol=0
+    )
+
+
+def test_weighted_sampler_no_frames():
+    episode_data_indices = [{"from": torch.tensor([0]), "to": torch.tensor([2])}]
+    with pytest.raises(ValueError):
+        WeightedEpisodeAwareSampler(episode_data_indices, drop_n_first_frames=2)
+
+
+def test_prefetch_sampler():
+    events = []
+
+    def sampler():
+        for i in range(7):
+            events.append(("sample", i))
+            yield i
+
+    prefetch_sampler = PrefetchSampler(sampler(), lambda indices: events.append(("prefetch", indices)), 3)
+    for i in prefetch_sampler:
+        events.append(("yield", i))
+    # each chunk of indices is prefetched before the previous chunk is yielded
+    assert [event for event in events if event[0] != "sample"] == [
+        ("prefetch", [0, 1, 2]),
+        ("prefetch", [3, 4, 5]),
+        ("yield", 0),
+        ("yield", 1),
+        ("yield", 2),
+        ("prefetch", [6]),
+        ("yield", 3),
+        ("yield", 4),
+        ("yield", 5),
+        ("yield", 6),
+    ]
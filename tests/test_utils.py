@@ -87,6 +87,32 @@ def test_reset_episode_index():
     assert dataset["episode_index"] == correct_episode_index
 
 
+def test_reset_episode_index_unsorted():
+    dataset = Dataset.from_dict(
+        {
+            "timestamp": [0.1, 0.2, 0.3, 0.4, 0.5, 0.6],
+            "index": [0, 1, 2, 3, 4, 5],
+            "episode_index": [7, 7, 3, 3, 12, 12],
+        },
+    )
+    dataset.set_transform(hf_transform_to_torch)
+    dataset = reset_episode_index(dataset)
+    assert dataset.column_names == ["timestamp", "index", "episode_index"]
+    assert dataset["episode_index"] == [1, 1, 0, 0, 2, 2]
+    assert isinstance(dataset[0]["episode_index"], torch.Tensor)
+
+
+def test_calculate_episode_data_index_cached():
+    dataset = Dataset.from_dict({"episode_index": [0, 0, 1, 1, 1]})
+    dataset.set_transform(hf_transform_to_torch)
+    episode_data_index = calculate_episode_data_index(dataset)
+    # the cached result is not shared with the caller
+    episode_data_index["from"] += 1
+    episode_data_index = calculate_episode_data_index(dataset)
+    assert torch.equal(episode_data_index["from"], torch.tensor([0, 2]))
+    assert torch.equal(episode_data_index["to"], torch.tensor([2, 5]))
+
+
 def test_init_hydra_config_empty():
     test_file = f"/tmp/test_init_hydra_config_empty_{uuid4().hex}.yaml"
     with open(test_file, "w") as f:
@@ -20,10 +20,13 @@ from copy import copy
 from functools import wraps
 from pathlib import Path
 
+import av
+import numpy as np
 import pytest
 import torch
 
 from lerobot import available_cameras, available_motors, available_robots
+from lerobot.common.datasets.video_utils import is_ffmpeg_encoder_available
 from lerobot.common.robot_devices.cameras.utils import Camera
 from lerobot.common.robot_devices.motors.utils import MotorsBus
 from lerobot.common.robot_devices.robots.factory import make_robot as make_robot_from_cfg
@@ -75,6 +78,27 @@ FEETECH_MOTORS = {
 }
 
 
+def make_spoof_video(video_path: str | Path, num_frames: int, fps: int, g: int = 2, height=48, width=64):
+    """Encode a small mp4 video where the pixels of frame `i` are all equal to `i` (modulo 256).
+
+    Returns the frames as a uint8 tensor of shape (num_frames, 3, height, width).
+    """
+    video_path = Path(video_path)
+    video_path.parent.mkdir(parents=True, exist_ok=True)
+    frames = np.zeros((num_frames, height, width, 3), dtype=np.uint8)
+    frames += (np.arange(num_frames) % 256).astype(np.uint8)[:, None, None, None]
+    with av.open(str(video_path), "w") as container:
+        stream = container.add_stream("mpeg4", rate=fps)
+        stream.width, stream.height = width, height
+        stream.pix_fmt = "yuv420p"
+        # disable scene change detection which inserts additional key frames
+        stream.options = {"g": str(g), "sc_threshold": "1000000000", "qscale": "1"}
+        for frame in frames:
+            container.mux(stream.encode(av.VideoFrame.from_ndarray(frame, format="rgb24")))
+        container.mux(stream.encode())
+    return torch.from_numpy(frames).permute(0, 3, 1, 2)
+
+
 def require_x86_64_kernel(func):
     """
     Decorator that skips the test if plateform device is not an x86_64 cpu.
@@ -197,6 +221,23 @@ def require_package(package_name):
     return decorator
 
 
+def require_ffmpeg_encoder(vcodec):
+    """
+    Decorator that skips the test if ffmpeg is not installed or doesn't support the video encoder `vcodec`.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_ffmpeg_encoder_available(vcodec):
+                pytest.skip(f"requires ffmpeg with the {vcodec} encoder")
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 def require_robot(func):
     """
     Decorator that skips the test if a robot is not available